@@ -0,0 +1,134 @@
+"""
+Measure WebSocket fan-out through BroadcastHub as the number of clients grows.
+
+Clients are in-process stand-ins for WebSockets, so the numbers show the cost of the hub
+itself: encoding once, queueing per client and the writer tasks. A share of the clients can
+be made to stall forever, to show that they no longer delay everybody else.
+
+Usage:
+    python benchmarks/broadcast_fanout.py --clients 10,100,1000,5000 --stalled 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# The hub loads the sensor models for the compact encoding; no database is used
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+from utils.broadcast import BroadcastHub
+
+
+class FakeWebSocket:
+    """Accepts frames like a WebSocket; a stalled one never finishes sending."""
+    def __init__(self, stalled: bool, expected: int, done: asyncio.Event, counter: list):
+        self.stalled = stalled
+        self.expected = expected
+        self.received = 0
+        self.done = done
+        self.counter = counter
+
+    scope = {"type": "websocket"}
+
+    async def accept(self, subprotocol: str | None = None):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, frame: str):
+        if self.stalled:
+            await asyncio.Event().wait()
+        await asyncio.sleep(0)
+        self.received += 1
+        if self.received == self.expected:
+            self.counter[0] -= 1
+            if self.counter[0] == 0:
+                self.done.set()
+
+
+def dashboard_delta(sensors: int):
+    return {
+        "type": "delta",
+        "version": 1,
+        "dashboard": {"online_sensors": sensors},
+        "sensors": [
+            {
+                "sensor_id": f"sensor_{index}",
+                "name": f"Sensor {index}",
+                "type": "temperature",
+                "location": f"Room {index % 10}",
+                "value": 21.5,
+                "unit": "°C",
+                "timestamp": "2024-01-01T00:00:00",
+                "status": "online",
+                "reliability_score": 0.8,
+                "data_variance": 0.2,
+                "update_frequency": 0.9,
+            }
+            for index in range(sensors)
+        ],
+    }
+
+
+async def run(clients: int, stalled_share: float, messages: int, sensors: int):
+    hub = BroadcastHub(f"bench-{clients}", overflow="disconnect")
+    done = asyncio.Event()
+    stalled = int(clients * stalled_share)
+    counter = [clients - stalled]
+
+    for index in range(clients):
+        await hub.connect(FakeWebSocket(index < stalled, messages, done, counter))
+
+    message = dashboard_delta(sensors)
+    publish_seconds = []
+    started = time.perf_counter()
+    for _ in range(messages):
+        hub.publish(message)
+        publish_seconds.append(hub.publish_seconds_last)
+        await asyncio.sleep(0)
+    await asyncio.wait_for(done.wait(), 60)
+    total = time.perf_counter() - started
+
+    stats = hub.stats()
+    for websocket in hub.active_connections:
+        hub.disconnect(websocket)
+
+    return {
+        "clients": clients,
+        "stalled_clients": stalled,
+        "messages": messages,
+        "message_bytes": len(json.dumps(message)),
+        "publish_ms_avg": round(sum(publish_seconds) / len(publish_seconds) * 1000, 3),
+        "all_delivered_ms": round(total * 1000, 3),
+        "delivery_p50_ms": stats["delivery_p50_ms"],
+        "delivery_p99_ms": stats["delivery_p99_ms"],
+        "dropped_clients": stats["dropped_clients"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="10,100,1000,5000", help="Comma-separated client counts")
+    parser.add_argument("--stalled", type=float, default=0.01, help="Share of clients that never read")
+    parser.add_argument("--messages", type=int, default=20, help="Messages published per run")
+    parser.add_argument("--sensors", type=int, default=20, help="Sensors per delta message")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for clients in (int(count) for count in args.clients.split(",")):
+        results.append(await run(clients, args.stalled, args.messages, args.sensors))
+        print(json.dumps(results[-1]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
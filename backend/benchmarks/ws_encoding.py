@@ -0,0 +1,98 @@
+"""
+Compare the WebSocket encodings on a dashboard snapshot: frame size and encode time.
+
+Each encoding of utils.encoding is measured as sent, and with the frame compressed the way
+permessage-deflate does it (raw deflate, level 6), which is negotiated by the WebSocket server
+and client when both offer it.
+
+Usage:
+    python benchmarks/ws_encoding.py --sensors 10000 --output ws_encoding.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# The encodings load the sensor models; no database is used
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+from models.sensor_data import SensorType, SensorStatus
+from utils.encoding import ENCODINGS, encode
+
+SENSOR_UNITS = {"temperature": "°C", "humidity": "%", "pressure": "hPa", "air_quality": "AQI"}
+
+
+def dashboard_snapshot(sensors: int):
+    generator = random.Random(0)
+    entries = []
+    for index in range(sensors):
+        sensor_type = generator.choice(list(SensorType)).value
+        entries.append({
+            "sensor_id": f"sensor_{index}",
+            "name": f"Sensor {index}",
+            "type": sensor_type,
+            "location": f"Room {index % 50}",
+            "value": round(generator.uniform(20, 100), 2),
+            "unit": SENSOR_UNITS[sensor_type],
+            "timestamp": f"2024-01-01T00:{index % 60:02d}:{generator.randrange(60):02d}.{generator.randrange(10 ** 6):06d}",
+            "status": generator.choices(list(SensorStatus), weights=[85, 5, 7, 3])[0].value,
+            "reliability_score": generator.random(),
+            "data_variance": generator.uniform(0, 50),
+            "update_frequency": generator.random(),
+        })
+    return {
+        "type": "snapshot",
+        "version": 1,
+        "dashboard": {"total_sensors": sensors, "online_sensors": 0, "warning_sensors": 0, "average_reliability": 0.5},
+        "sensors": entries,
+    }
+
+
+def deflate(frame):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def median_seconds(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2], result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, default=10000, help="Sensors in the snapshot")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per encoding")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    message = dashboard_snapshot(args.sensors)
+    results = []
+    for encoding in ENCODINGS:
+        encode_seconds, frame = median_seconds(lambda: encode(message, encoding), args.repeat)
+        data = frame.encode() if isinstance(frame, str) else frame
+        deflate_seconds, compressed = median_seconds(lambda: deflate(data), args.repeat)
+        results.append({
+            "encoding": encoding,
+            "bytes": len(data),
+            "encode_ms": round(encode_seconds * 1000, 3),
+            "deflated_bytes": len(compressed),
+            "deflate_ms": round(deflate_seconds * 1000, 3),
+        })
+        print(json.dumps(results[-1]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"sensors": args.sensors, "results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Move whole days of old readings from sensor_data to the cold tier (Arrow files in
+SENSOR_DATA_ARCHIVE_DIR), as the archiver of a running server does every
+SENSOR_DATA_ARCHIVE_INTERVAL seconds when SENSOR_DATA_ARCHIVE_AFTER_DAYS is set.
+
+Usage:
+    python archive_sensor_data.py --after-days 30
+    python archive_sensor_data.py --before 2024-01-01
+"""
+import argparse
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+
+# The controllers import from the routes, which have to be loaded first
+import routes  # noqa: F401
+from db import engine, AsyncSessionLocal
+from utils.archive import run_archiver
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--before", type=date.fromisoformat, help="Archive the days before this date (YYYY-MM-DD)")
+    group.add_argument("--after-days", type=int, help="Archive the days older than this many days")
+    args = parser.parse_args()
+
+    # Statement logging would flood the output
+    engine.echo = False
+    before = args.before or datetime.utcnow().date() - timedelta(days=args.after_days)
+
+    archived = await run_archiver(AsyncSessionLocal, before)
+    await engine.dispose()
+
+    print(json.dumps({"before": before.isoformat(), "archived": archived}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
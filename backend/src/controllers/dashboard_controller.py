@@ -1,33 +1,87 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.sql import func
-from models.sensor_data import SensorData
-from datetime import datetime, timedelta
+from sqlalchemy.sql import func, case
+from models.sensor_data import SensorStatus
+from models.sensor_latest import SensorLatest
+from utils.encoding import dumps
+import asyncio
+import hashlib
+import json
+import os
+import time
 
-async def get_total_sensors(db: AsyncSession):
-    """Get the total number of unique sensors."""
-    result = await db.execute(select(func.count(SensorData.sensor_id.distinct())))
-    return result.scalar()
+# How long cached dashboard metrics are served before they are recomputed (in milliseconds)
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL_MS", "1000")) / 1000
 
-async def get_online_sensors(db: AsyncSession):
-    """Get the number of sensors that are online."""
+async def calculate_dashboard_metrics(db: AsyncSession):
+    """Calculate all dashboard metrics with a single aggregate statement over sensor_latest."""
     result = await db.execute(
-        select(func.count(SensorData.sensor_id.distinct())).where(SensorData.status == "online")
+        select(
+            func.count(SensorLatest.id),
+            func.sum(case((SensorLatest.status == SensorStatus.ONLINE, 1), else_=0)),
+            func.sum(case((SensorLatest.status.in_([SensorStatus.WARNING, SensorStatus.ERROR]), 1), else_=0)),
+            func.avg(SensorLatest.reliability_score),
+        )
     )
-    return result.scalar()
+    total, online, warnings, reliability = result.one()
 
-async def get_warning_sensors(db: AsyncSession):
-    """Get the number of sensors with warnings/errors."""
-    result = await db.execute(
-        select(func.count(SensorData.sensor_id.distinct())).where(SensorData.status.in_(["warning", "error"]))
-    )
-    return result.scalar()
+    return {
+        "total_sensors": total,
+        "online_sensors": int(online or 0),
+        "warning_sensors": int(warnings or 0),
+        "average_reliability": round(reliability, 2) if reliability else 0.0,
+    }
 
-async def get_average_reliability(db: AsyncSession):
-    """Calculate the average reliability of sensors."""
-    # Example: Assume reliability is inversely proportional to the value of the sensor
-    result = await db.execute(
-        select(func.avg(SensorData.value)).where(SensorData.status == "online")
-    )
-    avg_reliability = result.scalar()
-    return round(avg_reliability, 2) if avg_reliability else 0.0
\ No newline at end of file
+class DashboardMetricsCache:
+    """
+    Short-TTL cache of the dashboard metrics, pre-encoded, with a content ETag.
+    The ingest path bumps the version, which invalidates the cached metrics immediately.
+    """
+    def __init__(self, ttl: float = DASHBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self._entry = None  # (version, expires_at, metrics, etag, body)
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Bump the version so the next request recomputes the metrics."""
+        self.version += 1
+
+    def _fresh_entry(self):
+        entry = self._entry
+        if entry and entry[0] == self.version and time.monotonic() < entry[1]:
+            return entry
+        return None
+
+    def current_etag(self):
+        """ETag of the cached metrics, or None when they have to be recomputed."""
+        entry = self._fresh_entry()
+        return entry[3] if entry else None
+
+    async def get_encoded(self, db: AsyncSession):
+        """Return `(body, etag)`, the metrics as an encoded JSON response body, recomputed at most once per TTL or version."""
+        entry = await self._entry_for(db)
+        return entry[4], entry[3]
+
+    async def _entry_for(self, db: AsyncSession):
+        entry = self._fresh_entry()
+        if entry is None:
+            async with self._lock:
+                # Concurrent requests wait for a single recomputation
+                entry = self._fresh_entry()
+                if entry is None:
+                    version = self.version
+                    metrics = await calculate_dashboard_metrics(db)
+                    body = json.dumps(metrics, sort_keys=True).encode()
+                    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                    entry = self._entry = (version, time.monotonic() + self.ttl, metrics, etag, dumps(metrics))
+        return entry
+
+dashboard_cache = DashboardMetricsCache()
+
+def etag_matches(if_none_match: str | None, etag: str | None):
+    """Check an If-None-Match header against an ETag."""
+    if not if_none_match or not etag:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
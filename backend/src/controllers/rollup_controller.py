@@ -0,0 +1,183 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models.sensor_data import SensorData
+from models.sensor_rollup import SensorRollup, SensorSeriesPointSchema, SensorSeriesSchema
+from fastapi import HTTPException
+from utils.archive import archived_days, archived_series
+from datetime import datetime, timezone
+import asyncio
+import heapq
+
+# Rollup resolutions and their bucket size in seconds, finest first
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+def bucket_start(timestamp: float, resolution: str):
+    """Start of the bucket holding an epoch timestamp, as a naive UTC datetime."""
+    seconds = RESOLUTIONS[resolution]
+    return datetime.fromtimestamp(timestamp - timestamp % seconds, timezone.utc).replace(tzinfo=None)
+
+def to_naive_utc(timestamp: datetime):
+    """Normalize a datetime to naive UTC, the way bucket starts are stored."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def choose_resolution(start: datetime, end: datetime, max_points: int):
+    """The finest rollup resolution that keeps the range within the point budget."""
+    span = (end - start).total_seconds()
+    for resolution, seconds in RESOLUTIONS.items():
+        if span / seconds <= max_points:
+            return resolution
+    return list(RESOLUTIONS)[-1]
+
+# Buckets written per multi-row upsert
+ROLLUP_CHUNK_SIZE = 1000
+
+def merge_rollups(db: AsyncSession):
+    """
+    Multi-row upsert merging new buckets into the stored ones in the database, so concurrent
+    writers of the same bucket add up instead of overwriting each other. None on databases
+    without one. The last value is assigned before the last timestamp, which MySQL requires
+    (it applies the assignments in order, the others against the old row).
+    """
+    table = SensorRollup.__table__
+    dialect = db.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        statement = (postgresql if dialect == "postgresql" else sqlite).insert(table)
+        new = statement.excluded
+        # SQLite's min() and max() take several arguments like least() and greatest()
+        least, greatest = (func.least, func.greatest) if dialect == "postgresql" else (func.min, func.max)
+    elif dialect == "mysql":
+        statement = mysql.insert(table)
+        new = statement.inserted
+        least, greatest = func.least, func.greatest
+    else:
+        return None
+
+    assignments = [
+        ("min", least(table.c.min, new.min)),
+        ("max", greatest(table.c.max, new.max)),
+        ("sum", table.c.sum + new.sum),
+        ("count", table.c.count + new.count),
+        ("last_value", case((new.last_timestamp >= table.c.last_timestamp, new.last_value), else_=table.c.last_value)),
+        ("last_timestamp", greatest(table.c.last_timestamp, new.last_timestamp)),
+    ]
+    if dialect == "mysql":
+        return statement.on_duplicate_key_update(assignments)
+    return statement.on_conflict_do_update(index_elements=["sensor_id", "resolution", "bucket_start"], set_=dict(assignments))
+
+async def update_rollups(readings_by_sensor: dict, db: AsyncSession):
+    """
+    Fold new readings into the 1m/1h/1d rollups of their sensors.
+    `readings_by_sensor` maps a sensor ID to its new `(epoch_seconds, value)` readings. Nothing is committed here.
+    """
+    # Aggregate the new readings per bucket first, so each bucket is written once
+    pending = {}
+    for sensor_id, readings in readings_by_sensor.items():
+        for timestamp, value in readings:
+            for resolution in RESOLUTIONS:
+                key = (sensor_id, resolution, bucket_start(timestamp, resolution))
+                bucket = pending.get(key)
+                if bucket is None:
+                    pending[key] = [value, value, value, 1, value, timestamp]
+                    continue
+                bucket[0] = min(bucket[0], value)
+                bucket[1] = max(bucket[1], value)
+                bucket[2] += value
+                bucket[3] += 1
+                if timestamp >= bucket[5]:
+                    bucket[4], bucket[5] = value, timestamp
+
+    rows = [
+        {
+            "sensor_id": sensor_id, "resolution": resolution, "bucket_start": start,
+            "min": low, "max": high, "sum": total, "count": count,
+            "last_value": last_value, "last_timestamp": last_timestamp,
+        }
+        for (sensor_id, resolution, start), (low, high, total, count, last_value, last_timestamp) in sorted(pending.items())
+    ]
+    statement = merge_rollups(db)
+    if statement is not None:
+        for chunk_start in range(0, len(rows), ROLLUP_CHUNK_SIZE):
+            await db.execute(statement.values(rows[chunk_start:chunk_start + ROLLUP_CHUNK_SIZE]))
+        return
+
+    # Other databases: read, merge and write back, with the buckets locked
+    result = await db.execute(
+        select(SensorRollup).where(
+            tuple_(SensorRollup.sensor_id, SensorRollup.resolution, SensorRollup.bucket_start).in_(list(pending))
+        ).with_for_update()
+    )
+    existing = {(r.sensor_id, r.resolution, r.bucket_start): r for r in result.scalars().all()}
+
+    for row in rows:
+        rollup = existing.get((row["sensor_id"], row["resolution"], row["bucket_start"]))
+        if rollup is None:
+            db.add(SensorRollup(**row))
+            continue
+
+        rollup.min = min(rollup.min, row["min"])
+        rollup.max = max(rollup.max, row["max"])
+        rollup.sum += row["sum"]
+        rollup.count += row["count"]
+        if row["last_timestamp"] >= rollup.last_timestamp:
+            rollup.last_value = row["last_value"]
+            rollup.last_timestamp = row["last_timestamp"]
+
+async def get_sensor_series(sensor_id: str, start: datetime, end: datetime, resolution: str, max_points: int, db: AsyncSession):
+    """
+    Fetch the readings of a sensor between two timestamps.
+    With `resolution="auto"` the finest rollup that fits the point budget is used; `"raw"` reads sensor_data.
+    """
+    start, end = to_naive_utc(start), to_naive_utc(end)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    if resolution == "auto":
+        resolution = choose_resolution(start, end, max_points)
+
+    if resolution == "raw":
+        result = await db.execute(
+            select(SensorData.timestamp, SensorData.value)
+            .where(SensorData.sensor_id == sensor_id)
+            .where(SensorData.timestamp >= start, SensorData.timestamp < end)
+            .order_by(SensorData.timestamp)
+            .limit(max_points)
+        )
+        readings = result.all()
+        if archived_days():
+            # Readings older than the hot tier were moved to the archive
+            archived = await asyncio.to_thread(archived_series, sensor_id, start, end, max_points)
+            readings = list(heapq.merge(archived, readings, key=lambda reading: to_naive_utc(reading[0])))[:max_points]
+        points = [
+            SensorSeriesPointSchema(timestamp=timestamp.isoformat(), min=value, max=value, avg=value, count=1, last=value)
+            for timestamp, value in readings
+        ]
+        return SensorSeriesSchema(sensor_id=sensor_id, resolution=resolution, points=points)
+
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown resolution '{resolution}'")
+
+    # Include the bucket that contains the start of the range
+    result = await db.execute(
+        select(SensorRollup)
+        .where(SensorRollup.sensor_id == sensor_id)
+        .where(SensorRollup.resolution == resolution)
+        .where(SensorRollup.bucket_start >= bucket_start(start.replace(tzinfo=timezone.utc).timestamp(), resolution))
+        .where(SensorRollup.bucket_start < end)
+        .order_by(SensorRollup.bucket_start)
+    )
+    points = [
+        SensorSeriesPointSchema(
+            timestamp=rollup.bucket_start.isoformat(),
+            min=rollup.min,
+            max=rollup.max,
+            avg=rollup.sum / rollup.count,
+            count=rollup.count,
+            last=rollup.last_value,
+        )
+        for rollup in result.scalars().all()
+    ]
+    return SensorSeriesSchema(sensor_id=sensor_id, resolution=resolution, points=points)
@@ -1,10 +1,28 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import insert, or_, and_, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from models.sensor_data import SensorData, SensorDataSchema
-from models.sensor_reliability import SensorReliability
+from models.sensor_reliability import SensorReliability, SensorStatistics
+from models.sensor_latest import SensorLatest
 from fastapi import HTTPException
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from db import AsyncSessionLocal
+import asyncio
+import base64
+import heapq
+import itertools
+import json
+import os
 from routes.websocket_routes import notify_clients
+from controllers.dashboard_controller import dashboard_cache
+from controllers.rollup_controller import update_rollups
+from utils.sensor_state import combine_sensor_data, READING_COLUMNS
+from utils.metrics import INGEST_STAGE_SECONDS, INGEST_READINGS
+from utils.encoding import dumps
+from utils.reading_window import ReadingWindow
+from utils.archive import scan_archive, archived_days, archived_series, naive_utc
 
 # Variance Calculation
 def calculate_variance(measurements):
@@ -33,74 +51,599 @@ def calculate_reliability_score(variance_score, frequency_score, weights=(0.5, 0
     alpha, beta = weights
     return alpha * variance_score + beta * frequency_score
 
-async def create_sensor_data(sensor_data: SensorDataSchema, db: AsyncSession):
-    """Insert new sensor data into the database, calculate reliability metrics, and notify WebSocket clients."""
-    # Check if a record with the same sensor_id already exists
-    result = await db.execute(select(SensorData).where(SensorData.sensor_id == sensor_data.sensor_id))
-    existing_sensor = result.scalars().first()
+# Expected time between two readings of a sensor in seconds (600 seconds = 10 minutes)
+EXPECTED_INTERVAL = float(os.getenv("RELIABILITY_EXPECTED_INTERVAL", "600"))
 
-    # if existing_sensor:
-    #     raise HTTPException(
-    #         status_code=400,
-    #         detail=f"Sensor with ID '{sensor_data.sensor_id}' already exists."
-    #     )
+# Weights of interval ratio, consistency and completeness in the update frequency score,
+# and of the variance and update frequency scores in the reliability score.
+# After changing any of these, rescore every sensor with recompute_reliability.py.
+FREQUENCY_WEIGHTS = tuple(float(weight) for weight in os.getenv("RELIABILITY_FREQUENCY_WEIGHTS", "0.3,0.3,0.4").split(","))
+RELIABILITY_WEIGHTS = tuple(float(weight) for weight in os.getenv("RELIABILITY_WEIGHTS", "0.5,0.5").split(","))
 
-    # Create a new sensor record
-    new_sensor = SensorData(**sensor_data.dict())
-    db.add(new_sensor)
-    await db.commit()
-    await db.refresh(new_sensor)  # Refresh to get the auto-generated ID
-
-    # Fetch all historical data for the sensor
-    historical_query = select(SensorData).where(SensorData.sensor_id == sensor_data.sensor_id).order_by(SensorData.timestamp)
-    historical_result = await db.execute(historical_query)
-    historical_data = historical_result.scalars().all()
-
-    # Extract measurements and timestamps
-    measurements = [data.value for data in historical_data]
-    timestamps = [data.timestamp for data in historical_data]
-
-    # Calculate variance
-    variance = calculate_variance(measurements)
-
-    # Calculate update frequency score (assuming expected interval is 600 seconds = 10 minutes)
-    expected_interval = 600
-    update_frequency_score = calculate_update_frequency_score(timestamps, expected_interval)
-
-    # Calculate reliability score
-    variance_score = 1 - (variance / max(variance, 1))  # Normalize variance score
-    reliability_score = calculate_reliability_score(variance_score, update_frequency_score)
-
-    # Update or insert into the sensor_reliability table
-    reliability_query = select(SensorReliability).where(SensorReliability.sensor_id == sensor_data.sensor_id)
-    reliability_result = await db.execute(reliability_query)
-    existing_reliability = reliability_result.scalars().first()
-
-    if existing_reliability:
-        # Update existing record
-        existing_reliability.variance = variance
-        existing_reliability.update_frequency = update_frequency_score
-        existing_reliability.score = reliability_score
-        existing_reliability.last_updated = datetime.utcnow()
+# Score sensors on their last N readings and/or the readings of their last T minutes instead of
+# their whole lifetime, so old problems stop counting. Unset (0), the lifetime is scored.
+RELIABILITY_WINDOW_READINGS = int(os.getenv("RELIABILITY_WINDOW_READINGS", "0"))
+RELIABILITY_WINDOW_SECONDS = float(os.getenv("RELIABILITY_WINDOW_MINUTES", "0")) * 60
+
+# Most readings kept in memory per sensor for a window of T minutes only
+RELIABILITY_WINDOW_MAX_READINGS = int(os.getenv("RELIABILITY_WINDOW_MAX_READINGS", "1000"))
+
+# Reading window per sensor ID, loaded from the database on first use
+reading_windows: dict[str, ReadingWindow] = {}
+
+def to_epoch_seconds(timestamp):
+    """Convert a reading timestamp to epoch seconds, treating naive datetimes as UTC."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+# Welford's online update of count, mean and sum of squared deviations (M2)
+def welford_update(count, mean, m2, x):
+    count += 1
+    delta = x - mean
+    mean += delta / count
+    m2 += delta * (x - mean)
+    return count, mean, m2
+
+def new_sensor_statistics(sensor_id):
+    """Create an empty running statistics row for a sensor."""
+    return SensorStatistics(
+        sensor_id=sensor_id,
+        count=0,
+        value_mean=0.0,
+        value_m2=0.0,
+        interval_count=0,
+        interval_mean=0.0,
+        interval_m2=0.0,
+        last_timestamp=None,
+    )
+
+def update_sensor_statistics(stats, value, timestamp):
+    """
+    Fold one reading (value, epoch seconds) into the running statistics in constant time.
+    Readings must come in time order: a reading older than `stats.last_timestamp` would add a
+    negative interval, so late readings go through `rebuild_sensor_statistics` instead.
+    """
+    stats.count, stats.value_mean, stats.value_m2 = welford_update(
+        stats.count, stats.value_mean, stats.value_m2, value
+    )
+    if stats.last_timestamp is not None:
+        interval = timestamp - stats.last_timestamp
+        stats.interval_count, stats.interval_mean, stats.interval_m2 = welford_update(
+            stats.interval_count, stats.interval_mean, stats.interval_m2, interval
+        )
+    stats.last_timestamp = timestamp
+    return stats
+
+# Variance from running statistics, equivalent to calculate_variance over the full history
+def calculate_variance_from_statistics(count, m2):
+    if count <= 1:
+        return 0.0
+    return max(m2, 0.0) / count
+
+# Update frequency score from running statistics, equivalent to calculate_update_frequency_score
+def calculate_update_frequency_score_from_statistics(count, interval_count, interval_mean, interval_m2, expected_interval, weights=(0.3, 0.3, 0.4)):
+    if count <= 1 or interval_count == 0:
+        return 0.0
+    mean_interval = interval_mean
+    interval_ratio = min(mean_interval, expected_interval) / max(mean_interval, expected_interval)
+    std_dev = (max(interval_m2, 0.0) / interval_count) ** 0.5
+    consistency = max(0, 1 - (std_dev / mean_interval)) if mean_interval > 0 else 0
+    # The intervals telescope, so their sum is the time between the first and the latest reading
+    total_duration = interval_mean * interval_count
+    expected_updates = total_duration / expected_interval
+    missing_ratio = max(0, min(1, 1 - (count / expected_updates))) if expected_updates > 0 else 0
+    w1, w2, w3 = weights
+    return w1 * interval_ratio + w2 * consistency + w3 * (1 - missing_ratio)
+
+async def rebuild_sensor_statistics(sensor_id: str, db: AsyncSession, stats: SensorStatistics | None = None):
+    """
+    Build running statistics from the stored history, cold tier included: for sensors that predate
+    the statistics table, or into `stats` (reset first) when a late reading changed the intervals
+    of a sensor.
+    """
+    if stats is None:
+        stats = new_sensor_statistics(sensor_id)
+    else:
+        stats.count, stats.value_mean, stats.value_m2 = 0, 0.0, 0.0
+        stats.interval_count, stats.interval_mean, stats.interval_m2 = 0, 0.0, 0.0
+        stats.last_timestamp = None
+    result = await db.execute(
+        select(SensorData.timestamp, SensorData.value)
+        .where(SensorData.sensor_id == sensor_id)
+        .order_by(SensorData.timestamp)
+    )
+    history = [(to_epoch_seconds(timestamp), value) for timestamp, value in result]
+    if archived_days():
+        archived = await asyncio.to_thread(archived_series, sensor_id)
+        history = heapq.merge([(to_epoch_seconds(timestamp), value) for timestamp, value in archived], history)
+    for timestamp, value in history:
+        update_sensor_statistics(stats, value, timestamp)
+    return stats
+
+def reliability_window_enabled():
+    return bool(RELIABILITY_WINDOW_READINGS or RELIABILITY_WINDOW_SECONDS)
+
+async def update_reading_window(sensor_id: str, readings: list, previous_count: int | None, count: int, db: AsyncSession):
+    """
+    Add new `(epoch_seconds, value)` readings, already flushed, to the window of a sensor.
+    The window is (re)loaded from the newest stored readings, from the cold tier too when
+    sensor_data has fewer than it holds, when this worker has none yet or when
+    `previous_count`, the lifetime count before these readings, shows it missed some.
+    """
+    window = reading_windows.get(sensor_id)
+    if window is not None and previous_count is not None and window.seen == previous_count:
+        for timestamp, value in readings:
+            window.add(timestamp, value)
     else:
-        # Insert new record
-        new_reliability = SensorReliability(
-            sensor_id=sensor_data.sensor_id,
-            variance=variance,
-            update_frequency=update_frequency_score,
-            score=reliability_score,
-            last_updated=datetime.utcnow()
+        window = ReadingWindow(RELIABILITY_WINDOW_READINGS or RELIABILITY_WINDOW_MAX_READINGS, RELIABILITY_WINDOW_SECONDS)
+        history = await db.execute(
+            select(SensorData.timestamp, SensorData.value)
+            .where(SensorData.sensor_id == sensor_id)
+            .order_by(SensorData.timestamp.desc())
+            .limit(window.capacity)
         )
-        db.add(new_reliability)
+        rows = history.all()[::-1]
+        if len(rows) < window.capacity and archived_days():
+            # The older readings of the window may have been moved to the cold tier
+            start = datetime.fromtimestamp(to_epoch_seconds(rows[-1][0]) - window.seconds, timezone.utc) if rows and window.seconds else None
+            archived = await asyncio.to_thread(archived_series, sensor_id, start)
+            rows = list(heapq.merge(archived, rows, key=lambda row: naive_utc(row[0])))[-window.capacity:]
+        window.fill([to_epoch_seconds(timestamp) for timestamp, _ in rows], [value for _, value in rows])
+        reading_windows[sensor_id] = window
+    window.seen = count
+    return window
 
-    await db.commit()
+def reading_timestamp(sensor_data: SensorDataSchema):
+    """Timestamp of a reading: the one sent by the producer, or the time of arrival."""
+    if sensor_data.timestamp:
+        return datetime.fromisoformat(sensor_data.timestamp)
+    return datetime.utcnow()
 
-    # Notify WebSocket clients
-    await notify_clients(db)
+async def lock_sensor_statistics(sensor_ids: list, db: AsyncSession):
+    """The statistics rows of the given sensors, locked (SELECT ... FOR UPDATE) in sensor order."""
+    result = await db.execute(
+        select(SensorStatistics)
+        .where(SensorStatistics.sensor_id.in_(sensor_ids))
+        .order_by(SensorStatistics.sensor_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    return {stats.sensor_id: stats for stats in result.scalars().all()}
+
+async def update_sensor_reliability(readings_by_sensor: dict, db: AsyncSession):
+    """
+    Fold new readings into the running statistics and rescore each affected sensor once.
+
+    `readings_by_sensor` maps a sensor ID to its new `(epoch_seconds, value)` readings, which must
+    already be flushed to the session. Nothing is committed here.
+    """
+    sensor_ids = sorted(readings_by_sensor)
+
+    # The statistics rows are locked until the commit, so concurrent writers of the same sensors
+    # (HTTP requests, queue writers, workers) fold their readings in one after the other instead
+    # of overwriting each other. New sensors get an empty row first, for all writers to lock.
+    all_stats = await lock_sensor_statistics(sensor_ids, db)
+    missing = [sensor_id for sensor_id in sensor_ids if sensor_id not in all_stats]
+    if missing:
+        await db.execute(insert_ignoring_duplicates(SensorStatistics, db, "sensor_id").values([
+            {column.name: getattr(new_sensor_statistics(sensor_id), column.name) for column in SensorStatistics.__table__.columns if column.name != "id"}
+            for sensor_id in missing
+        ]))
+        all_stats.update(await lock_sensor_statistics(missing, db))
+
+    # Read once the statistics are locked, so a row inserted by the writer before is seen
+    reliability_result = await db.execute(select(SensorReliability).where(SensorReliability.sensor_id.in_(sensor_ids)))
+    all_reliability = {r.sensor_id: r for r in reliability_result.scalars().all()}
+
+    for sensor_id, readings in readings_by_sensor.items():
+        readings = sorted(readings, key=lambda reading: reading[0])
+        stats = all_stats[sensor_id]
+        previous_count = stats.count or None
+        if not stats.count or (stats.last_timestamp is not None and readings[0][0] < stats.last_timestamp):
+            # A new sensor, or a late reading splitting an interval already folded in: the
+            # statistics are built from the history, which holds the flushed readings already
+            await rebuild_sensor_statistics(sensor_id, db, stats)
+        else:
+            for timestamp, value in readings:
+                update_sensor_statistics(stats, value, timestamp)
+
+        # The lifetime statistics are kept either way, the score comes from the window if one is set
+        if reliability_window_enabled():
+            window = await update_reading_window(sensor_id, readings, previous_count, stats.count, db)
+            count, value_m2, interval_count, interval_mean, interval_m2 = window.statistics()
+        else:
+            count, value_m2 = stats.count, stats.value_m2
+            interval_count, interval_mean, interval_m2 = stats.interval_count, stats.interval_mean, stats.interval_m2
+
+        # Calculate variance
+        variance = calculate_variance_from_statistics(count, value_m2)
+
+        # Calculate update frequency score
+        update_frequency_score = calculate_update_frequency_score_from_statistics(
+            count, interval_count, interval_mean, interval_m2, EXPECTED_INTERVAL, FREQUENCY_WEIGHTS
+        )
+
+        # Calculate reliability score
+        variance_score = 1 - (variance / max(variance, 1))  # Normalize variance score
+        reliability_score = calculate_reliability_score(variance_score, update_frequency_score, RELIABILITY_WEIGHTS)
+
+        # Update or insert into the sensor_reliability table
+        existing_reliability = all_reliability.get(sensor_id)
+        if existing_reliability:
+            # Update existing record
+            existing_reliability.variance = variance
+            existing_reliability.update_frequency = update_frequency_score
+            existing_reliability.score = reliability_score
+            existing_reliability.last_updated = datetime.utcnow()
+        else:
+            # Insert new record
+            new_reliability = SensorReliability(
+                sensor_id=sensor_id,
+                variance=variance,
+                update_frequency=update_frequency_score,
+                score=reliability_score,
+                last_updated=datetime.utcnow()
+            )
+            db.add(new_reliability)
+            all_reliability[sensor_id] = new_reliability
+
+    return all_reliability
+
+async def update_sensor_latest(latest_readings: dict, all_reliability: dict, db: AsyncSession):
+    """
+    Upsert the sensor_latest rows of the given sensors from their newest reading and reliability.
+    Returns the dashboard entries of the changed sensors. Nothing is committed here.
+    """
+    latest_result = await db.execute(select(SensorLatest).where(SensorLatest.sensor_id.in_(list(latest_readings))))
+    all_latest = {latest.sensor_id: latest for latest in latest_result.scalars().all()}
+
+    changed_sensors = []
+    for sensor_id, reading in latest_readings.items():
+        reliability = all_reliability.get(sensor_id)
+        latest = all_latest.get(sensor_id)
+        if latest is None:
+            latest = SensorLatest(sensor_id=sensor_id)
+            db.add(latest)
+        elif to_epoch_seconds(latest.timestamp) > to_epoch_seconds(reading["timestamp"]):
+            # A late reading only changes the reliability of the sensor
+            reading = {column: getattr(latest, column) for column in READING_COLUMNS}
+
+        for column in READING_COLUMNS:
+            setattr(latest, column, reading[column])
+        latest.reliability_score = reliability.score if reliability else None
+        latest.data_variance = reliability.variance if reliability else None
+        latest.update_frequency = reliability.update_frequency if reliability else None
+
+        changed_sensors.append(combine_sensor_data(reading, reliability))
+
+    return changed_sensors
+
+async def create_sensor_data(sensor_data: SensorDataSchema, db: AsyncSession):
+    """
+    Insert new sensor data into the database, calculate reliability metrics, and notify WebSocket clients.
+    A reading with a (sensor_id, seq) that is already stored is not written again; the stored one is returned.
+    """
+    if sensor_data.seq is not None:
+        stored = await find_stored_reading(sensor_data, db)
+        if stored:
+            return stored
+
+    # Create a new sensor record
+    with INGEST_STAGE_SECONDS.time(path="single", stage="insert"):
+        new_sensor = SensorData(**{**sensor_data.dict(), "timestamp": reading_timestamp(sensor_data)})
+        db.add(new_sensor)
+        try:
+            await db.flush()  # Flush to get the auto-generated ID
+        except IntegrityError:
+            # The same reading was stored concurrently (e.g. a retransmit racing the first send)
+            await db.rollback()
+            stored = await find_stored_reading(sensor_data, db) if sensor_data.seq is not None else None
+            if stored is None:
+                raise
+            return stored
+
+    readings_by_sensor = {new_sensor.sensor_id: [(to_epoch_seconds(new_sensor.timestamp), new_sensor.value)]}
+    with INGEST_STAGE_SECONDS.time(path="single", stage="reliability"):
+        all_reliability = await update_sensor_reliability(readings_by_sensor, db)
+    with INGEST_STAGE_SECONDS.time(path="single", stage="rollup"):
+        await update_rollups(readings_by_sensor, db)
+
+    with INGEST_STAGE_SECONDS.time(path="single", stage="latest"):
+        reading = {column: getattr(new_sensor, column) for column in READING_COLUMNS}
+        changed_sensors = await update_sensor_latest({new_sensor.sensor_id: reading}, all_reliability, db)
+
+    # Persist the reading, its reliability, rollups and latest state in a single commit
+    with INGEST_STAGE_SECONDS.time(path="single", stage="commit"):
+        await db.commit()
+    INGEST_READINGS.inc(path="single")
+
+    dashboard_cache.invalidate()
+
+    # Update the in-memory latest state and notify WebSocket clients, on every worker
+    with INGEST_STAGE_SECONDS.time(path="single", stage="broadcast"):
+        await notify_clients(changed_sensors)
 
     return new_sensor
 
-async def get_sensor_data(db: AsyncSession):
-    """Fetch all sensor data from the database."""
-    result = await db.execute(select(SensorData))
-    return result.scalars().all()
\ No newline at end of file
+async def find_stored_reading(sensor_data: SensorDataSchema, db: AsyncSession):
+    """The stored reading with the (sensor_id, seq) of `sensor_data`, if any."""
+    result = await db.execute(
+        select(SensorData).where(SensorData.sensor_id == sensor_data.sensor_id, SensorData.seq == sensor_data.seq)
+    )
+    return result.scalars().first()
+
+# Maximum number of rows sent in one multi-row INSERT statement
+INSERT_CHUNK_SIZE = 1000
+
+async def find_stored_readings(pairs: set, db: AsyncSession):
+    """
+    The (sensor_id, seq) pairs among `pairs` that are already stored in sensor_data. The cold
+    tier keeps no seq, so a retransmit of a reading that was archived meanwhile is stored again.
+    """
+    pairs = list(pairs)
+    stored = set()
+    for start in range(0, len(pairs), INSERT_CHUNK_SIZE):
+        result = await db.execute(
+            select(SensorData.sensor_id, SensorData.seq)
+            .where(tuple_(SensorData.sensor_id, SensorData.seq).in_(pairs[start:start + INSERT_CHUNK_SIZE]))
+        )
+        stored.update(tuple(row) for row in result)
+    return stored
+
+def insert_ignoring_duplicates(model, db: AsyncSession, key: str):
+    """
+    INSERT into the table of `model` that skips rows conflicting with one already stored. On
+    MySQL the conflict sets `key` to itself: INSERT IGNORE would also turn data errors (NULL
+    into NOT NULL, strings too long) into warnings and store the coerced rows.
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect == "mysql":
+        statement = mysql.insert(model)
+        return statement.on_duplicate_key_update({key: getattr(statement.inserted, key)})
+    return insert(model)
+
+# MySQL error code of a duplicate key
+MYSQL_DUPLICATE_KEY = 1062
+
+async def insert_new_readings(rows: list[dict], db: AsyncSession):
+    """
+    Insert sequenced readings into sensor_data, skipping those whose (sensor_id, seq) is
+    already stored, and return the (sensor_id, seq) pairs actually inserted. Stored readings
+    are filtered out before, so a conflict here is a retransmit written concurrently by
+    another writer, which is folded in and broadcast by that writer only.
+    """
+    dialect = db.bind.dialect.name
+    inserted = set()
+    if dialect in ("postgresql", "sqlite"):
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            result = await db.execute(
+                insert_ignoring_duplicates(SensorData, db, "seq")
+                .values(rows[start:start + INSERT_CHUNK_SIZE])
+                .returning(SensorData.sensor_id, SensorData.seq)
+            )
+            inserted.update(tuple(row) for row in result)
+        return inserted
+
+    # Without RETURNING (MySQL), row by row, each in a savepoint undone on a duplicate key only
+    for row in rows:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(SensorData).values(row))
+        except IntegrityError as e:
+            if dialect != "mysql" or e.orig.args[0] != MYSQL_DUPLICATE_KEY:
+                raise
+            continue
+        inserted.add((row["sensor_id"], row["seq"]))
+    return inserted
+
+async def create_sensor_data_batch(batch: list[SensorDataSchema], db: AsyncSession):
+    """
+    Insert a batch of sensor readings with multi-row inserts and a single commit.
+    Reliability is recomputed once per affected sensor and WebSocket clients are notified once.
+    Readings whose (sensor_id, seq) is already stored, or repeated in the batch, are skipped,
+    so a producer can retransmit readings it has no ack for. Returns the rows written.
+    """
+    sequenced = {(sensor_data.sensor_id, sensor_data.seq) for sensor_data in batch if sensor_data.seq is not None}
+    seen = await find_stored_readings(sequenced, db) if sequenced else set()
+
+    rows = []
+    for sensor_data in batch:
+        if sensor_data.seq is not None:
+            if (sensor_data.sensor_id, sensor_data.seq) in seen:
+                continue
+            seen.add((sensor_data.sensor_id, sensor_data.seq))
+        row = sensor_data.dict(exclude={"id"})
+        row["timestamp"] = reading_timestamp(sensor_data)
+        rows.append(row)
+
+    if not rows:
+        return rows
+
+    with INGEST_STAGE_SECONDS.time(path="batch", stage="insert"):
+        # Readings without a seq cannot conflict and are inserted as they are
+        unsequenced = [row for row in rows if row["seq"] is None]
+        for start in range(0, len(unsequenced), INSERT_CHUNK_SIZE):
+            await db.execute(insert(SensorData).values(unsequenced[start:start + INSERT_CHUNK_SIZE]))
+        if len(unsequenced) < len(rows):
+            inserted = await insert_new_readings([row for row in rows if row["seq"] is not None], db)
+            rows = [row for row in rows if row["seq"] is None or (row["sensor_id"], row["seq"]) in inserted]
+            if not rows:
+                return rows
+
+    readings_by_sensor = {}
+    for row in rows:
+        readings_by_sensor.setdefault(row["sensor_id"], []).append((to_epoch_seconds(row["timestamp"]), row["value"]))
+
+    with INGEST_STAGE_SECONDS.time(path="batch", stage="reliability"):
+        all_reliability = await update_sensor_reliability(readings_by_sensor, db)
+    with INGEST_STAGE_SECONDS.time(path="batch", stage="rollup"):
+        await update_rollups(readings_by_sensor, db)
+
+    with INGEST_STAGE_SECONDS.time(path="batch", stage="latest"):
+        # Newest reading of every sensor in the batch
+        latest_rows = {}
+        for row in rows:
+            latest = latest_rows.get(row["sensor_id"])
+            if latest is None or to_epoch_seconds(row["timestamp"]) >= to_epoch_seconds(latest["timestamp"]):
+                latest_rows[row["sensor_id"]] = row
+        changed_sensors = await update_sensor_latest(latest_rows, all_reliability, db)
+
+    # Persist the readings, their reliability, rollups and latest state in a single commit
+    with INGEST_STAGE_SECONDS.time(path="batch", stage="commit"):
+        await db.commit()
+    INGEST_READINGS.inc(len(rows), path="batch")
+
+    dashboard_cache.invalidate()
+
+    # Update the in-memory latest state and notify WebSocket clients once per changed sensor, on every worker
+    with INGEST_STAGE_SECONDS.time(path="batch", stage="broadcast"):
+        await notify_clients(changed_sensors)
+
+    return rows
+
+# Default and maximum number of readings per page of GET /sensor_data/
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# Rows fetched per round trip when streaming with a server-side cursor
+STREAM_CHUNK_SIZE = 1000
+
+def encode_cursor(timestamp: datetime, id: int):
+    """Opaque cursor pointing after the reading with this (timestamp, id)."""
+    return base64.urlsafe_b64encode(json.dumps([timestamp.isoformat(), id]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def filter_sensor_data(query, filters: dict, cursor: str | None = None):
+    """
+    Apply the filters of GET /sensor_data/ and keyset pagination on (timestamp, id) to a query.
+    Supported filters are sensor_id, type, status, location, start and end.
+    """
+    if filters.get("sensor_id") is not None:
+        query = query.where(SensorData.sensor_id == filters["sensor_id"])
+    if filters.get("type") is not None:
+        query = query.where(SensorData.type == filters["type"])
+    if filters.get("status") is not None:
+        query = query.where(SensorData.status == filters["status"])
+    if filters.get("location") is not None:
+        query = query.where(SensorData.location == filters["location"])
+    if filters.get("start") is not None:
+        query = query.where(SensorData.timestamp >= filters["start"])
+    if filters.get("end") is not None:
+        query = query.where(SensorData.timestamp < filters["end"])
+
+    if cursor:
+        timestamp, id = decode_cursor(cursor)
+        query = query.where(or_(
+            SensorData.timestamp > timestamp,
+            and_(SensorData.timestamp == timestamp, SensorData.id > id),
+        ))
+
+    return query.order_by(SensorData.timestamp, SensorData.id)
+
+# Columns of a reading as returned by GET /sensor_data/
+SENSOR_DATA_COLUMNS = [getattr(SensorData, column) for column in ("id",) + READING_COLUMNS]
+
+def reading_order(row: dict):
+    return to_epoch_seconds(row["timestamp"]), row["id"]
+
+def archived_chunks(filters: dict, cursor: str | None = None):
+    """Readings of the cold tier matching the filters after the cursor, as lists of dicts ordered by (timestamp, id)."""
+    after = decode_cursor(cursor) if cursor else None
+    for table in scan_archive(filters, after):
+        for batch in table.to_batches(STREAM_CHUNK_SIZE):
+            yield batch.to_pylist()
+
+async def archived_rows(filters: dict, cursor: str | None = None):
+    """
+    The rows of `archived_chunks`, read a chunk at a time in a worker thread, so the file reads,
+    sorts and conversions of the cold tier don't hold up the event loop.
+    """
+    chunks = archived_chunks(filters, cursor)
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        for row in chunk:
+            yield row
+
+async def get_sensor_data(db: AsyncSession, filters: dict | None = None, cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of sensor data ordered by (timestamp, id) as an encoded JSON array, and the
+    cursor of the next page. Rows are selected as tuples, without building ORM objects, and
+    merged with the readings moved to the cold tier, if any.
+    """
+    filters = filters or {}
+    query = filter_sensor_data(select(*SENSOR_DATA_COLUMNS), filters, cursor).limit(limit + 1)
+    result = await db.execute(query)
+    rows = [row._asdict() for row in result]
+
+    if archived_days():
+        archived = []
+        async for row in archived_rows(filters, cursor):
+            archived.append(row)
+            if len(archived) > limit:
+                break
+        rows = list(itertools.islice(heapq.merge(archived, rows, key=reading_order), limit + 1))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+    return dumps(rows), next_cursor
+
+async def merged_rows(result, archived):
+    """Rows of a streamed result merged with archived rows as dicts, both ordered by (timestamp, id)."""
+    pending = await anext(archived, None)
+    async for partition in result.partitions():
+        for row in partition:
+            row = row._asdict()
+            while pending is not None and reading_order(pending) < reading_order(row):
+                yield pending
+                pending = await anext(archived, None)
+            yield row
+    while pending is not None:
+        yield pending
+        pending = await anext(archived, None)
+
+def stream_sensor_data(filters: dict | None = None, cursor: str | None = None, limit: int | None = None):
+    """
+    Stream sensor data as NDJSON, reading with a server-side cursor so memory stays constant.
+    The query is built (and the cursor validated) before the first line is sent. Readings moved
+    to the cold tier are merged in by (timestamp, id).
+    """
+    filters = filters or {}
+    query = filter_sensor_data(select(*SENSOR_DATA_COLUMNS), filters, cursor)
+    if limit:
+        query = query.limit(limit)
+
+    async def lines():
+        # The request's session is closed before a streamed body is sent, so use our own
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+            if not archived_days():
+                async for partition in result.partitions():
+                    yield b"".join(dumps(row._asdict()) + b"\n" for row in partition)
+                return
+
+            count = 0
+            chunk = []
+            async for row in merged_rows(result, archived_rows(filters, cursor)):
+                chunk.append(row)
+                count += 1
+                if len(chunk) == STREAM_CHUNK_SIZE or count == limit:
+                    yield b"".join(dumps(row) + b"\n" for row in chunk)
+                    chunk = []
+                if count == limit:
+                    return
+            if chunk:
+                yield b"".join(dumps(row) + b"\n" for row in chunk)
+
+    return lines()
@@ -1,7 +1,20 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from models.sensor_reliability import SensorReliability, SensorReliabilitySchema
+from sqlalchemy import insert, update
+from models.sensor_data import SensorData
+from models.sensor_latest import SensorLatest
+from models.sensor_reliability import SensorReliability, SensorReliabilitySchema, SensorStatistics
+from controllers.dashboard_controller import dashboard_cache
+from utils.sensor_state import sensor_state
+from utils.reading_window import window_start
+from utils.archive import archived_history, archived_series, naive_utc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from fastapi import HTTPException
+import numpy as np
+import asyncio
+import os
+import time
 
 async def get_sensor_reliability(sensor_id: str, db: AsyncSession):
     """Fetch the reliability data for a specific sensor."""
@@ -32,4 +45,345 @@ async def create_or_update_sensor_reliability(sensor_data: SensorReliabilitySche
         db.add(new_sensor)
 
     await db.commit()
-    return SensorReliabilitySchema.from_orm_with_last_updated(existing_sensor or new_sensor)
\ No newline at end of file
+    return SensorReliabilitySchema.from_orm_with_last_updated(existing_sensor or new_sensor)
+
+
+# Sensors scored together; also the unit of work handed to the process pool
+RECOMPUTE_SHARD_SIZE = int(os.getenv("RELIABILITY_RECOMPUTE_SHARD_SIZE", "1000"))
+
+# Rows fetched per round trip while streaming the history of a shard
+RECOMPUTE_FETCH_SIZE = 10000
+
+
+def epoch_seconds(timestamps):
+    """Epoch seconds of a sequence of timestamps as a float array, treating naive datetimes as UTC."""
+    if timestamps and timestamps[0].tzinfo is None:
+        return np.array(timestamps, dtype="datetime64[us]").astype(np.int64) / 1e6
+    return np.array([timestamp.timestamp() for timestamp in timestamps], dtype=np.float64)
+
+
+def grouped_statistics(codes, timestamps, values, sensor_count):
+    """Running statistics (as kept in sensor_statistics) per sensor of readings sorted by sensor and time."""
+    count = np.bincount(codes, minlength=sensor_count)
+    value_mean = np.bincount(codes, weights=values, minlength=sensor_count) / np.maximum(count, 1)
+    value_m2 = np.bincount(codes, weights=(values - value_mean[codes]) ** 2, minlength=sensor_count)
+
+    # Intervals between consecutive readings of the same sensor
+    same_sensor = codes[1:] == codes[:-1]
+    interval_codes = codes[1:][same_sensor]
+    intervals = np.diff(timestamps)[same_sensor]
+    interval_count = np.bincount(interval_codes, minlength=sensor_count)
+    interval_total = np.bincount(interval_codes, weights=intervals, minlength=sensor_count)
+    interval_mean = interval_total / np.maximum(interval_count, 1)
+    interval_m2 = np.bincount(interval_codes, weights=(intervals - interval_mean[interval_codes]) ** 2, minlength=sensor_count)
+
+    last_timestamp = np.full(sensor_count, np.nan)
+    last_readings = np.flatnonzero(np.append(codes[1:] != codes[:-1], True)) if len(codes) else codes
+    last_timestamp[codes[last_readings]] = timestamps[last_readings]
+
+    return {
+        "count": count,
+        "value_mean": value_mean,
+        "value_m2": value_m2,
+        "interval_count": interval_count,
+        "interval_mean": interval_mean,
+        "interval_m2": interval_m2,
+        "interval_total": interval_total,
+        "last_timestamp": last_timestamp,
+    }
+
+
+def score_readings(
+    codes, timestamps, values, sensor_count, expected_interval, frequency_weights, reliability_weights,
+    window_readings=0, window_seconds=0,
+):
+    """
+    Score many sensors at once with grouped array operations.
+
+    `codes[i]` is the index (below `sensor_count`) of the sensor of reading i, taken at
+    `timestamps[i]` (epoch seconds) with `values[i]`; readings may come in any order.
+    Returns per-sensor arrays of the running statistics (as kept in sensor_statistics) and of
+    the scores, equal to those of the scalar scoring functions over each sensor's history, or
+    over its last `window_readings` readings and/or `window_seconds` when a window is given.
+    """
+    order = np.lexsort((timestamps, codes))
+    codes, timestamps, values = codes[order], timestamps[order], values[order]
+    statistics = grouped_statistics(codes, timestamps, values, sensor_count)
+
+    scored = statistics
+    if window_readings or window_seconds:
+        keep = np.ones(len(codes), dtype=bool)
+        if window_readings:
+            # Position of every reading counted from the newest of its sensor
+            last_position = np.cumsum(statistics["count"]) - 1
+            keep &= last_position[codes] - np.arange(len(codes)) < window_readings
+        if window_seconds:
+            keep &= timestamps >= statistics["last_timestamp"][codes] - window_seconds
+        scored = grouped_statistics(codes[keep], timestamps[keep], values[keep], sensor_count)
+    count, value_m2 = scored["count"], scored["value_m2"]
+    interval_count, interval_mean, interval_m2 = scored["interval_count"], scored["interval_mean"], scored["interval_m2"]
+    interval_total = scored["interval_total"]
+
+    variance = np.where(count > 1, value_m2 / np.maximum(count, 1), 0.0)
+
+    w1, w2, w3 = frequency_weights
+    with np.errstate(divide="ignore", invalid="ignore"):
+        interval_ratio = np.minimum(interval_mean, expected_interval) / np.maximum(interval_mean, expected_interval)
+        std_dev = np.sqrt(interval_m2 / np.maximum(interval_count, 1))
+        consistency = np.where(interval_mean > 0, np.maximum(0, 1 - std_dev / interval_mean), 0)
+        # The intervals telescope, so their sum is the time between the first and the latest reading
+        expected_updates = interval_total / expected_interval
+        missing_ratio = np.where(expected_updates > 0, np.clip(1 - count / expected_updates, 0, 1), 0)
+    update_frequency = np.where(
+        interval_count > 0, w1 * interval_ratio + w2 * consistency + w3 * (1 - missing_ratio), 0.0
+    )
+
+    alpha, beta = reliability_weights
+    variance_score = 1 - (variance / np.maximum(variance, 1))  # Normalize variance score
+    score = alpha * variance_score + beta * update_frequency
+
+    return {
+        **statistics,
+        "variance": variance,
+        "update_frequency": update_frequency,
+        "score": score,
+    }
+
+
+async def lock_shard_statistics(sensor_ids: list[str], db: AsyncSession):
+    """
+    Lock the statistics rows of a shard, in sensor order like the ingest path, until the shard's
+    scores are written and committed, so readings ingested meanwhile wait instead of being
+    overwritten. Sensors without statistics yet get an empty row first, for both to lock.
+    """
+    # Import inside the function to avoid circular import
+    from controllers.sensor_controller import insert_ignoring_duplicates, lock_sensor_statistics, new_sensor_statistics
+
+    await db.execute(insert_ignoring_duplicates(SensorStatistics, db, "sensor_id").values([
+        {column.name: getattr(new_sensor_statistics(sensor_id), column.name) for column in SensorStatistics.__table__.columns if column.name != "id"}
+        for sensor_id in sensor_ids
+    ]))
+    await lock_sensor_statistics(sensor_ids, db)
+
+
+async def load_shard_history(sensor_ids: list[str], db: AsyncSession):
+    """Stream the (sensor, timestamp, value) columns of a shard of sensors, hot and archived, into arrays."""
+    positions = {sensor_id: position for position, sensor_id in enumerate(sensor_ids)}
+    codes, timestamps, values = [], [], []
+    result = await db.stream(
+        select(SensorData.sensor_id, SensorData.timestamp, SensorData.value)
+        .where(SensorData.sensor_id.in_(sensor_ids))
+        .execution_options(yield_per=RECOMPUTE_FETCH_SIZE)
+    )
+    async for rows in result.partitions():
+        sensor_column, timestamp_column, value_column = zip(*rows)
+        codes.append(np.fromiter((positions[sensor_id] for sensor_id in sensor_column), np.int64, len(rows)))
+        timestamps.append(epoch_seconds(timestamp_column))
+        values.append(np.array(value_column, dtype=np.float64))
+
+    # Readings moved to the cold tier count toward the lifetime statistics too
+    archived_codes, archived_timestamps, archived_values = await asyncio.to_thread(archived_history, positions)
+    if len(archived_codes):
+        codes.append(archived_codes)
+        timestamps.append(archived_timestamps)
+        values.append(archived_values)
+
+    if not codes:
+        return np.empty(0, np.int64), np.empty(0), np.empty(0)
+    return np.concatenate(codes), np.concatenate(timestamps), np.concatenate(values)
+
+
+async def upsert_shard_scores(sensor_ids: list[str], scores: dict, db: AsyncSession):
+    """Bulk-write the statistics and scores of a shard: one UPDATE batch and one INSERT batch per table."""
+    now = datetime.utcnow()
+    reliability_rows, statistics_rows, latest_rows = [], [], []
+    for position, sensor_id in enumerate(sensor_ids):
+        if not scores["count"][position]:
+            continue
+        reliability_rows.append({
+            "sensor_id": sensor_id,
+            "score": float(scores["score"][position]),
+            "variance": float(scores["variance"][position]),
+            "update_frequency": float(scores["update_frequency"][position]),
+            "last_updated": now,
+        })
+        statistics_rows.append({
+            "sensor_id": sensor_id,
+            "count": int(scores["count"][position]),
+            "value_mean": float(scores["value_mean"][position]),
+            "value_m2": float(scores["value_m2"][position]),
+            "interval_count": int(scores["interval_count"][position]),
+            "interval_mean": float(scores["interval_mean"][position]),
+            "interval_m2": float(scores["interval_m2"][position]),
+            "last_timestamp": float(scores["last_timestamp"][position]),
+        })
+        latest_rows.append({
+            "sensor_id": sensor_id,
+            "reliability_score": reliability_rows[-1]["score"],
+            "data_variance": reliability_rows[-1]["variance"],
+            "update_frequency": reliability_rows[-1]["update_frequency"],
+        })
+
+    for model, rows, insert_missing in [
+        (SensorReliability, reliability_rows, True),
+        (SensorStatistics, statistics_rows, True),
+        (SensorLatest, latest_rows, False),
+    ]:
+        if not rows:
+            continue
+        existing = await db.execute(select(model.sensor_id, model.id).where(model.sensor_id.in_(sensor_ids)))
+        ids = dict(existing.all())
+        updates = [{"id": ids[row["sensor_id"]], **row} for row in rows if row["sensor_id"] in ids]
+        inserts = [row for row in rows if row["sensor_id"] not in ids]
+        if updates:
+            await db.execute(update(model), updates)
+        if inserts and insert_missing:
+            await db.execute(insert(model), inserts)
+
+    return reliability_rows
+
+
+async def recompute_reliability(db: AsyncSession, workers: int = 0, shard_size: int = RECOMPUTE_SHARD_SIZE):
+    """
+    Rescore every sensor from its full history, or its configured reliability window, and
+    bulk-upsert sensor_reliability, sensor_statistics and the scores in sensor_latest.
+
+    The history is streamed shard by shard into arrays and scored with `score_readings`; with
+    `workers` > 0 the scoring of shards is spread over a process pool while the next shard loads.
+    The scoring settings are those of the ingest path, which keeps rescoring with them.
+    """
+    # Import inside the function to avoid circular import
+    from controllers.sensor_controller import (
+        EXPECTED_INTERVAL, FREQUENCY_WEIGHTS, RELIABILITY_WEIGHTS, RELIABILITY_WINDOW_READINGS, RELIABILITY_WINDOW_SECONDS,
+    )
+
+    parameters = (
+        EXPECTED_INTERVAL,
+        FREQUENCY_WEIGHTS,
+        RELIABILITY_WEIGHTS,
+        RELIABILITY_WINDOW_READINGS,
+        RELIABILITY_WINDOW_SECONDS,
+    )
+    started = time.perf_counter()
+
+    result = await db.execute(select(SensorData.sensor_id).distinct())
+    all_sensor_ids = sorted(result.scalars().all())
+    shards = [all_sensor_ids[start:start + shard_size] for start in range(0, len(all_sensor_ids), shard_size)]
+
+    loop = asyncio.get_running_loop()
+    pool = ProcessPoolExecutor(workers) if workers > 0 else None
+    pending: list = []
+    readings = 0
+    rescored: dict[str, dict] = {}
+
+    async def write(sensor_ids, scores):
+        for row in await upsert_shard_scores(sensor_ids, scores, db):
+            rescored[row["sensor_id"]] = row
+
+    async def write_pending():
+        for sensor_ids, future in pending:
+            await write(sensor_ids, await future)
+        pending.clear()
+        # Releases the statistics locks of the shards written
+        await db.commit()
+
+    try:
+        for sensor_ids in shards:
+            await lock_shard_statistics(sensor_ids, db)
+            codes, timestamps, values = await load_shard_history(sensor_ids, db)
+            readings += len(codes)
+            arguments = (codes, timestamps, values, len(sensor_ids), *parameters)
+            # Scored off the event loop, in a thread or in the process pool
+            pending.append((sensor_ids, loop.run_in_executor(pool, score_readings, *arguments)))
+            # Keep at most one shard per worker in flight, locked, while the next one loads
+            if len(pending) >= max(workers, 1):
+                await write_pending()
+        await write_pending()
+    finally:
+        if pool:
+            pool.shutdown()
+
+    await refresh_dashboard_reliability(rescored)
+
+    return {
+        "sensors": len(rescored),
+        "readings": readings,
+        "shards": len(shards),
+        "workers": workers,
+        "expected_interval": parameters[0],
+        "frequency_weights": list(parameters[1]),
+        "reliability_weights": list(parameters[2]),
+        "window_readings": parameters[3],
+        "window_seconds": parameters[4],
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+async def refresh_dashboard_reliability(rescored: dict):
+    """Push new scores into the latest-state stores of the workers and on to the dashboards."""
+    if not sensor_state.loaded or not rescored:
+        return
+
+    # Import inside the function to avoid circular import
+    from routes.websocket_routes import notify_clients
+
+    changed = []
+    for sensor_id, row in rescored.items():
+        entry = sensor_state.sensors.get(sensor_id)
+        if entry is None:
+            continue
+        changed.append({
+            **entry,
+            "reliability_score": row["score"],
+            "data_variance": row["variance"],
+            "update_frequency": row["update_frequency"],
+        })
+
+    dashboard_cache.invalidate()
+    await notify_clients(changed)
+
+
+async def verify_reliability(db: AsyncSession, sample: int = 100):
+    """
+    Check stored scores against the scalar scoring functions over each sensor's history (or
+    reliability window), for up to `sample` sensors. Returns the number checked, the sensors that differ and the largest difference.
+    """
+    # Import inside the function to avoid circular import
+    from controllers.sensor_controller import (
+        EXPECTED_INTERVAL, FREQUENCY_WEIGHTS, RELIABILITY_WEIGHTS, RELIABILITY_WINDOW_READINGS, RELIABILITY_WINDOW_SECONDS,
+        calculate_variance, calculate_update_frequency_score, calculate_reliability_score, to_epoch_seconds,
+    )
+
+    result = await db.execute(select(SensorReliability).order_by(SensorReliability.sensor_id).limit(sample))
+    max_difference = 0.0
+    mismatched = []
+    checked = 0
+    for reliability in result.scalars().all():
+        history = await db.execute(
+            select(SensorData.timestamp, SensorData.value)
+            .where(SensorData.sensor_id == reliability.sensor_id)
+            .order_by(SensorData.timestamp)
+        )
+        rows = history.all()
+        archived = await asyncio.to_thread(archived_series, reliability.sensor_id)
+        if archived:
+            rows = sorted(archived + rows, key=lambda row: naive_utc(row[0]))
+        rows = rows[window_start([to_epoch_seconds(timestamp) for timestamp, _ in rows], RELIABILITY_WINDOW_READINGS, RELIABILITY_WINDOW_SECONDS):]
+        variance = calculate_variance([value for _, value in rows])
+        update_frequency = calculate_update_frequency_score(
+            [timestamp for timestamp, _ in rows], EXPECTED_INTERVAL, FREQUENCY_WEIGHTS
+        )
+        variance_score = 1 - (variance / max(variance, 1))
+        score = calculate_reliability_score(variance_score, update_frequency, RELIABILITY_WEIGHTS)
+
+        difference = max(
+            abs(reliability.variance - variance) / max(1.0, abs(variance)),
+            abs(reliability.update_frequency - update_frequency),
+            abs(reliability.score - score),
+        )
+        if difference > 1e-9:
+            mismatched.append(reliability.sensor_id)
+        max_difference = max(max_difference, difference)
+        checked += 1
+
+    return {"checked": checked, "mismatched": mismatched, "max_difference": max_difference}
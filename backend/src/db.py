@@ -1,6 +1,7 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
+from utils.metrics import instrument_engine
 import os
 
 # Load environment variables from .env file
@@ -11,7 +12,11 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Echoing every statement is slow; leave it off outside debugging and rely on the slow-query log
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true")
+
+engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
+instrument_engine(engine)
 AsyncSessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
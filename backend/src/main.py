@@ -1,19 +1,62 @@
 from fastapi import FastAPI
 from routes import router as api_router
-from db import engine, Base
+from db import engine, Base, AsyncSessionLocal
+from utils.sensor_state import sensor_state
+from utils.ingest_queue import ingest_queue
+from utils.pubsub import bus
+from models.sensor_data import PARTITION_BY_DAY
+from utils.partitions import create_missing_columns, create_missing_indexes, maintain_partitions, partition_maintenance_loop
+from utils.archive import ARCHIVE_AFTER_DAYS, archive_loop
+from utils.profiling import ProfilingMiddleware
+import asyncio
+import os
 
 app = FastAPI()
 
+# Profile requests on demand and keep the slow ones (see utils.profiling)
+app.add_middleware(ProfilingMiddleware)
+
+# Background tasks started with the application
+background_tasks: list[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup():
     # Create tables in the database
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_columns)
+
+    # Outside of a transaction, so PostgreSQL can build them concurrently
+    await create_missing_indexes(engine)
+
+    if PARTITION_BY_DAY:
+        # Partitions must exist before the first reading is inserted
+        await maintain_partitions(engine)
+        background_tasks.append(asyncio.create_task(partition_maintenance_loop(engine)))
+
+    # Warm the latest state of every sensor for the dashboard counters
+    async with AsyncSessionLocal() as db:
+        await sensor_state.warm(db)
+
+    if ARCHIVE_AFTER_DAYS:
+        # Move old readings to the cold tier; one worker at a time archives
+        background_tasks.append(asyncio.create_task(archive_loop(AsyncSessionLocal)))
+
+    # Receive the ingest events of every worker from the pub/sub bus
+    await bus.start()
+
+    # Start the writers of the WebSocket ingest queue
+    await ingest_queue.start()
 
 @app.on_event("shutdown")
 async def shutdown():
-    # Any shutdown tasks can be added here
-    pass
+    # Write the readings still waiting in the ingest queue
+    await ingest_queue.stop()
+    await bus.stop()
+
+    # Stop the background tasks
+    for task in background_tasks:
+        task.cancel()
 
 app.include_router(api_router)
 
@@ -1,9 +1,16 @@
-from sqlalchemy import Column, String, Float, Integer, DateTime, Enum
+from sqlalchemy import Column, String, Float, Integer, BigInteger, DateTime, Enum, Index
 from sqlalchemy.sql import func
-from db import Base
+from db import Base, DATABASE_URL
 from pydantic import BaseModel, validator
 from datetime import datetime
 from enum import Enum as PyEnum
+import os
+
+# Range partition sensor_data by day (SENSOR_DATA_PARTITIONING=daily), only supported on PostgreSQL
+PARTITION_BY_DAY = (
+    os.getenv("SENSOR_DATA_PARTITIONING", "").lower() == "daily"
+    and DATABASE_URL.startswith("postgresql")
+)
 
 # Enum for sensor type
 class SensorType(PyEnum):
@@ -21,6 +28,15 @@ class SensorStatus(PyEnum):
 
 class SensorData(Base):
     __tablename__ = "sensor_data"
+    __table_args__ = (
+        Index("ix_sensor_data_sensor_id_timestamp", "sensor_id", "timestamp"),  # History of a sensor
+        Index("ix_sensor_data_status_sensor_id", "status", "sensor_id"),  # Sensors by status
+        Index("ix_sensor_data_timestamp_id", "timestamp", "id"),  # Keyset pagination
+        # Retransmitted readings are skipped; unique indexes of a partitioned table must hold the partition key
+        Index("ux_sensor_data_sensor_id_seq", "sensor_id", "seq", *(("timestamp",) if PARTITION_BY_DAY else ()), unique=True),
+        # A partitioned table needs the partition key in its primary key, see `timestamp`
+        {"postgresql_partition_by": "RANGE (timestamp)"} if PARTITION_BY_DAY else {},
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     sensor_id = Column(String(255), nullable=False)  # Unique identifier for the sensor
@@ -29,8 +45,9 @@ class SensorData(Base):
     location = Column(String(255), nullable=False)  # Location where the sensor is installed
     value = Column(Float, nullable=False)  # Current reading value
     unit = Column(String(50), nullable=False)  # Measurement unit (e.g., °C, %, hPa, AQI)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())  # ISO format timestamp of the reading
+    timestamp = Column(DateTime(timezone=True), server_default=func.now(), primary_key=PARTITION_BY_DAY)  # ISO format timestamp of the reading
     status = Column(Enum(SensorStatus), nullable=False)  # Current operational status
+    seq = Column(BigInteger, nullable=True)  # Producer's sequence number of the reading, unique per sensor
 
 class SensorDataSchema(BaseModel):
     id: int | None = None  # Optional for creation, required for responses
@@ -42,6 +59,7 @@ class SensorDataSchema(BaseModel):
     unit: str
     timestamp: str | None = None  # Optional field for request payload
     status: SensorStatus
+    seq: int | None = None  # Optional sequence number, increasing per sensor, that makes retransmits idempotent
 
     class Config:
         orm_mode = True
@@ -51,4 +69,14 @@ class SensorDataSchema(BaseModel):
         """Convert datetime to ISO 8601 string."""
         if isinstance(value, datetime):
             return value.isoformat()
+        return value
+
+    @validator("seq")
+    def require_timestamp_with_seq(cls, value, values):
+        """
+        A retransmit must match the stored reading, timestamp included: on a table partitioned
+        by day the unique index of (sensor_id, seq) holds the timestamp too.
+        """
+        if value is not None and not values.get("timestamp"):
+            raise ValueError("readings with a seq need a timestamp")
         return value
\ No newline at end of file
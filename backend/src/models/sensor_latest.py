@@ -0,0 +1,20 @@
+from sqlalchemy import Column, String, Float, Integer, DateTime, Enum
+from db import Base
+from models.sensor_data import SensorType, SensorStatus
+
+class SensorLatest(Base):
+    """Latest reading, status and reliability of every sensor (one row per sensor)."""
+    __tablename__ = "sensor_latest"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    sensor_id = Column(String(255), nullable=False, unique=True)  # References the sensor ID
+    name = Column(String(255), nullable=False)  # Display name for the sensor
+    type = Column(Enum(SensorType), nullable=False)  # Sensor type
+    location = Column(String(255), nullable=False)  # Location where the sensor is installed
+    value = Column(Float, nullable=False)  # Latest reading value
+    unit = Column(String(50), nullable=False)  # Measurement unit (e.g., °C, %, hPa, AQI)
+    timestamp = Column(DateTime(timezone=True), nullable=False)  # Timestamp of the latest reading
+    status = Column(Enum(SensorStatus), nullable=False)  # Latest operational status
+    reliability_score = Column(Float, nullable=True)  # Reliability score at the latest reading
+    data_variance = Column(Float, nullable=True)  # Variance at the latest reading
+    update_frequency = Column(Float, nullable=True)  # Update frequency score at the latest reading
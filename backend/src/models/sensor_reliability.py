@@ -32,4 +32,18 @@ class SensorReliabilitySchema(BaseModel):
             variance=obj.variance,
             update_frequency=obj.update_frequency,
             last_updated=obj.last_updated.isoformat() if obj.last_updated else None,
-        )
\ No newline at end of file
+        )
+
+class SensorStatistics(Base):
+    """Running (Welford) statistics per sensor so reliability can be scored without rereading history."""
+    __tablename__ = "sensor_statistics"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    sensor_id = Column(String(255), nullable=False, unique=True)  # References the sensor ID
+    count = Column(Integer, nullable=False, default=0)  # Number of readings seen
+    value_mean = Column(Float, nullable=False, default=0.0)  # Running mean of the readings
+    value_m2 = Column(Float, nullable=False, default=0.0)  # Sum of squared deviations from the running mean
+    interval_count = Column(Integer, nullable=False, default=0)  # Number of inter-arrival intervals seen
+    interval_mean = Column(Float, nullable=False, default=0.0)  # Running mean of the intervals in seconds
+    interval_m2 = Column(Float, nullable=False, default=0.0)  # Sum of squared deviations of the intervals
+    last_timestamp = Column(Float, nullable=True)  # Epoch seconds of the latest reading
@@ -0,0 +1,34 @@
+from sqlalchemy import Column, String, Float, Integer, DateTime, UniqueConstraint
+from db import Base
+from pydantic import BaseModel
+
+class SensorRollup(Base):
+    """Aggregated readings of a sensor per time bucket, at 1-minute, 1-hour and 1-day resolution."""
+    __tablename__ = "sensor_rollup"
+    __table_args__ = (
+        UniqueConstraint("sensor_id", "resolution", "bucket_start", name="uq_sensor_rollup_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    sensor_id = Column(String(255), nullable=False)  # References the sensor ID
+    resolution = Column(String(8), nullable=False)  # Bucket size: "1m", "1h" or "1d"
+    bucket_start = Column(DateTime, nullable=False)  # Start of the bucket (UTC)
+    min = Column(Float, nullable=False)  # Lowest reading in the bucket
+    max = Column(Float, nullable=False)  # Highest reading in the bucket
+    sum = Column(Float, nullable=False)  # Sum of the readings, the average is sum / count
+    count = Column(Integer, nullable=False)  # Number of readings in the bucket
+    last_value = Column(Float, nullable=False)  # Latest reading in the bucket
+    last_timestamp = Column(Float, nullable=False)  # Epoch seconds of the latest reading in the bucket
+
+class SensorSeriesPointSchema(BaseModel):
+    timestamp: str  # ISO format start of the bucket
+    min: float
+    max: float
+    avg: float
+    count: int
+    last: float
+
+class SensorSeriesSchema(BaseModel):
+    sensor_id: str
+    resolution: str
+    points: list[SensorSeriesPointSchema]
@@ -0,0 +1,45 @@
+"""
+Rescore every sensor from its full history, e.g. after changing RELIABILITY_EXPECTED_INTERVAL
+or the weights, or after backfilling readings.
+
+Usage:
+    python recompute_reliability.py
+    RELIABILITY_EXPECTED_INTERVAL=300 python recompute_reliability.py --workers 4 --verify 200
+
+The settings are read from the environment, like the ingest path reads them: change them
+for the servers too, or the next readings of a sensor are scored with the old ones again.
+Running servers keep the scores they loaded at startup in memory; use
+POST /sensor_reliabilty/recompute to rescore through a server instead.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+# The controllers import from the routes, which have to be loaded first
+import routes  # noqa: F401
+from db import engine, AsyncSessionLocal
+from controllers.sensor_reliability_controller import recompute_reliability, verify_reliability
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=0, help="Processes scoring shards in parallel")
+    parser.add_argument("--verify", type=int, default=0, help="Sensors to check against the scalar scoring functions")
+    args = parser.parse_args()
+
+    # Statement logging would flood the output
+    engine.echo = False
+    async with AsyncSessionLocal() as db:
+        summary = await recompute_reliability(db, workers=args.workers)
+        if args.verify:
+            summary["verification"] = await verify_reliability(db, args.verify)
+    await engine.dispose()
+
+    print(json.dumps(summary, indent=2))
+    if args.verify and summary["verification"]["mismatched"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,6 +4,8 @@ from .sensor_routes import sensor_router
 from .dashboard_route import dashboard_router
 from .sensor_reliability_route import sensor_reliability_router
 from .websocket_routes import websocket_router
+from .metrics_routes import metrics_router
+from .admin_routes import admin_router
 
 router = APIRouter()
 
@@ -13,6 +15,8 @@ router.include_router(sensor_router, prefix="/sensor_data", tags=["Sensor Data"]
 router.include_router(dashboard_router, prefix="/dashboard", tags=["Dashboard"])
 router.include_router(sensor_reliability_router, prefix="/sensor_reliabilty", tags=["Sensor Reliability"])
 router.include_router(websocket_router, prefix="/ws", tags=["WS"])
+router.include_router(metrics_router, tags=["Metrics"])
+router.include_router(admin_router, prefix="/admin", tags=["Admin"])
 
 @router.get("/")
 async def root():
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from utils.profiling import PROFILE_SAMPLE_RATE, SLOW_REQUEST_THRESHOLD, check_admin_token, profile_ring
+
+admin_router = APIRouter(tags=["Admin"])
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    """Admin endpoints need the X-Admin-Token header to match ADMIN_TOKEN; without ADMIN_TOKEN they do not exist."""
+    if not check_admin_token(x_admin_token):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@admin_router.get("/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """API to list the profiled and slow requests kept in the ring of this worker, newest first."""
+    return {
+        "slow_request_threshold_ms": SLOW_REQUEST_THRESHOLD * 1000,
+        "profile_sample_rate": PROFILE_SAMPLE_RATE,
+        "captured": profile_ring.captured,
+        "profiles": [profile.summary() for profile in reversed(profile_ring.profiles)],
+    }
+
+@admin_router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: int, format: str = "json"):
+    """
+    API to get one request: its timeline of SQL statements, ingest stages and WebSocket
+    publishes and sends, and its stack samples (`format=folded` for a flame graph).
+    """
+    profile = profile_ring.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return profile.details()
+
+@admin_router.delete("/profiles", dependencies=[Depends(require_admin)])
+async def clear_profiles():
+    """API to empty the ring."""
+    profile_ring.clear()
+    return {"message": "Profiles cleared"}
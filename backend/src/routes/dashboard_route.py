@@ -1,63 +1,123 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
 from sqlalchemy.ext.asyncio import AsyncSession
 from db import get_db
-from controllers.dashboard_controller import (
-    get_total_sensors,
-    get_online_sensors,
-    get_warning_sensors,
-    get_average_reliability,
-)
+from controllers.dashboard_controller import dashboard_cache, etag_matches
+from utils.broadcast import BroadcastHub
+from utils.sensor_state import sensor_state, summarize_sensors, BREAKDOWN_DIMENSIONS
+from utils.encoding import dumps
+from utils.subscriptions import select_sensors
 
 dashboard_router = APIRouter(tags=["Dashboard"])
 
-# In-memory storage for connected WebSocket clients
-dashboard_connections = []
+# Connected WebSocket clients; every message is the full set of metrics, so slow clients only get the latest
+dashboard_connections = BroadcastHub("dashboard", overflow="latest")
+
+# Clients of the breakdown feed, by the dimension they follow; slow clients only get the latest breakdown
+breakdown_dimensions: dict[WebSocket, str] = {}
+breakdown_connections = BroadcastHub(
+    "breakdown", overflow="latest", resync=lambda websocket: breakdown_message(breakdown_dimensions[websocket])
+)
 
 @dashboard_router.get("/")
-async def get_dashboard_metrics(db: AsyncSession = Depends(get_db)):
-    """API to get all dashboard metrics in a single response."""
-    total = await get_total_sensors(db)
-    online = await get_online_sensors(db)
-    warnings = await get_warning_sensors(db)
-    reliability = await get_average_reliability(db)
-
-    return {
-        "total_sensors": total,
-        "online_sensors": online,
-        "warning_sensors": warnings,
-        "average_reliability": reliability,
-    }
+async def get_dashboard_metrics(
+    if_none_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    API to get all dashboard metrics in a single response.
+    Unchanged metrics are answered with 304 from the cache, without touching the database.
+    """
+    cached_etag = dashboard_cache.current_etag()
+    if etag_matches(if_none_match, cached_etag):
+        return Response(status_code=304, headers={"ETag": cached_etag})
 
-@dashboard_router.websocket("/ws/dashboard")
-async def dashboard_websocket(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
-    """WebSocket endpoint to send real-time dashboard updates."""
-    await websocket.accept()
-    dashboard_connections.append(websocket)
+    body, etag = await dashboard_cache.get_encoded(db)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def breakdown_message(dimension: str):
+    return {"by": dimension, "groups": sensor_state.breakdown(dimension)}
+
+@dashboard_router.get("/breakdown")
+async def get_dashboard_breakdown(
+    by: str = Query("location", description="location or type"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    API to get the dashboard metrics per location or per sensor type, with the error count apart.
+    Served from counters kept up to date on ingest, so the cost depends on the number of groups only.
+    """
+    if by not in BREAKDOWN_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown breakdown '{by}', expected one of {', '.join(BREAKDOWN_DIMENSIONS)}")
+    if not sensor_state.loaded:
+        await sensor_state.warm(db)
+    return Response(dumps(breakdown_message(by)), media_type="application/json")
+
+@dashboard_router.websocket("/ws/breakdown")
+async def breakdown_websocket(websocket: WebSocket, by: str = "location", db: AsyncSession = Depends(get_db)):
+    """WebSocket endpoint to send the breakdown of GET /dashboard/breakdown whenever a sensor changes."""
+    if by not in BREAKDOWN_DIMENSIONS:
+        # 1008: policy violation, the closest to a bad request
+        await websocket.close(code=1008)
+        return
+    await breakdown_connections.connect(websocket)
+    breakdown_dimensions[websocket] = by
     try:
+        if not sensor_state.loaded:
+            await sensor_state.warm(db)
+        breakdown_connections.send(websocket, breakdown_message(by))
         while True:
-            # Keep the connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        dashboard_connections.remove(websocket)
+        print("Breakdown WebSocket client disconnected")
+    finally:
+        breakdown_connections.disconnect(websocket)
+        breakdown_dimensions.pop(websocket, None)
+
+@dashboard_router.websocket("/ws/dashboard")
+async def dashboard_websocket(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
+    """
+    WebSocket endpoint to send real-time dashboard updates.
+    A subscribe message (see /ws/sensor-dashboard) switches the client to the metrics of the
+    sensors it watches; it only hears about changes to those sensors.
+    """
+    await dashboard_connections.connect(websocket)
+    try:
+        if not sensor_state.loaded:
+            await sensor_state.warm(db)
+        dashboard_connections.send(websocket, sensor_state.summary())
+
+        await dashboard_connections.receive_subscriptions(websocket, send_dashboard_metrics)
+    except WebSocketDisconnect:
         print("Dashboard WebSocket client disconnected")
+    finally:
+        dashboard_connections.disconnect(websocket)
+
+def send_dashboard_metrics(websocket: WebSocket, filters: dict):
+    """Send a client the metrics of the sensors matching its filters."""
+    if not filters:
+        dashboard_connections.send(websocket, sensor_state.summary())
+        return
+    sensors = select_sensors(filters, sensor_state.sensors)
+    dashboard_connections.subscriptions.hold(websocket, (sensor["sensor_id"] for sensor in sensors))
+    dashboard_connections.send(websocket, summarize_sensors(sensors))
+
+async def notify_dashboard_clients(changed_sensors: list[dict]):
+    """Notify connected WebSocket clients with updated dashboard metrics."""
+    if not dashboard_connections.clients:
+        return
+    subscriptions = dashboard_connections.subscriptions
+    dashboard_connections.publish_to(subscriptions.everything, sensor_state.summary())
+
+    # Filtered clients are only recomputed when a sensor they watch changed or left their filters
+    for websocket in subscriptions.route(changed_sensors):
+        send_dashboard_metrics(websocket, subscriptions.filters[websocket])
 
-async def notify_dashboard_clients(db: AsyncSession):
-    """Notify all connected WebSocket clients with updated dashboard metrics."""
-    total = await get_total_sensors(db)
-    online = await get_online_sensors(db)
-    warnings = await get_warning_sensors(db)
-    reliability = await get_average_reliability(db)
-
-    data = {
-        "total_sensors": total,
-        "online_sensors": online,
-        "warning_sensors": warnings,
-        "average_reliability": reliability,
-    }
-
-    for connection in dashboard_connections:
-        try:
-            await connection.send_json(data)
-        except Exception as e:
-            print(f"Failed to send data to a client: {e}")
-            dashboard_connections.remove(connection)
\ No newline at end of file
+def notify_breakdown_clients():
+    """Send every breakdown client the current breakdown of its dimension, encoded once per dimension."""
+    for dimension in BREAKDOWN_DIMENSIONS:
+        websockets = [websocket for websocket, followed in breakdown_dimensions.items() if followed == dimension]
+        if websockets:
+            breakdown_connections.publish_to(websockets, breakdown_message(dimension))
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from utils.broadcast import hubs
+from utils.ingest_queue import ingest_queue
+from utils.metrics import Gauge, render
+
+metrics_router = APIRouter(tags=["Metrics"])
+
+Gauge(
+    "websocket_connections", "Connected WebSocket clients per hub.", ("hub",),
+    collect=lambda: {(name,): len(hub.clients) for name, hub in hubs.items()},
+)
+Gauge(
+    "websocket_pending_frames", "Frames queued for WebSocket clients and not sent yet, per hub.", ("hub",),
+    collect=lambda: {(name,): sum(client.queue.qsize() for client in hub.clients.values()) for name, hub in hubs.items()},
+)
+Gauge("ingest_queue_depth", "Readings waiting in the ingest queue.", collect=lambda: {(): ingest_queue.depth})
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics of this worker in the text exposition format."""
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
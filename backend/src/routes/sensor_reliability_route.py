@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from db import get_db
 from models.sensor_reliability import SensorReliabilitySchema
+from routes.admin_routes import require_admin
 
 sensor_reliability_router = APIRouter(tags=["Sensor Reliability"])
 
@@ -21,4 +22,22 @@ async def add_or_update_sensor_reliability(sensor_data: SensorReliabilitySchema,
     """
     # Import inside the function to avoid circular import
     from controllers.sensor_reliability_controller import create_or_update_sensor_reliability
-    return await create_or_update_sensor_reliability(sensor_data, db)
\ No newline at end of file
+    return await create_or_update_sensor_reliability(sensor_data, db)
+
+@sensor_reliability_router.post("/recompute", dependencies=[Depends(require_admin)])
+async def recompute_sensor_reliability(
+    workers: int = Query(0, ge=0, le=32, description="Processes scoring shards in parallel (0 scores in this process)"),
+    verify: int = Query(0, ge=0, description="Sensors to check against the scalar scoring functions afterwards"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Admin API to rescore every sensor from its full history, e.g. after a backfill, or after
+    changing the expected interval or the weights in the environment and restarting.
+    Needs the X-Admin-Token header, like the other admin endpoints.
+    """
+    # Import inside the function to avoid circular import
+    from controllers.sensor_reliability_controller import recompute_reliability, verify_reliability
+    summary = await recompute_reliability(db, workers=workers)
+    if verify:
+        summary["verification"] = await verify_reliability(db, verify)
+    return summary
@@ -1,22 +1,91 @@
-from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from models.sensor_data import SensorData, SensorDataSchema
-from controllers.sensor_controller import get_sensor_data, create_sensor_data
+from models.sensor_data import SensorData, SensorDataSchema, SensorType, SensorStatus
+from models.sensor_rollup import SensorSeriesSchema
+from controllers.sensor_controller import (
+    get_sensor_data,
+    stream_sensor_data,
+    create_sensor_data,
+    create_sensor_data_batch,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+)
+from controllers.rollup_controller import get_sensor_series
 from db import get_db
+from utils.ingest_queue import ingest_queue, IngestAcks
+from utils.ingest_worker import encode_reading
+from utils.broadcast import BroadcastHub
+from utils.metrics import INGEST_STAGE_SECONDS
+from utils.pubsub import bus
+from datetime import datetime, timedelta
 
 sensor_router = APIRouter(tags=["Sensor Data"])
 
-# In-memory storage for connected WebSocket clients
-active_connections = []
+# Connected WebSocket clients; they receive every new reading, so clients that fall behind are dropped
+active_connections = BroadcastHub("sensor-data", overflow="disconnect")
 
 @sensor_router.get("/", response_model=list[SensorDataSchema])
-async def list_sensor_data(db: AsyncSession = Depends(get_db)):
-    """API to fetch all sensor data."""
-    return await get_sensor_data(db)
+async def list_sensor_data(
+    sensor_id: str | None = None,
+    type: SensorType | None = None,
+    status: SensorStatus | None = None,
+    location: str | None = None,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    cursor: str | None = Query(None, description="X-Next-Cursor of the previous page"),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    format: str = Query("json", description="json (one page) or ndjson (stream every matching row)"),
+    accept: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    API to fetch sensor data, filtered and ordered by (timestamp, id).
+    JSON responses are paginated; the cursor of the next page is sent in the X-Next-Cursor header.
+    The body is encoded straight from the selected rows, so it is not validated against the schema again.
+    NDJSON responses (format=ndjson or Accept: application/x-ndjson) stream every matching row.
+    """
+    filters = {
+        "sensor_id": sensor_id,
+        "type": type,
+        "status": status,
+        "location": location,
+        "start": start,
+        "end": end,
+    }
+
+    if format == "ndjson" or (accept and "application/x-ndjson" in accept):
+        return StreamingResponse(stream_sensor_data(filters, cursor, limit), media_type="application/x-ndjson")
+
+    body, next_cursor = await get_sensor_data(db, filters, cursor, limit or DEFAULT_PAGE_SIZE)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(body, media_type="application/json", headers=headers)
+
+@sensor_router.get("/{sensor_id}/series", response_model=SensorSeriesSchema)
+async def sensor_series(
+    sensor_id: str,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    resolution: str = Query("auto", description="auto, raw, 1m, 1h or 1d"),
+    points: int = Query(500, ge=1, le=10000, description="Point budget used by auto resolution"),
+    db: AsyncSession = Depends(get_db),
+):
+    """API to fetch the time series of a sensor, from the coarsest rollup that fits the point budget."""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=1)
+    return await get_sensor_series(sensor_id, start, end, resolution, points, db)
 
 @sensor_router.post("/", response_model=SensorDataSchema)
 async def add_sensor_data(sensor_data: SensorDataSchema, db: AsyncSession = Depends(get_db)):
-    """API to create new sensor data."""
+    """
+    API to create new sensor data. With ingest worker processes, the reading is written by the
+    worker of its sensor (without its ID in the response), so scoring stays off this process.
+    """
+    if ingest_queue.processes:
+        written = await write_through_queue([sensor_data])
+        await notify_clients(sensor_data)
+        return written[0]
     created_data = await create_sensor_data(sensor_data, db)
     if not created_data:
         raise HTTPException(status_code=400, detail="Failed to create sensor data")
@@ -24,42 +93,122 @@ async def add_sensor_data(sensor_data: SensorDataSchema, db: AsyncSession = Depe
     await notify_clients(created_data)
     return created_data
 
-# In-memory storage for connected WebSocket clients
-active_connections = []
+@sensor_router.post("/batch")
+async def add_sensor_data_batch(batch: list[SensorDataSchema], db: AsyncSession = Depends(get_db)):
+    """API to create a batch of sensor data with a single bulk insert (or through the ingest worker processes)."""
+    if ingest_queue.processes:
+        written = await write_through_queue(batch)
+        await notify_clients_batch([encode_reading(reading) for reading in written])
+        return {"message": "Batch received and saved", "count": len(written)}
+    created_data = await create_sensor_data_batch(batch, db)
+    # Notify all connected WebSocket clients about the new data
+    await notify_clients_batch(created_data)
+    return {"message": "Batch received and saved", "count": len(created_data)}
+
+async def write_through_queue(readings: list[SensorDataSchema]):
+    """Have the ingest workers write readings posted over HTTP, all or none of them."""
+    written, failed, rejected = await ingest_queue.write(readings)
+    if rejected:
+        raise HTTPException(status_code=503, detail=f"Server overloaded, retry later ({len(written)} of {len(readings)} readings saved)")
+    if failed:
+        raise HTTPException(status_code=400, detail=f"Failed to create sensor data ({len(written)} of {len(readings)} readings saved)")
+    return written
+
+@sensor_router.get("/ingest/stats")
+async def ingest_stats():
+    """API to inspect the write-behind ingest queue: depth, counters and commit latency."""
+    return ingest_queue.stats()
 
 @sensor_router.websocket("/ws/sensor-data")
-async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
-    """WebSocket endpoint to send and receive sensor data."""
+async def websocket_endpoint(websocket: WebSocket):
+    """
+    WebSocket endpoint to send and receive sensor data.
+    A frame carries either a single reading or an array of readings (a batch). Readings are
+    validated and handed to the ingest queue, whose writers group-commit them in the background.
+    Frames without sequence numbers are answered one by one once queued, and those of their
+    readings that fail to be written are sent back in an error later. Readings with a `seq`
+    are acknowledged cumulatively once written (see IngestAcks), so producers can keep many
+    frames in flight and resend unacknowledged ones after a reconnect without duplicates.
+    When an overloaded queue rejects sequenced readings the connection is closed (1013), since
+    acknowledging later readings of the same sensors would cover the rejected ones.
+    """
     print("WebSocket connection attempt")
-    await websocket.accept()
+    await active_connections.connect(websocket)
     print("WebSocket connection accepted")
-    active_connections.append(websocket)
+    # 1011: the server could not write readings of this connection
+    acks = IngestAcks(
+        lambda message: active_connections.send(websocket, message),
+        lambda: active_connections.close(websocket, 1011),
+    )
     try:
         while True:
             # Wait for data from the client
             data = await websocket.receive_json()
-            print(f"Received data: {data}")
+            if acks.stopped:
+                # The connection is being closed; the producer resends what was not acknowledged
+                continue
 
-            # Validate and save the data to the database
+            # Validate the data using Pydantic
             try:
-                sensor_data = SensorDataSchema(**data)  # Validate the data using Pydantic
-                created_data = await create_sensor_data(sensor_data, db)  # Save to the database
-                print(f"Data saved to database: {created_data}")
+                with INGEST_STAGE_SECONDS.time(path="websocket", stage="validate"):
+                    readings = [SensorDataSchema(**item) for item in (data if isinstance(data, list) else [data])]
             except Exception as e:
-                print(f"Failed to save data to database: {e}")
-                await websocket.send_json({"error": "Failed to save data to database"})
+                print(f"Invalid sensor data: {e}")
+                active_connections.send(websocket, {"error": "Invalid sensor data"})
+                continue
+            sequenced = any(reading.seq is not None for reading in readings)
 
-            # Optionally, send a response back to the client
-            await websocket.send_json({"message": "Data received and saved", "data": data})
+            # Queue the data for writing; a full queue holds this loop back (backpressure)
+            accepted = await ingest_queue.submit(readings, acks)
+            if accepted < len(readings):
+                error = {
+                    "error": "Server overloaded, retry later",
+                    "accepted": accepted,
+                    "rejected": len(readings) - accepted,
+                }
+                if sequenced:
+                    # These will not be acknowledged; the producer resends them after reconnecting
+                    error["seqs"] = [[reading.sensor_id, reading.seq] for reading in readings[accepted:]]
+                    acks.flush()
+                    acks.stop()
+                    active_connections.send(websocket, error)
+                    # 1013: try again later
+                    active_connections.close(websocket, 1013)
+                    continue
+                active_connections.send(websocket, error)
+                continue
+
+            # Optionally, send a response back to the client (through its send queue, behind any broadcast)
+            if sequenced:
+                continue
+            if isinstance(data, list):
+                active_connections.send(websocket, {"message": "Batch received and queued", "count": len(readings)})
+            else:
+                active_connections.send(websocket, {"message": "Data received and queued", "data": data})
     except WebSocketDisconnect:
-        # Remove the client from active connections on disconnect
-        active_connections.remove(websocket)
         print("WebSocket client disconnected")
+    except RuntimeError:
+        # Receiving after the close sent for failed or rejected sequenced readings
+        if not acks.stopped:
+            raise
+    finally:
+        # Remove the client from active connections on disconnect
+        acks.stop()
+        active_connections.disconnect(websocket)
+
+async def notify_clients(data: SensorData | SensorDataSchema):
+    """Notify all connected WebSocket clients, on every worker, with new sensor data."""
+    payload = jsonable_encoder({column.name: getattr(data, column.name) for column in SensorData.__table__.columns})
+    await bus.publish("sensor-data", {"event": "new_sensor_data", "data": payload})
+
+async def notify_clients_batch(data: list[dict]):
+    """Notify all connected WebSocket clients, on every worker, with a batch of new sensor data in one message."""
+    if not data:
+        return
+    await bus.publish("sensor-data", {"event": "new_sensor_data_batch", "data": jsonable_encoder(data)})
+
+async def publish_sensor_data(message: dict):
+    """Send new sensor data from the bus to the WebSocket clients of this worker."""
+    active_connections.publish(message)
 
-async def notify_clients(data: SensorDataSchema):
-    """Notify all connected WebSocket clients with new sensor data."""
-    for connection in active_connections:
-        try:
-            await connection.send_json({"event": "new_sensor_data", "data": data.dict()})
-        except Exception as e:
-            print(f"Failed to send data to a client: {e}")
\ No newline at end of file
+bus.subscribe("sensor-data", publish_sensor_data)
@@ -1,166 +1,275 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from models.sensor_data import SensorData
-from models.sensor_reliability import SensorReliability
-from db import get_db
+from db import get_db, AsyncSessionLocal
+from controllers.dashboard_controller import dashboard_cache
+from utils.sensor_state import sensor_state
+from utils.pubsub import bus
+from utils.broadcast import BroadcastHub, hubs
+from utils.subscriptions import parse_query_subscription, select_sensors
+from utils.encoding import encode
+from utils.metrics import DASHBOARD_SYNCS
+from collections import deque
 import asyncio
+import os
+import secrets
 
 websocket_router = APIRouter(tags=["WebSocket"])
 
+# Deltas are coalesced and flushed at most once per window (in milliseconds)
+DASHBOARD_FLUSH_INTERVAL = float(os.getenv("DASHBOARD_FLUSH_INTERVAL_MS", "250")) / 1000
 
-class ConnectionManager:
-    """Manages WebSocket connections."""
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+# Versions kept in the change log, for clients resuming with ?since=<version>
+DASHBOARD_CHANGE_LOG_SIZE = int(os.getenv("DASHBOARD_CHANGE_LOG_SIZE", "1000"))
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+# Slow dashboards are skipped to a fresh snapshot (see `dashboard_state` below)
+manager = BroadcastHub("sensor-dashboard", overflow="latest")
+
+
+class DashboardState:
+    """
+    Tracks which sensors changed since the last broadcast so that changes are sent as
+    coalesced, versioned deltas. The sensors themselves live in the latest-state store.
+
+    Clients subscribed to everything share one delta. A filtered client only gets a delta when
+    a sensor it watches changed, with the full summary (it skips the deltas in between) and the
+    IDs of sensors that no longer match its filters under "removed".
+
+    Every version is recorded in a bounded change log with the IDs of the sensors it changed,
+    so a reconnecting client that has seen a version only needs the sensors changed after it.
+    Versions are numbered per process; `epoch` tells clients which numbering they have.
+    """
+    def __init__(self, flush_interval: float = DASHBOARD_FLUSH_INTERVAL, change_log_size: int = DASHBOARD_CHANGE_LOG_SIZE):
+        self.flush_interval = flush_interval
+        self.summary: dict = {}
+        self.version = 0
+        self.epoch = secrets.token_hex(4)
+        self.changes: deque = deque(maxlen=change_log_size)  # (version, IDs of the sensors changed in it)
+        self._dirty: set[str] = set()
+        self._flush_task: asyncio.Task | None = None
+        self._snapshot_version = None
+        self._snapshot_frames: dict = {}  # Full snapshot at _snapshot_version, per encoding
+
+    def snapshot(self, filters: dict | None = None):
+        """Full dashboard message at the current version, with only the sensors matching `filters`."""
+        return {
+            "type": "snapshot",
+            "version": self.version,
+            "epoch": self.epoch,
+            "dashboard": sensor_state.summary(),
+            "sensors": select_sensors(filters, sensor_state.sensors),
+        }
+
+    def snapshot_frame(self, encoding: str):
+        """
+        The full snapshot, built and encoded once per version and encoding and shared by every
+        client that needs it. Changes made after it was built are still dirty, so they reach
+        its clients with the next delta.
+        """
+        if self._snapshot_version != self.version:
+            self._snapshot_version = self.version
+            self._snapshot_frames = {}
+        frame = self._snapshot_frames.get(encoding)
+        if frame is None:
+            frame = self._snapshot_frames[encoding] = encode(self.snapshot(), encoding)
+        return frame
+
+    def changes_since(self, since: int):
+        """IDs of the sensors changed after version `since`, or None when the log no longer reaches back to it."""
+        if since > self.version:
+            return None
+        if since == self.version:
+            return set()
+        if not self.changes or self.changes[0][0] > since + 1:
+            return None
+        changed = set()
+        for version, sensor_ids in reversed(self.changes):
+            if version <= since:
+                break
+            changed |= sensor_ids
+        return changed
+
+    def resume(self, since: int):
+        """Delta from version `since` to the current one, or None when a full snapshot is needed."""
+        changed = self.changes_since(since)
+        if changed is None:
+            return None
+        return {
+            "type": "delta",
+            "version": self.version,
+            "epoch": self.epoch,
+            "dashboard": sensor_state.summary(),
+            "sensors": [sensor_state.sensors[sensor_id] for sensor_id in changed if sensor_id in sensor_state.sensors],
+        }
+
+    def apply(self, changed_sensors: list[dict]):
+        """Record changed sensors and schedule a coalesced delta broadcast."""
+        for sensor in changed_sensors:
+            self._dirty.add(sensor["sensor_id"])
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Broadcast the sensors changed since the last flush and the summary fields that moved."""
+        if not self._dirty:
+            return
+
+        changed_ids, self._dirty = self._dirty, set()
+        summary = sensor_state.summary()
+        summary_delta = {key: value for key, value in summary.items() if self.summary.get(key) != value}
+        self.summary = summary
+        self.version += 1
+        self.changes.append((self.version, changed_ids))
+        changed = [sensor_state.sensors[sensor_id] for sensor_id in changed_ids]
+
+        manager.publish_to(manager.subscriptions.everything, {
+            "type": "delta",
+            "version": self.version,
+            "dashboard": summary_delta,
+            "sensors": changed,
+        })
+
+        # Clients with the same changes share one encoded frame
+        groups: dict = {}
+        for websocket, (entries, removed) in manager.subscriptions.route(changed).items():
+            key = (tuple(entry["sensor_id"] for entry in entries), tuple(removed))
+            groups.setdefault(key, (entries, removed, []))[2].append(websocket)
+        for entries, removed, websockets in groups.values():
+            manager.publish_to(websockets, {
+                "type": "delta",
+                "version": self.version,
+                "dashboard": summary,
+                "sensors": entries,
+                "removed": removed,
+            })
+
+        # Import inside the function to avoid circular import
+        from routes.dashboard_route import notify_dashboard_clients, notify_breakdown_clients
+        await notify_dashboard_clients(changed)
+        notify_breakdown_clients()
 
-    async def broadcast(self, message: dict):
-        """Send a message to all connected clients."""
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except WebSocketDisconnect:
-                self.disconnect(connection)
 
+dashboard_state = DashboardState()
 
-manager = ConnectionManager()
+
+def send_snapshot(websocket: WebSocket, filters: dict | None = None):
+    """Send a client the snapshot of the sensors matching its filters."""
+    manager.send(websocket, subscribed_snapshot(websocket, filters))
+
+
+def subscribed_snapshot(websocket: WebSocket, filters: dict | None = None):
+    """Filtered snapshot for a client, recording which sensors it now has."""
+    snapshot = dashboard_state.snapshot(filters)
+    manager.subscriptions.hold(websocket, (sensor["sensor_id"] for sensor in snapshot["sensors"]))
+    return snapshot
+
+
+manager.resync = lambda websocket: subscribed_snapshot(websocket, manager.subscriptions.filters.get(websocket))
+
+
+@websocket_router.get("/stats")
+async def broadcast_stats():
+    """API to inspect WebSocket fan-out: clients, counters and delivery latency per hub."""
+    return {name: hub.stats() for name, hub in hubs.items()}
 
 
 @websocket_router.websocket("/sensor-dashboard")
 async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
     """
     WebSocket endpoint to send real-time dashboard updates.
+    Clients receive a versioned snapshot on connect, then deltas of the changed sensors.
+    A client reconnecting with ?since=<version>&epoch=<epoch> of the last message it applied
+    only receives the sensors changed since, as one delta, while the change log reaches back.
+    A client watching some sensors only passes its filters in the URL, e.g.
+    ?locations=Building%20A&types=temperature, and gets the filtered snapshot as its first
+    message. A subscribe message changes them later, e.g.
+    {"action": "subscribe", "locations": ["Building A"], "types": ["temperature"]},
+    and is answered with a filtered snapshot.
     """
     await manager.connect(websocket)
     try:
-        # Send initial data to the client
-        await send_initial_data(websocket, db)
+        filters = parse_query_subscription(websocket.query_params)
+        if filters:
+            if not sensor_state.loaded:
+                await sensor_state.warm(db)
+            manager.subscribe(websocket, filters)
+            DASHBOARD_SYNCS.inc(kind="snapshot")
+            send_snapshot(websocket, filters)
+        else:
+            # Send initial data to the client
+            try:
+                since = int(websocket.query_params["since"]) if "since" in websocket.query_params else None
+            except ValueError:
+                since = None
+            await send_initial_data(websocket, db, since, websocket.query_params.get("epoch"))
 
-        # Keep the connection alive
-        while True:
-            await asyncio.sleep(1)
+        await manager.receive_subscriptions(websocket, send_snapshot)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
-async def send_initial_data(websocket: WebSocket, db: AsyncSession):
+async def send_initial_data(websocket: WebSocket, db: AsyncSession, since: int | None = None, epoch: str | None = None):
     """
-    Send the initial dashboard data to the connected WebSocket client.
+    Send the initial dashboard state to the connected WebSocket client: the changes after
+    version `since` of `epoch` when the change log still has them, the shared full snapshot otherwise.
     """
-    # Fetch all sensor data
-    sensor_data_query = select(SensorData)
-    sensor_data_result = await db.execute(sensor_data_query)
-    all_sensor_data = sensor_data_result.scalars().all()
-
-    # Fetch all sensor reliability data
-    reliability_query = select(SensorReliability)
-    reliability_result = await db.execute(reliability_query)
-    all_reliability_data = {r.sensor_id: r for r in reliability_result.scalars().all()}
-
-    # Combine sensor data with reliability data
-    combined_sensor_data = []
-    for sensor in all_sensor_data:
-        reliability = all_reliability_data.get(sensor.sensor_id)
-        combined_sensor_data.append({
-            "sensor_id": sensor.sensor_id,
-            "name": sensor.name,
-            "type": sensor.type.value,
-            "location": sensor.location,
-            "value": sensor.value,
-            "unit": sensor.unit,
-            "timestamp": sensor.timestamp.isoformat(),
-            "status": sensor.status.value,
-            "reliability_score": reliability.score if reliability else None,
-            "data_variance": reliability.variance if reliability else None,
-            "update_frequency": reliability.update_frequency if reliability else None,
-        })
+    if not sensor_state.loaded:
+        await sensor_state.warm(db)
+    # Versions are only comparable within an epoch, so a resume without one gets a snapshot
+    if since is not None and epoch == dashboard_state.epoch:
+        resumed = dashboard_state.resume(since)
+        if resumed is not None:
+            DASHBOARD_SYNCS.inc(kind="resume")
+            manager.send(websocket, resumed)
+            return
+    encoding = manager.encoding_of(websocket)
+    if encoding:
+        DASHBOARD_SYNCS.inc(kind="snapshot")
+        manager.send_frame(websocket, dashboard_state.snapshot_frame(encoding))
+
 
-    # Calculate dashboard summary
-    total_sensors = len(all_sensor_data)
-    online_sensors = sum(1 for sensor in all_sensor_data if sensor.status.value == "online")
-    warning_sensors = sum(1 for sensor in all_sensor_data if sensor.status.value in ["warning", "error"])
-    average_reliability = (
-        sum(r.score for r in all_reliability_data.values()) / len(all_reliability_data)
-        if all_reliability_data else 0
-    )
-
-    dashboard_summary = {
-        "total_sensors": total_sensors,
-        "online_sensors": online_sensors,
-        "warning_sensors": warning_sensors,
-        "average_reliability": round(average_reliability, 2),
-    }
-
-    # Combine dashboard summary and sensor details
-    message = {
-        "dashboard": dashboard_summary,
-        "sensors": combined_sensor_data,
-    }
-
-    # Send the initial data to the connected client
-    await websocket.send_json(message)
-
-
-async def notify_clients(db: AsyncSession):
+async def notify_clients(changed_sensors: list[dict]):
     """
-    Notify all connected WebSocket clients with the updated dashboard data.
+    Notify all connected WebSocket clients about changed sensors.
+    The changes are published once on the bus, and every worker applies them to its
+    latest-state store and sends them to its own clients (see `apply_sensor_changes`).
     """
-    # Fetch all sensor data
-    sensor_data_query = select(SensorData)
-    sensor_data_result = await db.execute(sensor_data_query)
-    all_sensor_data = sensor_data_result.scalars().all()
-
-    # Fetch all sensor reliability data
-    reliability_query = select(SensorReliability)
-    reliability_result = await db.execute(reliability_query)
-    all_reliability_data = {r.sensor_id: r for r in reliability_result.scalars().all()}
-
-    # Combine sensor data with reliability data
-    combined_sensor_data = []
-    for sensor in all_sensor_data:
-        reliability = all_reliability_data.get(sensor.sensor_id)
-        combined_sensor_data.append({
-            "sensor_id": sensor.sensor_id,
-            "name": sensor.name,
-            "type": sensor.type.value,
-            "location": sensor.location,
-            "value": sensor.value,
-            "unit": sensor.unit,
-            "timestamp": sensor.timestamp.isoformat(),
-            "status": sensor.status.value,
-            "reliability_score": reliability.score if reliability else None,
-            "data_variance": reliability.variance if reliability else None,
-            "update_frequency": reliability.update_frequency if reliability else None,
-        })
+    if changed_sensors:
+        await bus.publish("sensor-changes", changed_sensors)
+
+
+async def apply_sensor_changes(changed_sensors: list[dict]):
+    """
+    Update the latest-state store of this worker with changed sensors from the bus and
+    queue them for its dashboards, coalesced into a single delta per flush window.
+    """
+    for entry in changed_sensors:
+        sensor_state.update(entry)
+    dashboard_cache.invalidate()
+    dashboard_state.apply(changed_sensors)
+
+
+async def resync_sensor_changes():
+    """
+    Catch up with the sensor changes other workers published while the bus was down: reload
+    the latest-state store and send the sensors that differ as a new version, which clients
+    resuming from before the outage then receive too.
+    """
+    if not sensor_state.loaded:
+        return
+    async with AsyncSessionLocal() as db:
+        changed_sensors = await sensor_state.reload(db)
+    if changed_sensors:
+        dashboard_cache.invalidate()
+        dashboard_state.apply(changed_sensors)
+
 
-    # Calculate dashboard summary
-    total_sensors = len(all_sensor_data)
-    online_sensors = sum(1 for sensor in all_sensor_data if sensor.status.value == "online")
-    warning_sensors = sum(1 for sensor in all_sensor_data if sensor.status.value in ["warning", "error"])
-    average_reliability = (
-        sum(r.score for r in all_reliability_data.values()) / len(all_reliability_data)
-        if all_reliability_data else 0
-    )
-
-    dashboard_summary = {
-        "total_sensors": total_sensors,
-        "online_sensors": online_sensors,
-        "warning_sensors": warning_sensors,
-        "average_reliability": round(average_reliability, 2),
-    }
-
-    # Combine dashboard summary and sensor details
-    message = {
-        "dashboard": dashboard_summary,
-        "sensors": combined_sensor_data,
-    }
-
-    # Broadcast the data to all connected clients
-    await manager.broadcast(message)
\ No newline at end of file
+bus.subscribe("sensor-changes", apply_sensor_changes)
+bus.on_reconnect(resync_sensor_changes)
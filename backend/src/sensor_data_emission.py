@@ -1,55 +1,317 @@
+"""
+Simulate sensors sending readings to the ingest WebSocket, and measure the server while doing so.
+
+Sensors are spread over concurrent connections. Readings are sent open-loop at a target
+aggregate rate: every frame has a scheduled send time, and its latency is measured from that
+time to the server's ack, so a server that falls behind shows up as latency instead of
+silently slowing the generator down. Acks arrive in the order the frames were sent on a
+connection, so each ack (or error) is matched to the oldest unanswered frame.
+
+With --seq every reading carries a sequence number and a timestamp. The server then answers
+with cumulative acks per sensor once readings are written, frames are pipelined without
+waiting for them, and readings not acknowledged when a connection drops are resent after
+reconnecting; the server skips those it already stored.
+
+Usage:
+    python sensor_data_emission.py ws://127.0.0.1:8000/sensor_data/ws/sensor-data
+    python sensor_data_emission.py ws://127.0.0.1:8000/sensor_data/ws/sensor-data \\
+        --sensors 5000 --connections 50 --rate 10000 --batch-size 20 --duration 60 --output load.json
+    python sensor_data_emission.py ws://127.0.0.1:8000/sensor_data/ws/sensor-data --seq --rate 10000 --batch-size 20
+"""
+import argparse
 import asyncio
 import random
 import json
-import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
 from websockets import connect, WebSocketException
 
-async def emit_sensor_data(server_url, variance, sensor_ids, interval):
-    """Emit random sensor data to the WebSocket server."""
-    while True:
+SENSOR_TYPES = {"temperature": "°C", "humidity": "%", "pressure": "hPa", "air_quality": "AQI"}
+
+
+def percentile(latencies, fraction):
+    """Percentile of sorted latencies in milliseconds."""
+    if not latencies:
+        return 0.0
+    return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 3)
+
+
+class Stats:
+    """Counters and ack latencies, per report interval and for the whole run."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.interval_started = self.started
+        self.totals = {"sent": 0, "acked": 0, "errors": 0, "lost": 0, "resent": 0}
+        self.interval = dict(self.totals)
+        self.latencies: list[float] = []
+        self.interval_latencies: list[float] = []
+        self.reports: list[dict] = []
+
+    def count(self, key, readings=1):
+        self.totals[key] += readings
+        self.interval[key] += readings
+
+    def ack(self, latency, readings):
+        self.count("acked", readings)
+        self.latencies.append(latency)
+        self.interval_latencies.append(latency)
+
+    def summarize(self, counts, latencies, seconds):
+        latencies = sorted(latencies)
+        return {
+            "seconds": round(seconds, 3),
+            **counts,
+            "sent_per_second": round(counts["sent"] / seconds, 1) if seconds else 0.0,
+            "acked_per_second": round(counts["acked"] / seconds, 1) if seconds else 0.0,
+            "latency_p50_ms": percentile(latencies, 0.5),
+            "latency_p99_ms": percentile(latencies, 0.99),
+            "latency_p999_ms": percentile(latencies, 0.999),
+            "latency_max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        }
+
+    def report(self):
+        """Close the current interval and print its numbers."""
+        now = time.perf_counter()
+        report = {
+            "elapsed": round(now - self.started, 1),
+            **self.summarize(self.interval, self.interval_latencies, now - self.interval_started),
+        }
+        self.reports.append(report)
+        print(json.dumps(report))
+        self.interval = {key: 0 for key in self.totals}
+        self.interval_latencies = []
+        self.interval_started = now
+
+    def total(self):
+        return self.summarize(self.totals, self.latencies, time.perf_counter() - self.started)
+
+
+@lru_cache(maxsize=None)
+def sensor_profile(sensor_id):
+    """Type, unit and location of a simulated sensor, the same on every run."""
+    generator = random.Random(sensor_id)
+    sensor_type = generator.choice(list(SENSOR_TYPES))
+    return sensor_type, SENSOR_TYPES[sensor_type], f"Room {generator.randint(1, 10)}"
+
+
+def generate_reading(sensor_id, variance):
+    """Random reading of a sensor."""
+    sensor_type, unit, location = sensor_profile(sensor_id)
+    return {
+        "sensor_id": sensor_id,
+        "name": f"Sensor {sensor_id}",
+        "type": sensor_type,
+        "location": location,
+        "value": round(random.uniform(20, 100) + random.uniform(-variance, variance), 2),
+        "unit": unit,
+        "status": random.choices(["online", "offline", "warning", "error"], weights=[85, 5, 7, 3])[0],
+    }
+
+
+async def emit_sensor_data(server_url, variance, sensor_ids, frame_rate, batch_size, deadline, stats):
+    """
+    Send readings of `sensor_ids` over one connection at `frame_rate` frames per second until
+    `deadline`, reconnecting when the connection drops.
+    """
+    next_sensor = 0
+    next_send = time.perf_counter()
+    while time.perf_counter() < deadline:
+        # Scheduled send time and reading count of every frame not answered yet
+        pending: deque = deque()
         try:
-            async with connect(server_url) as websocket:
-                print(f"Connected to WebSocket server at {server_url}")
-
-                while True:
-                    for sensor_id in sensor_ids:
-                        # Generate random sensor data with the specified variance
-                        sensor_data = {
-                            "sensor_id": sensor_id,
-                            "name": f"Sensor {sensor_id}",
-                            "type": random.choice(["temperature", "humidity", "pressure", "air_quality"]),
-                            "location": f"Room {random.randint(1, 10)}",
-                            "value": round(random.uniform(20, 100) + random.uniform(-variance, variance), 2),
-                            "unit": random.choice(["°C", "%", "hPa", "AQI"]),
-                            "status": random.choice(["online", "offline", "warning", "error"]),
-                        }
-
-                        # Send the data to the WebSocket server
-                        await websocket.send(json.dumps(sensor_data))
-                        print(f"Sent data: {sensor_data}")
-
-                    # Wait for the specified interval before sending the next batch
-                    await asyncio.sleep(interval)
-
-        except WebSocketException as e:
+            async with connect(server_url, max_queue=None) as websocket:
+                receiver = asyncio.create_task(receive_acks(websocket, pending, stats))
+                try:
+                    while time.perf_counter() < deadline:
+                        # Open loop: wait for the frame's scheduled time, never for the server
+                        delay = next_send - time.perf_counter()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        if receiver.done():
+                            receiver.result()
+
+                        readings = []
+                        for _ in range(batch_size):
+                            readings.append(generate_reading(sensor_ids[next_sensor], variance))
+                            next_sensor = (next_sensor + 1) % len(sensor_ids)
+                        frame = readings if batch_size > 1 else readings[0]
+
+                        pending.append((next_send, len(readings)))
+                        await websocket.send(json.dumps(frame))
+                        stats.count("sent", len(readings))
+                        next_send += 1 / frame_rate
+
+                    # Give the last frames a moment to be answered
+                    grace = time.perf_counter() + 5
+                    while pending and time.perf_counter() < grace and not receiver.done():
+                        await asyncio.sleep(0.05)
+                finally:
+                    receiver.cancel()
+        except (WebSocketException, OSError) as e:
             print(f"WebSocket error: {e}")
-            print("Reconnecting in 5 seconds...")
-            await asyncio.sleep(5)
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-            break
+            await asyncio.sleep(1)
+            # Don't try to catch up on the frames missed while disconnected
+            next_send = max(next_send, time.perf_counter())
+        finally:
+            for _, readings in pending:
+                stats.count("lost", readings)
+
+
+async def receive_acks(websocket, pending, stats):
+    """Match every ack or error to the oldest unanswered frame of the connection."""
+    async for message in websocket:
+        received = time.perf_counter()
+        response = json.loads(message)
+        if "event" in response or not pending:
+            # Broadcast of data posted by someone else, not an answer to this connection
+            continue
+        if "readings" in response:
+            # Readings acked earlier that the server failed to write, not an answer either
+            stats.count("errors", response["count"])
+            continue
+
+        scheduled, readings = pending.popleft()
+        if "error" in response:
+            stats.count("errors", readings)
+        else:
+            stats.ack(received - scheduled, readings)
+
+
+async def emit_sequenced_data(server_url, variance, sensor_ids, frame_rate, batch_size, deadline, stats):
+    """
+    Like `emit_sensor_data`, with a seq on every reading. Readings stay unacknowledged until a
+    cumulative ack of their sensor covers their seq, and are resent after a reconnect until then.
+    """
+    next_sensor = 0
+    next_send = time.perf_counter()
+    # Seqs start at the current time in microseconds, so they keep increasing from run to run
+    next_seq = dict.fromkeys(sensor_ids, time.time_ns() // 1000)
+    # Per sensor, in seq order: (seq, scheduled send time, reading) of every reading not acknowledged
+    unacked = {sensor_id: deque() for sensor_id in sensor_ids}
+    try:
+        while time.perf_counter() < deadline:
+            try:
+                async with connect(server_url, max_queue=None) as websocket:
+                    receiver = asyncio.create_task(receive_cumulative_acks(websocket, unacked, stats))
+                    try:
+                        # Whatever the last connection left unacknowledged goes first
+                        backlog = sorted((entry for entries in unacked.values() for entry in entries), key=lambda entry: entry[1])
+                        for start in range(0, len(backlog), batch_size):
+                            await websocket.send(json.dumps([reading for _, _, reading in backlog[start:start + batch_size]]))
+                        stats.count("resent", len(backlog))
+
+                        while time.perf_counter() < deadline:
+                            # Open loop: wait for the frame's scheduled time, never for the server
+                            delay = next_send - time.perf_counter()
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+                            if receiver.done():
+                                receiver.result()
+
+                            readings = []
+                            for _ in range(batch_size):
+                                sensor_id = sensor_ids[next_sensor]
+                                reading = generate_reading(sensor_id, variance)
+                                reading["seq"] = next_seq[sensor_id]
+                                reading["timestamp"] = datetime.now(timezone.utc).isoformat()
+                                next_seq[sensor_id] += 1
+                                unacked[sensor_id].append((reading["seq"], next_send, reading))
+                                readings.append(reading)
+                                next_sensor = (next_sensor + 1) % len(sensor_ids)
+
+                            await websocket.send(json.dumps(readings if batch_size > 1 else readings[0]))
+                            stats.count("sent", len(readings))
+                            next_send += 1 / frame_rate
+
+                        # Give the last readings a moment to be acknowledged
+                        grace = time.perf_counter() + 5
+                        while any(unacked.values()) and time.perf_counter() < grace and not receiver.done():
+                            await asyncio.sleep(0.05)
+                    finally:
+                        receiver.cancel()
+            except (WebSocketException, OSError) as e:
+                print(f"WebSocket error: {e}")
+                await asyncio.sleep(1)
+                next_send = max(next_send, time.perf_counter())
+    finally:
+        stats.count("lost", sum(len(entries) for entries in unacked.values()))
+
+
+async def receive_cumulative_acks(websocket, unacked, stats):
+    """
+    Settle the readings covered by every cumulative ack. An overloaded server that rejects readings
+    closes the connection; they stay unacknowledged and are resent after reconnecting.
+    """
+    async for message in websocket:
+        received = time.perf_counter()
+        response = json.loads(message)
+        if "ack" in response:
+            for sensor_id, seq in response["ack"].items():
+                entries = unacked.get(sensor_id)
+                while entries and entries[0][0] <= seq:
+                    stats.ack(received - entries.popleft()[1], 1)
+        elif "seqs" in response:
+            stats.count("errors", len(response["seqs"]))
+
+
+async def run_load(args):
+    sensor_ids = args.sensor_ids.split(",") if args.sensor_ids else [f"sensor_{index}" for index in range(args.sensors)]
+    connections = min(args.connections, len(sensor_ids))
+    frame_rate = args.rate / args.batch_size / connections
+    deadline = time.perf_counter() + args.duration
+    stats = Stats()
+
+    async def report_every_interval():
+        while True:
+            await asyncio.sleep(args.report_interval)
+            stats.report()
+
+    reporter = asyncio.create_task(report_every_interval())
+    emit = emit_sequenced_data if args.seq else emit_sensor_data
+    try:
+        await asyncio.gather(*(
+            emit(
+                args.server_url, args.variance, sensor_ids[index::connections],
+                frame_rate, args.batch_size, deadline, stats,
+            )
+            for index in range(connections)
+        ))
+    finally:
+        reporter.cancel()
+
+    summary = {
+        "server_url": args.server_url,
+        "sensors": len(sensor_ids),
+        "connections": connections,
+        "target_rate": args.rate,
+        "batch_size": args.batch_size,
+        "seq": args.seq,
+        "total": stats.total(),
+        "intervals": stats.reports,
+    }
+    print(json.dumps(summary["total"], indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(summary, output, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("server_url", help="Ingest WebSocket URL, e.g. ws://127.0.0.1:8000/sensor_data/ws/sensor-data")
+    parser.add_argument("--sensors", type=int, default=100, help="Number of simulated sensors (sensor_0, sensor_1, ...)")
+    parser.add_argument("--sensor-ids", help="Comma-separated sensor IDs, instead of --sensors")
+    parser.add_argument("--connections", type=int, default=10, help="Concurrent WebSocket connections")
+    parser.add_argument("--rate", type=float, default=100, help="Target readings per second over all connections")
+    parser.add_argument("--batch-size", type=int, default=1, help="Readings per frame; above 1 frames are JSON arrays")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send for")
+    parser.add_argument("--variance", type=float, default=5, help="Random variation of the readings (±)")
+    parser.add_argument("--report-interval", type=float, default=5, help="Seconds between interval reports")
+    parser.add_argument("--seq", action="store_true", help="Send sequence numbers and rely on cumulative acks, resending after reconnects")
+    parser.add_argument("--output", help="Write the summary and interval reports as JSON to this file")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    # Parse command-line arguments
-    if len(sys.argv) < 5:
-        print("Usage: python sensor_data_emission.py <server_url> <variance> <interval> <sensor_ids>")
-        print("Example: python sensor_data_emission.py ws://127.0.0.1:8000/sensor_data/ws/sensor-data 5 2 sensor_1,sensor_2,sensor_3")
-        sys.exit(1)
-
-    server_url = sys.argv[1]  # WebSocket server URL
-    variance = float(sys.argv[2])  # Variance in sensor data
-    interval = float(sys.argv[3])  # Time interval between emissions (in seconds)
-    sensor_ids = sys.argv[4].split(",")  # List of sensor IDs (comma-separated)
-
-    # Run the emission script
-    asyncio.run(emit_sensor_data(server_url, variance, sensor_ids, interval))
\ No newline at end of file
+    asyncio.run(run_load(parse_args()))
@@ -0,0 +1,379 @@
+from sqlalchemy import delete, func
+from sqlalchemy.future import select
+from models.sensor_data import SensorData
+from datetime import date, datetime, timedelta, timezone
+from array import array
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+import numpy as np
+import asyncio
+import bisect
+import fcntl
+import functools
+import json
+import os
+import time
+
+# Directory of the cold tier: one subdirectory per day holding Arrow IPC files
+ARCHIVE_DIR = os.getenv("SENSOR_DATA_ARCHIVE_DIR", "sensor_data_archive")
+
+# Whole days of readings older than this many days are moved to the cold tier (unset keeps everything in sensor_data)
+ARCHIVE_AFTER_DAYS = os.getenv("SENSOR_DATA_ARCHIVE_AFTER_DAYS")
+
+# How often the archiver runs (in seconds)
+ARCHIVE_INTERVAL = float(os.getenv("SENSOR_DATA_ARCHIVE_INTERVAL", "3600"))
+
+# Rows per record batch written, and per chunk of ids deleted from sensor_data
+ARCHIVE_BATCH_SIZE = 10000
+ARCHIVE_DELETE_CHUNK_SIZE = 1000
+
+# Columns of an archived reading, in file order; enums are stored as their values
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("sensor_id", pa.string()),
+    ("name", pa.string()),
+    ("type", pa.string()),
+    ("location", pa.string()),
+    ("value", pa.float64()),
+    ("unit", pa.string()),
+    ("timestamp", pa.timestamp("us")),  # Naive UTC
+    ("status", pa.string()),
+])
+ARCHIVE_COLUMNS = ARCHIVE_SCHEMA.names
+
+# Extra column of every archived file: the positions of its rows in (timestamp, id) order
+TIME_ORDER_COLUMN = "time_order"
+ARCHIVE_FILE_SCHEMA = ARCHIVE_SCHEMA.append(pa.field(TIME_ORDER_COLUMN, pa.int64()))
+
+# Footers of archived files kept parsed in memory
+FOOTER_CACHE_SIZE = 4096
+
+
+def naive_utc(timestamp: datetime):
+    """A datetime as naive UTC, the way archived timestamps are stored."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def day_directory(day: date):
+    return os.path.join(ARCHIVE_DIR, day.isoformat())
+
+
+def archived_days():
+    """Days with archived readings, oldest first."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    days = []
+    for name in os.listdir(ARCHIVE_DIR):
+        try:
+            days.append(date.fromisoformat(name))
+        except ValueError:
+            continue
+    return sorted(days)
+
+
+def day_parts(day: date):
+    """Files of an archived day. Each is sorted by (sensor_id, timestamp, id), with its (timestamp, id) order in TIME_ORDER_COLUMN."""
+    directory = day_directory(day)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".arrow"))
+
+
+@functools.lru_cache(maxsize=FOOTER_CACHE_SIZE)
+def part_footer(path: str):
+    """
+    Row range of every sensor in an archived file, and its first and last timestamps (None in
+    files written before they were kept). Files are never rewritten, so each footer is parsed once.
+    """
+    metadata = ipc.open_file(pa.memory_map(path)).metadata
+    timestamps = metadata.get(b"timestamps")
+    return {
+        "sensors": json.loads(metadata[b"sensors"]),
+        "timestamps": [datetime.fromisoformat(timestamp) for timestamp in json.loads(timestamps)] if timestamps else None,
+    }
+
+
+def read_part(path: str, columns: list[str], sensor_id: str | None = None):
+    """
+    Columns of an archived file, or of one sensor's rows in it, memory-mapped: only the pages
+    of the selected columns (and rows) are read from disk, and nothing is copied.
+    """
+    table = ipc.open_file(pa.memory_map(path)).read_all()
+    if sensor_id is not None:
+        offset, length = part_footer(path)["sensors"].get(sensor_id, (0, 0))
+        table = table.slice(offset, length)
+    return table.select(columns)
+
+
+def read_day(paths: list[str], columns: list[str], sensor_id: str | None = None):
+    tables = [read_part(path, columns, sensor_id) for path in paths]
+    if not tables:
+        return pa.table({column: pa.array([], ARCHIVE_SCHEMA.field(column).type) for column in columns})
+    return pa.concat_tables(tables)
+
+
+def ordered_part(path: str, columns: list[str], sensor_id: str | None, lower: tuple):
+    """
+    Rows of one archived file in (timestamp, id) order, from the first one after `lower` (a
+    (microseconds, id) key), in chunks, without sorting: a sensor's rows are stored in that
+    order, and the rows of the whole file are taken through TIME_ORDER_COLUMN. The start is
+    found by bisection, so a page deep into a day only reads the rows it returns.
+    """
+    if sensor_id is not None:
+        table = read_part(path, columns, sensor_id)
+        order = None
+    else:
+        table = read_part(path, columns + [TIME_ORDER_COLUMN])
+        order = table[TIME_ORDER_COLUMN]
+        table = table.select(columns)
+
+    timestamps, ids = table["timestamp"], table["id"]
+
+    def key(position):
+        row = position if order is None else order[position].as_py()
+        return (timestamps[row].value, ids[row].as_py())
+
+    position = bisect.bisect_right(range(table.num_rows), lower, key=key)
+    for start in range(position, table.num_rows, ARCHIVE_BATCH_SIZE):
+        if order is None:
+            yield table.slice(start, ARCHIVE_BATCH_SIZE)
+        else:
+            yield table.take(order.slice(start, ARCHIVE_BATCH_SIZE))
+
+
+def scan_archive(filters: dict, after: tuple | None = None, columns: list[str] = ARCHIVE_COLUMNS):
+    """
+    Archived readings matching the filters of GET /sensor_data/ (sensor_id, type, status,
+    location, start, end) and coming after the (timestamp, id) of `after`, as tables ordered by
+    (timestamp, id), oldest first.
+    """
+    start = naive_utc(filters["start"]) if filters.get("start") is not None else None
+    end = naive_utc(filters["end"]) if filters.get("end") is not None else None
+    if after is not None:
+        after = (naive_utc(after[0]), after[1])
+    first_day = max(day for day in (start and start.date(), after and after[0].date(), date.min) if day)
+    sensor_id = filters.get("sensor_id")
+
+    # Key of the last row to skip: the cursor, or anything before the start
+    lower = max(
+        (int(pa.scalar(after[0], pa.timestamp("us")).value), after[1]) if after is not None else (float("-inf"), 0),
+        (int(pa.scalar(start, pa.timestamp("us")).value), float("-inf")) if start is not None else (float("-inf"), 0),
+    )
+
+    # Columns needed to filter and order, whether they are returned or not
+    needed = list(dict.fromkeys(columns + ["timestamp", "id"] + [key for key in ("type", "status", "location") if filters.get(key) is not None]))
+
+    def matching(table):
+        mask = pa.array(np.ones(table.num_rows, dtype=bool))
+        timestamps = table["timestamp"]
+        if start is not None:
+            mask = pc.and_(mask, pc.greater_equal(timestamps, pa.scalar(start, pa.timestamp("us"))))
+        if end is not None:
+            mask = pc.and_(mask, pc.less(timestamps, pa.scalar(end, pa.timestamp("us"))))
+        for key in ("type", "status", "location"):
+            if filters.get(key) is not None:
+                value = getattr(filters[key], "value", filters[key])
+                mask = pc.and_(mask, pc.equal(table[key], value))
+        if after is not None:
+            after_timestamp = pa.scalar(after[0], pa.timestamp("us"))
+            mask = pc.and_(mask, pc.or_(
+                pc.greater(timestamps, after_timestamp),
+                pc.and_(pc.equal(timestamps, after_timestamp), pc.greater(table["id"], after[1])),
+            ))
+        return table.filter(mask)
+
+    for day in archived_days():
+        if day < first_day:
+            continue
+        if end is not None and datetime.combine(day, datetime.min.time()) >= end:
+            break
+
+        # Files entirely before the cursor (or start) or after the end are not opened
+        parts = []
+        for path in day_parts(day):
+            timestamps = part_footer(path)["timestamps"]
+            if timestamps and (
+                (after is not None and timestamps[1] < after[0])
+                or (start is not None and timestamps[1] < start)
+                or (end is not None and timestamps[0] >= end)
+            ):
+                continue
+            parts.append(path)
+
+        if len(parts) == 1 and part_footer(parts[0])["timestamps"]:
+            for chunk in ordered_part(parts[0], needed, sensor_id, lower):
+                if end is not None and chunk.num_rows and chunk["timestamp"][0].as_py() >= end:
+                    break
+                chunk = matching(chunk)
+                if chunk.num_rows:
+                    yield chunk.select(columns)
+            continue
+
+        # Days archived in several runs (late readings), or files without their time order: sorted here
+        table = matching(read_day(parts, needed, sensor_id))
+        if table.num_rows:
+            yield table.sort_by([("timestamp", "ascending"), ("id", "ascending")]).select(columns)
+
+
+def archived_series(sensor_id: str, start: datetime | None = None, end: datetime | None = None, limit: int | None = None):
+    """Up to `limit` (timestamp, value) readings of a sensor from the cold tier, oldest first."""
+    points = []
+    for table in scan_archive({"sensor_id": sensor_id, "start": start, "end": end}, columns=["timestamp", "value"]):
+        points.extend(zip(table["timestamp"].to_pylist(), table["value"].to_pylist()))
+        if limit is not None and len(points) >= limit:
+            break
+    return points[:limit]
+
+
+def archived_history(sensor_positions: dict):
+    """
+    Sensor position, epoch seconds and value of every archived reading of the given sensors
+    (`{sensor_id: position}`), as arrays.
+    """
+    codes, timestamps, values = [], [], []
+    for day in archived_days():
+        for path in day_parts(day):
+            ranges = part_footer(path)["sensors"]
+            if not any(sensor_id in ranges for sensor_id in sensor_positions):
+                continue
+            table = read_part(path, ["timestamp", "value"])
+            for sensor_id, position in sensor_positions.items():
+                offset, length = ranges.get(sensor_id, (0, 0))
+                if not length:
+                    continue
+                rows = table.slice(offset, length)
+                codes.append(np.full(length, position, dtype=np.int64))
+                timestamps.append(rows["timestamp"].to_numpy().astype("datetime64[us]").astype(np.int64) / 1e6)
+                values.append(rows["value"].to_numpy())
+    if not codes:
+        return np.empty(0, np.int64), np.empty(0), np.empty(0)
+    return np.concatenate(codes), np.concatenate(timestamps), np.concatenate(values)
+
+
+def archived_ids(day: date):
+    """IDs of the readings of a day already in the cold tier."""
+    ids = [read_part(path, ["id"])["id"].to_numpy() for path in day_parts(day)]
+    return np.concatenate(ids) if ids else np.empty(0, np.int64)
+
+
+async def archive_day(day: date, db):
+    """
+    Move the readings of one day from sensor_data to a new Arrow IPC file of that day, sorted by
+    (sensor_id, timestamp, id), with its (timestamp, id) order in TIME_ORDER_COLUMN and the row
+    range of every sensor and the first and last timestamps in its footer. The file is in
+    place before the rows are deleted; rows of an earlier run that were archived but not deleted
+    are only deleted. Returns the number of readings archived.
+    """
+    start = datetime.combine(day, datetime.min.time())
+    already_archived = set(archived_ids(day).tolist())
+
+    result = await db.stream(
+        select(*[getattr(SensorData, column) for column in ARCHIVE_COLUMNS])
+        .where(SensorData.timestamp >= start, SensorData.timestamp < start + timedelta(days=1))
+        .order_by(SensorData.sensor_id, SensorData.timestamp, SensorData.id)
+        .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+    )
+
+    os.makedirs(day_directory(day), exist_ok=True)
+    path = os.path.join(day_directory(day), f"part-{time.time_ns()}.arrow")
+    ranges: dict[str, list] = {}
+    written = 0
+    delete_ids = array("q")
+
+    # The footer (with the sensor ranges) and the time order are only known at the end, so the
+    # batches are first streamed to a scratch file and then copied from its memory map into the final file
+    with ipc.new_file(path + ".rows", ARCHIVE_SCHEMA) as scratch:
+        async for partition in result.partitions():
+            delete_ids.extend(row.id for row in partition)
+            rows = [row for row in partition if row.id not in already_archived]
+            if not rows:
+                continue
+            for row in rows:
+                if row.sensor_id not in ranges:
+                    ranges[row.sensor_id] = [written, 0]
+                ranges[row.sensor_id][1] += 1
+                written += 1
+            scratch.write_batch(pa.record_batch([
+                pa.array([row.id for row in rows], pa.int64()),
+                pa.array([row.sensor_id for row in rows], pa.string()),
+                pa.array([row.name for row in rows], pa.string()),
+                pa.array([row.type.value for row in rows], pa.string()),
+                pa.array([row.location for row in rows], pa.string()),
+                pa.array([row.value for row in rows], pa.float64()),
+                pa.array([row.unit for row in rows], pa.string()),
+                pa.array([naive_utc(row.timestamp) for row in rows], pa.timestamp("us")),
+                pa.array([row.status.value for row in rows], pa.string()),
+            ], schema=ARCHIVE_SCHEMA))
+
+    try:
+        if written:
+            rows = ipc.open_file(pa.memory_map(path + ".rows"))
+            table = rows.read_all()
+            order = pc.sort_indices(table, sort_keys=[("timestamp", "ascending"), ("id", "ascending")]).cast(pa.int64())
+            bounds = pc.min_max(table["timestamp"])
+            metadata = {
+                "sensors": json.dumps(ranges),
+                "timestamps": json.dumps([bounds["min"].as_py().isoformat(), bounds["max"].as_py().isoformat()]),
+            }
+            with ipc.new_file(path + ".tmp", ARCHIVE_FILE_SCHEMA, metadata=metadata) as writer:
+                offset = 0
+                for index in range(rows.num_record_batches):
+                    batch = rows.get_batch(index)
+                    writer.write_batch(pa.record_batch([*batch.columns, order.slice(offset, batch.num_rows)], schema=ARCHIVE_FILE_SCHEMA))
+                    offset += batch.num_rows
+            os.replace(path + ".tmp", path)
+    finally:
+        os.remove(path + ".rows")
+
+    for chunk_start in range(0, len(delete_ids), ARCHIVE_DELETE_CHUNK_SIZE):
+        chunk = delete_ids[chunk_start:chunk_start + ARCHIVE_DELETE_CHUNK_SIZE].tolist()
+        await db.execute(delete(SensorData).where(SensorData.id.in_(chunk)))
+    await db.commit()
+    return written
+
+
+async def archive_readings(db, before: date):
+    """Move every whole day of readings before `before` to the cold tier. Returns readings archived per day."""
+    result = await db.execute(select(func.min(SensorData.timestamp)).where(SensorData.timestamp < datetime.combine(before, datetime.min.time())))
+    oldest = result.scalar()
+    if oldest is None:
+        return {}
+
+    archived = {}
+    day = naive_utc(oldest).date()
+    while day < before:
+        count = await archive_day(day, db)
+        if count:
+            archived[day.isoformat()] = count
+        day += timedelta(days=1)
+    return archived
+
+
+async def run_archiver(session_factory, before: date):
+    """
+    Archive the days before `before` once, unless another process (a worker of the API or the
+    archive_sensor_data script) is already archiving. Returns readings archived per day.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with open(os.path.join(ARCHIVE_DIR, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return {}
+        async with session_factory() as db:
+            return await archive_readings(db, before)
+
+
+async def archive_loop(session_factory):
+    """Background job moving old readings to the cold tier."""
+    while True:
+        try:
+            archived = await run_archiver(session_factory, datetime.utcnow().date() - timedelta(days=int(ARCHIVE_AFTER_DAYS)))
+            if archived:
+                print(f"Archived sensor_data readings: {archived}")
+        except Exception as e:
+            print(f"Failed to archive sensor_data readings: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
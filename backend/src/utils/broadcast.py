@@ -0,0 +1,233 @@
+from fastapi import WebSocket
+from collections import deque
+from utils.subscriptions import SubscriptionIndex, parse_subscription
+from utils.encoding import encode, negotiate_encoding
+from utils.metrics import BROADCAST_PUBLISH_SECONDS, BROADCAST_DELIVERY_SECONDS
+from utils.profiling import current_profile
+import asyncio
+import json
+import os
+import time
+
+# Frames a client may have waiting before it counts as a slow consumer
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "64"))
+
+# Number of recent delivery latencies kept for the percentiles
+LATENCY_SAMPLES = 2048
+
+# Every hub, by name, for the stats endpoint
+hubs: dict = {}
+
+
+class BroadcastClient:
+    """A connected WebSocket with its own bounded send queue, drained by its own writer task."""
+    def __init__(self, websocket: WebSocket, queue_size: int, encoding: str):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.task: asyncio.Task | None = None
+
+
+class CloseFrame:
+    """Queued by `BroadcastHub.close` to close a connection behind the frames sent before."""
+    def __init__(self, code: int):
+        self.code = code
+
+
+class BroadcastHub:
+    """
+    Fans messages out to WebSocket clients without letting one client delay the others.
+
+    A message is encoded once per encoding in use (see utils.encoding, negotiated on connect)
+    and put on the send queue of every client; each client's writer
+    task sends at its own pace. When a client's queue is full it is a slow consumer: with the
+    "disconnect" policy it is dropped, with the "latest" policy its queued frames are discarded
+    and replaced by `resync(websocket)` (a full state message for that client) or, without one,
+    by the newest message. Clients start subscribed to everything; `subscriptions` tells which
+    clients want which sensors, for hubs that route per sensor with `publish_to`.
+    """
+    def __init__(self, name: str, overflow: str = "disconnect", resync=None, queue_size: int = BROADCAST_QUEUE_SIZE):
+        self.name = name
+        self.overflow = overflow
+        self.resync = resync
+        self.queue_size = queue_size
+        self.clients: dict[WebSocket, BroadcastClient] = {}
+        self.subscriptions = SubscriptionIndex()
+
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.dropped_clients = 0
+        self.publish_seconds_last = 0.0
+        self.latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        hubs[name] = self
+
+    @property
+    def active_connections(self):
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket):
+        """Accept a WebSocket in the encoding it asked for and start its writer task."""
+        encoding, subprotocol = negotiate_encoding(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        client = BroadcastClient(websocket, self.queue_size, encoding)
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+        self.subscriptions.subscribe(websocket)
+
+    def subscribe(self, websocket: WebSocket, filters: dict | None = None):
+        """Set the sensor filters of a client; no filters means every sensor."""
+        if websocket in self.clients:
+            self.subscriptions.subscribe(websocket, filters)
+
+    async def receive_subscriptions(self, websocket: WebSocket, on_subscribe):
+        """
+        Read client messages until the client goes away. `{"action": "subscribe", ...filters}`
+        replaces the client's filters and `{"action": "unsubscribe"}` clears them; after either,
+        `on_subscribe(websocket, filters)` sends the client its filtered state.
+        """
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+                action = message.get("action") if isinstance(message, dict) else None
+                if action not in ("subscribe", "unsubscribe"):
+                    continue
+                filters = parse_subscription(message) if action == "subscribe" else {}
+            except ValueError as e:
+                self.send(websocket, {"type": "error", "message": f"Invalid subscription: {e}"})
+                continue
+
+            self.subscribe(websocket, filters)
+            on_subscribe(websocket, filters)
+
+    def disconnect(self, websocket: WebSocket):
+        """Forget a client and stop its writer task."""
+        self.subscriptions.unsubscribe(websocket)
+        client = self.clients.pop(websocket, None)
+        if client and client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for one client, behind whatever it has pending."""
+        client = self.clients.get(websocket)
+        if client:
+            self._enqueue(client, encode(message, client.encoding), time.perf_counter())
+
+    def send_frame(self, websocket: WebSocket, frame: str | bytes):
+        """Queue a frame already encoded in the client's encoding (see `encoding_of`), e.g. a shared one."""
+        client = self.clients.get(websocket)
+        if client:
+            self._enqueue(client, frame, time.perf_counter())
+
+    def close(self, websocket: WebSocket, code: int):
+        """Close a client's connection once the frames queued before are sent."""
+        client = self.clients.get(websocket)
+        if client:
+            self._enqueue(client, CloseFrame(code), time.perf_counter())
+
+    def encoding_of(self, websocket: WebSocket):
+        client = self.clients.get(websocket)
+        return client.encoding if client else None
+
+    def publish(self, message: dict):
+        """Encode a message once per encoding and queue it for every client. Never waits on a client."""
+        self._publish(list(self.clients.values()), message)
+
+    def publish_to(self, websockets, message: dict):
+        """Encode a message once per encoding and queue it for the given clients only."""
+        self._publish([self.clients[websocket] for websocket in websockets if websocket in self.clients], message)
+
+    def _publish(self, clients: list, message: dict):
+        if not clients:
+            return
+        started = time.perf_counter()
+        frames: dict = {}
+        for client in clients:
+            frame = frames.get(client.encoding)
+            if frame is None:
+                frame = frames[client.encoding] = encode(message, client.encoding)
+            self._enqueue(client, frame, started)
+        self.published += 1
+        self.publish_seconds_last = time.perf_counter() - started
+        BROADCAST_PUBLISH_SECONDS.observe(self.publish_seconds_last, hub=self.name)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add("ws_publish", started, self.publish_seconds_last, hub=self.name, clients=len(clients))
+
+    def _enqueue(self, client: BroadcastClient, frame: str | bytes, published_at: float):
+        try:
+            client.queue.put_nowait((frame, published_at))
+            return
+        except asyncio.QueueFull:
+            self.overflows += 1
+
+        if self.overflow == "latest":
+            # Skip the client to the latest state instead of delivering every frame
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            if self.resync:
+                frame = encode(self.resync(client.websocket), client.encoding)
+            client.queue.put_nowait((frame, published_at))
+            return
+
+        self.dropped_clients += 1
+        self.disconnect(client.websocket)
+        asyncio.create_task(self._close(client.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            # 1013: try again later
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    async def _writer(self, client: BroadcastClient):
+        try:
+            while True:
+                frame, published_at = await client.queue.get()
+                if isinstance(frame, CloseFrame):
+                    self.disconnect(client.websocket)
+                    await client.websocket.close(code=frame.code)
+                    return
+                sending = time.perf_counter()
+                if isinstance(frame, bytes):
+                    await client.websocket.send_bytes(frame)
+                else:
+                    await client.websocket.send_text(frame)
+                self.delivered += 1
+                sent = time.perf_counter()
+                latency = sent - published_at
+                self.latencies.append(latency)
+                BROADCAST_DELIVERY_SECONDS.observe(latency, hub=self.name)
+                # The writer task inherits the context of the connection, so this is its profile
+                profile = current_profile.get()
+                if profile is not None:
+                    profile.add("ws_send", sending, sent - sending, hub=self.name, bytes=len(frame), queued_ms=round((sending - published_at) * 1000, 3))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Failed to send data to a client: {e}")
+            self.disconnect(client.websocket)
+
+    def stats(self):
+        """Client count, counters and fan-out latency."""
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 3)
+
+        return {
+            "clients": len(self.clients),
+            "filtered_clients": len(self.subscriptions.filters),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+            "dropped_clients": self.dropped_clients,
+            "pending_frames": sum(client.queue.qsize() for client in self.clients.values()),
+            "last_publish_ms": round(self.publish_seconds_last * 1000, 3),
+            "delivery_p50_ms": percentile(0.5),
+            "delivery_p99_ms": percentile(0.99),
+        }
@@ -0,0 +1,329 @@
+from db import AsyncSessionLocal
+from utils.ingest_worker import IngestWorker, WorkerTimeout, encode_reading
+import asyncio
+import os
+import time
+import zlib
+
+# Maximum number of readings waiting to be written
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+
+# A writer commits once it has this many readings or the batch window has passed (in milliseconds)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_BATCH_TIMEOUT = float(os.getenv("INGEST_BATCH_TIMEOUT_MS", "50")) / 1000
+
+# Number of writer tasks; readings of one sensor always go to the same writer
+INGEST_WRITERS = int(os.getenv("INGEST_WRITERS", "1"))
+
+# Worker processes that write the readings and score them, one per writer, each owning the
+# sensors of its shard (0 writes and scores in the API process)
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", "0"))
+
+# How long a producer waits for room in a full queue before it is told the server is overloaded
+INGEST_ENQUEUE_TIMEOUT = float(os.getenv("INGEST_ENQUEUE_TIMEOUT_MS", "1000")) / 1000
+
+# Producers of sequenced readings get a cumulative ack once this many of their readings are
+# written, or this long (in milliseconds) after the first one not acknowledged yet
+INGEST_ACK_EVERY = int(os.getenv("INGEST_ACK_EVERY", "1000"))
+INGEST_ACK_INTERVAL = float(os.getenv("INGEST_ACK_INTERVAL_MS", "50")) / 1000
+
+
+def shard_of(sensor_id: str, shards: int):
+    """Stable shard of a sensor, so its readings keep their order."""
+    return zlib.crc32(sensor_id.encode()) % shards
+
+
+class IngestAcks:
+    """
+    Cumulative acks of the sequenced readings (those with a `seq`) of one producer connection,
+    and reports of the readings of that producer that could not be written.
+
+    Readings of a sensor are written in the order they were sent, so the highest seq written
+    per sensor acknowledges every reading of that sensor sent before it on the connection. Acks
+    are sent as {"ack": {sensor_id: seq, ...}, "count": n} once `every` readings are written or
+    `interval` after the first one written since the last ack. A failed sequenced reading is not
+    skipped over: the producer is told and `on_failure` closes the connection, after which the
+    producer resends what was not acknowledged, as it does after any reconnect. Readings without
+    a seq were already answered when queued, so those that fail are sent back to the producer
+    ({"error": ..., "readings": [...]}) and the connection stays open.
+    """
+    def __init__(self, send, on_failure, every: int = INGEST_ACK_EVERY, interval: float = INGEST_ACK_INTERVAL):
+        self.send = send
+        self.on_failure = on_failure
+        self.every = every
+        self.interval = interval
+        self.pending: dict[str, int] = {}
+        self.count = 0
+        self.timer: asyncio.TimerHandle | None = None
+        self.stopped = False
+
+    def written(self, readings: list):
+        """Readings of this producer were committed (or were already stored)."""
+        if self.stopped:
+            return
+        for reading in readings:
+            if reading.seq is None:
+                continue
+            self.pending[reading.sensor_id] = max(reading.seq, self.pending.get(reading.sensor_id, reading.seq))
+            self.count += 1
+        if self.count >= self.every:
+            self.flush()
+        elif self.count and self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def settle(self, written: list, failed: list):
+        """Readings of this producer in a batch were written or dropped."""
+        # An ack would cover a dropped sequenced reading sent before the written ones
+        if not any(reading.seq is not None for reading in failed):
+            self.written(written)
+        if failed:
+            self.failed(failed)
+
+    def failed(self, readings: list):
+        """Readings of this producer could not be written."""
+        if self.stopped:
+            return
+        if not any(reading.seq is not None for reading in readings):
+            self.send({"error": "Failed to write readings", "count": len(readings), "readings": [encode_reading(reading) for reading in readings]})
+            return
+        # Readings written before the failure are still acknowledged
+        self.flush()
+        self.send({"error": "Failed to write readings, reconnect and resend the unacknowledged ones", "count": len(readings)})
+        self.stop()
+        self.on_failure()
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.pending:
+            self.send({"ack": self.pending, "count": self.count})
+        self.pending = {}
+        self.count = 0
+
+    def stop(self):
+        """Stop acknowledging, e.g. when the producer disconnected."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.stopped = True
+
+
+class IngestReceipt:
+    """The outcome of readings queued by an HTTP request, which waits for all of them to be settled."""
+    def __init__(self):
+        self.written: list = []
+        self.failed: list = []
+        self.expected: int | None = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    def settle(self, written: list, failed: list):
+        self.written += written
+        self.failed += failed
+        self._check()
+
+    def expect(self, count: int):
+        """Set the number of readings accepted by the queue, once known."""
+        self.expected = count
+        self._check()
+
+    def _check(self):
+        if self.expected is not None and len(self.written) + len(self.failed) >= self.expected and not self.done.done():
+            self.done.set_result(None)
+
+
+class IngestQueue:
+    """
+    Bounded write-behind queue for sensor readings.
+
+    Readings are partitioned by sensor across writer tasks, each with its own queue, and every
+    writer group-commits up to `batch_size` readings or whatever arrived within `batch_timeout`.
+    A full queue blocks producers for up to `enqueue_timeout`, then rejects the readings. A batch
+    that fails is split and retried (see `_commit`), so one bad reading does not take the other
+    readings of its batch down with it.
+    With `processes`, there is one writer per worker process (see utils.ingest_worker), which
+    hands its batches to the process and waits for the commit, one batch at a time.
+    """
+    def __init__(
+        self,
+        maxsize: int = INGEST_QUEUE_SIZE,
+        batch_size: int = INGEST_BATCH_SIZE,
+        batch_timeout: float = INGEST_BATCH_TIMEOUT,
+        writers: int = INGEST_WRITERS,
+        enqueue_timeout: float = INGEST_ENQUEUE_TIMEOUT,
+        processes: int = INGEST_PROCESSES,
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.writers = processes or writers
+        self.processes = processes
+        self.enqueue_timeout = enqueue_timeout
+        self.queues: list[asyncio.Queue] = []
+        self.tasks: list[asyncio.Task] = []
+        self.workers: list[IngestWorker] = []
+
+        self.enqueued = 0
+        self.rejected = 0
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+        self.commit_seconds_total = 0.0
+        self.commit_seconds_last = 0.0
+        self.commit_seconds_max = 0.0
+
+    async def start(self):
+        """Start the writer tasks, and their worker processes if any."""
+        self.workers = [IngestWorker(shard) for shard in range(self.processes)]
+        for worker in self.workers:
+            await worker.start()
+        self.queues = [asyncio.Queue(max(1, self.maxsize // self.writers)) for _ in range(self.writers)]
+        self.tasks = [asyncio.create_task(self._writer(shard, queue)) for shard, queue in enumerate(self.queues)]
+
+    async def stop(self, timeout: float = 10):
+        """Write what is still queued (for up to `timeout` seconds), then stop the writers."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            print(f"Ingest queue stopped with {self.depth} readings unwritten")
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        for worker in self.workers:
+            await worker.stop()
+
+    @property
+    def depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    async def submit(self, readings: list, acks: IngestAcks | IngestReceipt | None = None):
+        """
+        Queue readings for writing, waiting while the queue is full; `acks` is told when they
+        are written. Returns the number of readings accepted; fewer than submitted means the
+        server is overloaded.
+        """
+        deadline = time.monotonic() + self.enqueue_timeout
+        for accepted, reading in enumerate(readings):
+            queue = self.queues[shard_of(reading.sensor_id, len(self.queues))]
+            try:
+                queue.put_nowait((reading, acks))
+            except asyncio.QueueFull:
+                try:
+                    await asyncio.wait_for(queue.put((reading, acks)), max(0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self.rejected += len(readings) - accepted
+                    return accepted
+            self.enqueued += 1
+        return len(readings)
+
+    async def write(self, readings: list):
+        """
+        Queue readings and wait until they are written, for requests that answer with the outcome.
+        Returns the readings written, those dropped and the number rejected by a full queue.
+        """
+        receipt = IngestReceipt()
+        accepted = await self.submit(readings, receipt)
+        receipt.expect(accepted)
+        await receipt.done
+        return receipt.written, receipt.failed, len(readings) - accepted
+
+    async def _writer(self, shard: int, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+
+            # Gather more readings until the batch is full or the batch window has passed
+            deadline = loop.time() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                while len(batch) < self.batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+
+            dropped = {id(reading) for reading in await self._commit(shard, [reading for reading, _ in batch])}
+
+            # Tell every producer in the batch about its readings, written and dropped
+            readings_by_producer: dict = {}
+            for reading, acks in batch:
+                if acks is not None:
+                    readings_by_producer.setdefault(acks, ([], []))[id(reading) in dropped].append(reading)
+            for acks, (written, failed) in readings_by_producer.items():
+                acks.settle(written, failed)
+
+            for _ in batch:
+                queue.task_done()
+
+    async def _commit(self, shard: int, batch: list):
+        """
+        Write a batch. A failed batch is split in halves, each retried and split again, down to
+        single readings, so only the readings that cannot be written (e.g. a value too long for
+        its column) are dropped. Returns the dropped readings.
+        """
+        errors = []
+        dropped = await self._commit_split(shard, batch, errors)
+        if dropped:
+            self.failed += len(dropped)
+            print(f"Dropped {len(dropped)} of {len(batch)} queued readings: {errors[-1]}")
+        return dropped
+
+    async def _commit_split(self, shard: int, batch: list, errors: list):
+        error = await self._write(shard, batch)
+        if error is None:
+            return []
+        errors.append(error)
+        # A worker that hung is not retried on halves, each of which could hang it again
+        if len(batch) == 1 or isinstance(error, WorkerTimeout):
+            return batch
+        # Halves keep the readings of a sensor in order
+        middle = len(batch) // 2
+        return await self._commit_split(shard, batch[:middle], errors) + await self._commit_split(shard, batch[middle:], errors)
+
+    async def _write(self, shard: int, batch: list):
+        """Write and commit readings in one transaction. Returns why it failed, or None."""
+        # Import inside the function to avoid circular import
+        from controllers.sensor_controller import create_sensor_data_batch
+
+        started = time.perf_counter()
+        if self.workers:
+            try:
+                if not await self.workers[shard].write(batch):
+                    return f"ingest worker {shard} failed to write them"
+            except WorkerTimeout as e:
+                return e
+        else:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await create_sensor_data_batch(batch, db)
+            except Exception as e:
+                return e
+
+        elapsed = time.perf_counter() - started
+        self.committed += len(batch)
+        self.batches += 1
+        self.commit_seconds_total += elapsed
+        self.commit_seconds_last = elapsed
+        self.commit_seconds_max = max(self.commit_seconds_max, elapsed)
+        return None
+
+    def stats(self):
+        """Queue depth, counters and group commit latency."""
+        return {
+            "depth": self.depth,
+            "capacity": self.maxsize,
+            "writers": self.writers,
+            "processes": self.processes,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "committed": self.committed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "average_batch_size": round(self.committed / self.batches, 2) if self.batches else 0.0,
+            "last_commit_ms": round(self.commit_seconds_last * 1000, 3),
+            "average_commit_ms": round(self.commit_seconds_total / self.batches * 1000, 3) if self.batches else 0.0,
+            "max_commit_ms": round(self.commit_seconds_max * 1000, 3),
+        }
+
+
+ingest_queue = IngestQueue()
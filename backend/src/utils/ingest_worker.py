@@ -0,0 +1,202 @@
+"""
+Ingest worker processes (INGEST_PROCESSES > 0).
+
+Each worker owns a shard of the sensors (see `shard_of`): it writes their readings in the
+batches the ingest queue of the API process hands it, and keeps their scoring state (reading
+windows and statistics) in its own memory, so reliability scoring never runs on the event
+loop that serves HTTP and WebSockets. Batches go out and replies come back as length-prefixed
+MessagePack frames over a socket pair. What a worker publishes on its bus (sensor changes for
+the dashboards) is handed back and published on the bus of the API process.
+
+The API process starts its workers itself:
+    python -m utils.ingest_worker <fd>
+"""
+from utils import pubsub
+import asyncio
+import msgpack
+import os
+import signal
+import socket
+import sys
+
+# Directory the worker modules are imported from
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# How long a stopping worker may take to finish its batch before it is killed (in seconds)
+WORKER_STOP_TIMEOUT = 10
+
+# How long a worker may take to write a batch before it is killed and restarted (in seconds)
+INGEST_WORKER_TIMEOUT = float(os.getenv("INGEST_WORKER_TIMEOUT", "60"))
+
+
+class WorkerTimeout(Exception):
+    """A worker did not answer a batch in time and was killed."""
+
+
+class WorkerChannel:
+    """Length-prefixed MessagePack frames over a stream socket."""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, sock: socket.socket):
+        return cls(*await asyncio.open_unix_connection(sock=sock))
+
+    async def send(self, message):
+        data = msgpack.packb(message, use_bin_type=True)
+        self.writer.write(len(data).to_bytes(4, "big") + data)
+        await self.writer.drain()
+
+    async def receive(self):
+        size = int.from_bytes(await self.reader.readexactly(4), "big")
+        return msgpack.unpackb(await self.reader.readexactly(size), raw=False)
+
+    def close(self):
+        self.writer.close()
+
+
+def encode_reading(reading):
+    """A validated reading as plain values for the channel."""
+    return {**reading.dict(exclude={"id"}), "type": reading.type.value, "status": reading.status.value}
+
+
+class IngestWorker:
+    """
+    An ingest worker process as seen from the API process. Restarted on the next batch if it
+    died, or if it was killed for not answering a batch within `timeout` seconds.
+    """
+    def __init__(self, shard: int, timeout: float = INGEST_WORKER_TIMEOUT):
+        self.shard = shard
+        self.timeout = timeout
+        self.process: asyncio.subprocess.Process | None = None
+        self.channel: WorkerChannel | None = None
+        self.receiver: asyncio.Task | None = None
+        self.reply: asyncio.Future | None = None
+        self.stopping = False
+
+    @property
+    def alive(self):
+        return self.channel is not None and self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        parent, child = socket.socketpair()
+        # The parent's working directory is kept, for relative paths such as a SQLite DATABASE_URL
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (SOURCE_DIR, os.environ.get("PYTHONPATH"))))}
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "utils.ingest_worker", str(child.fileno()), pass_fds=(child.fileno(),), env=env,
+        )
+        child.close()
+        self.channel = await WorkerChannel.open(parent)
+        self.receiver = asyncio.create_task(self._receive(self.channel))
+
+    async def write(self, batch: list):
+        """
+        Have the worker write a batch of readings. Returns whether it was committed; raises
+        WorkerTimeout when the worker was killed for not answering in time (the batch may or
+        may not have been committed).
+        """
+        if not self.alive:
+            await self.start()
+        self.reply = asyncio.get_running_loop().create_future()
+        try:
+            await self.channel.send([encode_reading(reading) for reading in batch])
+        except (ConnectionError, OSError) as e:
+            print(f"Failed to send a batch to ingest worker {self.shard}: {e}")
+            return False
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.reply), self.timeout)
+        except asyncio.TimeoutError:
+            print(f"Ingest worker {self.shard} did not answer within {self.timeout:g}s, restarting it")
+            await self.kill()
+            raise WorkerTimeout(f"ingest worker {self.shard} timed out")
+
+    async def kill(self):
+        """Kill a hung worker; the next batch starts a new one."""
+        if self.process and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        if self.channel:
+            self.channel.close()
+        # Its receiver settles the reply of the batch, not that of the next one
+        if self.receiver:
+            await asyncio.gather(self.receiver, return_exceptions=True)
+
+    async def _receive(self, channel: WorkerChannel):
+        try:
+            while True:
+                message = await channel.receive()
+                if message[0] == "publish":
+                    await pubsub.bus.publish(message[1], message[2])
+                elif self.reply is not None and not self.reply.done():
+                    self.reply.set_result(message[0] == "written")
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            if not self.stopping:
+                print(f"Ingest worker {self.shard} exited: {e}")
+        finally:
+            channel.close()
+            if self.channel is channel:
+                self.channel = None
+            if self.reply is not None and not self.reply.done():
+                self.reply.set_result(False)
+
+    async def stop(self):
+        """Close the channel; the worker exits once its current batch is written."""
+        self.stopping = True
+        if self.channel:
+            self.channel.close()
+        if self.process and self.process.returncode is None:
+            try:
+                await asyncio.wait_for(self.process.wait(), WORKER_STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.process.kill()
+        if self.receiver:
+            self.receiver.cancel()
+
+
+class ForwardingBus(pubsub.InProcessBus):
+    """Bus of a worker process: hands every event to the API process, which publishes it on its own bus."""
+    def __init__(self, channel: WorkerChannel):
+        super().__init__()
+        self.channel = channel
+
+    async def publish(self, channel: str, message):
+        await self.channel.send(["publish", channel, message])
+
+
+async def serve(fd: int):
+    channel = await WorkerChannel.open(socket.socket(fileno=fd))
+
+    # The controllers take the bus from utils.pubsub when they are imported, so it is replaced first
+    pubsub.bus = ForwardingBus(channel)
+    # The controllers import from the routes, which have to be loaded first
+    import routes  # noqa: F401
+    from controllers.sensor_controller import create_sensor_data_batch
+    from models.sensor_data import SensorDataSchema
+    from db import AsyncSessionLocal, engine
+
+    # The API process closes the channel to stop the worker, or is gone
+    while True:
+        try:
+            batch = [SensorDataSchema(**item) for item in await channel.receive()]
+        except (asyncio.IncompleteReadError, ConnectionError):
+            break
+        try:
+            async with AsyncSessionLocal() as db:
+                await create_sensor_data_batch(batch, db)
+            result = "written"
+        except Exception as e:
+            print(f"Ingest worker failed to write {len(batch)} readings: {e}")
+            result = "failed"
+        try:
+            await channel.send([result])
+        except (ConnectionError, OSError):
+            break
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    # Stopping is up to the API process (it closes the channel), so that queued readings are written first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(serve(int(sys.argv[1])))
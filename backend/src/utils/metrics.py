@@ -0,0 +1,211 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from sqlalchemy import event
+from utils.profiling import current_profile
+import json
+import logging
+import os
+import random
+import time
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statements slower than this (in milliseconds) go to the slow-query log, a sample of them at most
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100")) / 1000
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+
+# Longest statement text written to the slow-query log
+SLOW_QUERY_MAX_LENGTH = 1000
+
+slow_query_log = logging.getLogger("slow_query")
+
+# Every metric, in the order they are rendered
+registry: list = []
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic count per label set."""
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Current value per label set, read from `collect()` ({label values: value}) when rendered."""
+    def __init__(self, name: str, help: str, labelnames: tuple = (), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in self.collect().items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Distribution of observations per label set, in cumulative buckets as Prometheus expects."""
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: [count per bucket (the last one is +Inf), sum]
+        self.values: dict[tuple, list] = {}
+        registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(elapsed, **labels)
+            profile = current_profile.get()
+            if profile is not None:
+                profile.add(self.name, started, elapsed, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, 'le="' + str(bound) + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+INGEST_STAGE_SECONDS = Histogram(
+    "ingest_stage_seconds",
+    "Time spent per stage of ingesting readings (validate, insert, reliability, rollup, latest, commit, broadcast).",
+    ("path", "stage"),
+)
+INGEST_READINGS = Counter("ingest_readings_total", "Readings written.", ("path",))
+
+DB_STATEMENT_SECONDS = Histogram("db_statement_seconds", "Execution time of database statements.", ("operation",))
+DB_POOL_CHECKOUT_SECONDS = Histogram("db_pool_checkout_seconds", "Time a pooled database connection stays checked out.")
+DB_POOL_CONNECT_SECONDS = Histogram("db_pool_connect_seconds", "Time spent opening a new database connection for the pool.")
+SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_THRESHOLD_MS.", ("operation",))
+
+DASHBOARD_SYNCS = Counter(
+    "dashboard_syncs_total", "Dashboard WebSocket connections brought up to date, by a full snapshot or a resume.", ("kind",)
+)
+
+BROADCAST_PUBLISH_SECONDS = Histogram(
+    "broadcast_publish_seconds", "Time to encode a WebSocket message and queue it for its clients.", ("hub",)
+)
+BROADCAST_DELIVERY_SECONDS = Histogram(
+    "broadcast_delivery_seconds", "Time from publishing a WebSocket message to it being sent to a client.", ("hub",)
+)
+
+
+def statement_operation(statement: str):
+    """First keyword of a statement (SELECT, INSERT, ...), a label of bounded cardinality."""
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return operation if operation in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+def instrument_engine(engine):
+    """
+    Time every statement, pool checkout and new connection of an async engine, and log slow
+    statements as JSON lines (sampled by SLOW_QUERY_SAMPLE_RATE) instead of echoing every statement.
+    The listeners are on the engine, so they carry over to the new pool of `engine.dispose()`.
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["statement_started"].pop()
+        elapsed = time.perf_counter() - started
+        operation = statement_operation(statement)
+        DB_STATEMENT_SECONDS.observe(elapsed, operation=operation)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add("sql", started, elapsed, operation=operation, statement=" ".join(statement.split())[:SLOW_QUERY_MAX_LENGTH])
+        if elapsed < SLOW_QUERY_THRESHOLD:
+            return
+        SLOW_QUERIES.inc(operation=operation)
+        if random.random() < SLOW_QUERY_SAMPLE_RATE:
+            slow_query_log.warning(json.dumps({
+                "event": "slow_query",
+                "duration_ms": round(elapsed * 1000, 3),
+                "operation": operation,
+                "executemany": executemany,
+                "statement": " ".join(statement.split())[:SLOW_QUERY_MAX_LENGTH],
+            }))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("statement_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+    @event.listens_for(sync_engine, "do_connect")
+    def do_connect(dialect, connection_record, cargs, cparams):
+        connection_record.info["connect_started"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        started = connection_record.info.pop("connect_started", None)
+        if started is not None:
+            DB_POOL_CONNECT_SECONDS.observe(time.perf_counter() - started)
+
+    # How long connections are held: with the pool size, shows how close the pool is to making requests wait
+    @event.listens_for(sync_engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checked_out", None)
+        if started is not None:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
@@ -0,0 +1,190 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from models.sensor_data import SensorData
+from datetime import date, datetime, timedelta
+import asyncio
+import os
+
+# Number of future daily partitions kept ready for incoming readings
+PARTITION_DAYS_AHEAD = int(os.getenv("SENSOR_DATA_PARTITION_DAYS_AHEAD", "7"))
+
+# Daily partitions entirely older than this many days are dropped (unset keeps everything)
+RETENTION_DAYS = os.getenv("SENSOR_DATA_RETENTION_DAYS")
+
+# How often partitions are created and expired (in seconds)
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("SENSOR_DATA_PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+PARTITION_PREFIX = f"{SensorData.__tablename__}_p"
+
+
+def partition_name(day: date):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def create_missing_columns(sync_conn):
+    """Add columns added to sensor_data after the table itself was created (nullable ones only)."""
+    existing = {column["name"] for column in inspect(sync_conn).get_columns(SensorData.__tablename__)}
+    for column in SensorData.__table__.columns:
+        if column.name not in existing and column.nullable:
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f"ALTER TABLE {SensorData.__tablename__} ADD COLUMN {column.name} {column_type}"))
+
+
+def missing_indexes(sync_conn):
+    existing = {index["name"] for index in inspect(sync_conn).get_indexes(SensorData.__tablename__)}
+    return [index for index in SensorData.__table__.indexes if index.name not in existing]
+
+
+def index_definition(index, table: str):
+    columns = ", ".join(column.name for column in index.columns)
+    return f"{'UNIQUE ' if index.unique else ''}INDEX", f"{table} ({columns})"
+
+
+async def create_missing_indexes(engine):
+    """
+    Create indexes added to sensor_data after the table itself was created.
+
+    On PostgreSQL they are built with CREATE INDEX CONCURRENTLY, outside of a transaction, so
+    a large table keeps taking reads and writes while the workers start. A partitioned table
+    gets the index on itself only, is indexed concurrently partition by partition, and the
+    partition indexes are attached. A build that failed half-way (an invalid index) is dropped
+    and started over. Elsewhere (MySQL builds secondary indexes online) the plain DDL is used.
+    """
+    async with engine.connect() as conn:
+        if conn.dialect.name != "postgresql":
+            for index in await conn.run_sync(missing_indexes):
+                await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+            await conn.commit()
+            return
+
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        table = SensorData.__tablename__
+        invalid = await conn.execute(text(
+            "SELECT index_class.relname FROM pg_index "
+            "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+            "JOIN pg_class table_class ON table_class.oid = pg_index.indrelid "
+            "WHERE table_class.relname = :table AND NOT pg_index.indisvalid AND table_class.relkind = 'r'"
+        ), {"table": table})
+        for (name,) in invalid:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+        partitioned = (await conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE relname = :table"), {"table": table})).scalar()
+        partitions = [partition_name(day) for day in await list_partitions(conn)] + [f"{table}_default"] if partitioned else []
+        for index in await conn.run_sync(missing_indexes):
+            kind, target = index_definition(index, table)
+            try:
+                if not partitioned:
+                    await conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {index.name} ON {target}"))
+                    continue
+                await conn.execute(text(f"CREATE {kind} IF NOT EXISTS {index.name} ON ONLY {target}"))
+                for partition in partitions:
+                    partition_index = f"{partition}_{index.name}"[:63]
+                    _, partition_target = index_definition(index, partition)
+                    await conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition_target}"))
+                    await conn.execute(text(f"ALTER INDEX {index.name} ATTACH PARTITION {partition_index}"))
+            except Exception as e:
+                # Another worker building the same index, for one; it is picked up on the next start
+                print(f"Failed to create index {index.name}: {e}")
+
+
+async def list_partitions(conn: AsyncConnection):
+    """Days that have a partition of sensor_data."""
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {"table": SensorData.__tablename__})
+
+    days = []
+    for (name,) in result:
+        if name.startswith(PARTITION_PREFIX):
+            days.append(datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date())
+    return sorted(days)
+
+
+async def create_partition(conn: AsyncConnection, day: date):
+    """
+    Create the partition of a day. Readings of that day already in the default partition (sent
+    with a timestamp beyond the partitions kept ahead) would make CREATE TABLE ... PARTITION OF
+    fail, so the partition is then created on its own, the readings are moved into it and it is
+    attached, with the default partition locked against new readings meanwhile.
+    """
+    table = SensorData.__tablename__
+    start, end = day.isoformat(), (day + timedelta(days=1)).isoformat()
+    in_range = f"timestamp >= '{start}' AND timestamp < '{end}'"
+    await conn.execute(text(f"LOCK TABLE {table}_default IN EXCLUSIVE MODE"))
+    stranded = (await conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE {in_range})"))).scalar()
+    if not stranded:
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        return
+    await conn.execute(text(f"CREATE TABLE {partition_name(day)} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = await conn.execute(text(f"INSERT INTO {partition_name(day)} SELECT * FROM {table}_default WHERE {in_range}"))
+    await conn.execute(text(f"DELETE FROM {table}_default WHERE {in_range}"))
+    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {partition_name(day)} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    print(f"Moved {moved.rowcount} sensor_data readings of {start} out of the default partition")
+
+
+async def ensure_partitions(engine, today: date | None = None, first_day: date | None = None):
+    """
+    Create the daily partitions from today (or `first_day`, to hold backfilled history)
+    up to PARTITION_DAYS_AHEAD, plus a default partition. Every partition is created in its own
+    transaction, so one that fails does not hold back the others (or retention).
+    """
+    today = today or datetime.utcnow().date()
+    first_day = min(first_day or today, today)
+    table = SensorData.__tablename__
+    async with engine.begin() as conn:
+        # Readings outside of every daily range (backdated or far in the future) land here
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+        existing = set(await list_partitions(conn))
+    for offset in range((today - first_day).days + PARTITION_DAYS_AHEAD + 1):
+        day = first_day + timedelta(days=offset)
+        if day in existing:
+            continue
+        try:
+            async with engine.begin() as conn:
+                await create_partition(conn, day)
+        except Exception as e:
+            print(f"Failed to create the sensor_data partition of {day.isoformat()}: {e}")
+
+
+async def drop_expired_partitions(engine, retention_days: int, today: date | None = None):
+    """Drop the daily partitions that end before the retention cutoff, instead of deleting rows, one transaction each."""
+    today = today or datetime.utcnow().date()
+    cutoff = today - timedelta(days=retention_days)
+    async with engine.connect() as conn:
+        days = await list_partitions(conn)
+    dropped = []
+    for day in days:
+        if day + timedelta(days=1) > cutoff:
+            continue
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {partition_name(day)}"))
+            dropped.append(day)
+        except Exception as e:
+            print(f"Failed to drop the sensor_data partition of {day.isoformat()}: {e}")
+    return dropped
+
+
+async def maintain_partitions(engine):
+    """Create upcoming partitions and drop expired ones, once."""
+    await ensure_partitions(engine)
+    if RETENTION_DAYS:
+        dropped = await drop_expired_partitions(engine, int(RETENTION_DAYS))
+        if dropped:
+            print(f"Dropped expired sensor_data partitions: {[day.isoformat() for day in dropped]}")
+
+
+async def partition_maintenance_loop(engine):
+    """Background job keeping the daily partitions of sensor_data up to date."""
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            await maintain_partitions(engine)
+        except Exception as e:
+            print(f"Failed to maintain sensor_data partitions: {e}")
+
@@ -0,0 +1,252 @@
+"""
+Request profiling and slow-request capture.
+
+`ProfilingMiddleware` times every HTTP request. A request is profiled when it carries
+`X-Profile: <ADMIN_TOKEN>` or is picked by PROFILE_SAMPLE_RATE (WebSocket connections too, for
+their whole lifetime): a background thread samples the stack of the event loop every
+PROFILE_SAMPLE_INTERVAL_MS, and the SQL statements, ingest stages and WebSocket publishes and
+sends it causes are recorded on a timeline. When SLOW_REQUEST_THRESHOLD_MS is set, every HTTP
+request records its timeline and the slower ones keep it (not the stack samples) as well. Profiled and slow requests are kept in a bounded
+ring, served by the admin endpoints (see routes.admin_routes).
+"""
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import itertools
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+
+# Token of the admin endpoints, also the value of the X-Profile header that profiles a request (unset disables both)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Fraction of requests and WebSocket connections profiled without the header
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# Time between two stack samples of a profiled request (in milliseconds)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+
+# HTTP requests slower than this (in milliseconds) are kept with their timeline; 0 turns the capture off (and its cost on every request)
+SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "0")) / 1000
+
+# Number of profiled and slow requests kept; the oldest make room for new ones
+SLOW_REQUEST_RING_SIZE = int(os.getenv("SLOW_REQUEST_RING_SIZE", "100"))
+
+# Timeline events kept per request; a long-lived WebSocket stops recording beyond them
+PROFILE_MAX_EVENTS = 2000
+
+# Stacks listed per request, most sampled first
+PROFILE_TOP_STACKS = 50
+
+# The request (or WebSocket connection) being handled, when it is profiled or timed
+current_profile: ContextVar["RequestProfile | None"] = ContextVar("current_profile", default=None)
+
+
+def frame_label(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+class RequestProfile:
+    """Timeline and, when sampled, stack samples of one request."""
+    def __init__(self, scope: dict, sampled: bool):
+        self.id: int | None = None
+        self.kind = scope["type"]
+        self.method = scope.get("method", "WEBSOCKET")
+        self.path = scope["path"]
+        self.status: int | None = None
+        self.sampled = sampled
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.finished = False
+        self.events: list[dict] = []
+        self.dropped_events = 0
+        # Set by the middleware: the thread running the event loop and the frame of the request
+        self.thread_id: int | None = None
+        self.frame = None
+        # Seconds per folded stack, and when the last sample was taken
+        self.stacks: Counter = Counter()
+        self.sampled_until = self.started
+
+    def add(self, kind: str, started: float, elapsed: float, **fields):
+        """Record an event that started at `started` (perf_counter) and took `elapsed` seconds."""
+        if self.finished:
+            return
+        if len(self.events) >= PROFILE_MAX_EVENTS:
+            self.dropped_events += 1
+            return
+        self.events.append({
+            "at_ms": round((started - self.started) * 1000, 3),
+            "ms": round(elapsed * 1000, 3),
+            "kind": kind,
+            **fields,
+        })
+
+    def sample(self, frame, now: float):
+        """
+        Credit the stack the event loop thread is in with the time since the last sample. The
+        sampler only runs when it gets the GIL, mostly when the loop waits, so a sample after a
+        long busy stretch weighs as much as the stretch. Only the frames under the request's own
+        are kept; time the loop spent on other work or waiting is counted apart.
+        """
+        elapsed, self.sampled_until = now - self.sampled_until, now
+        stack = []
+        while frame is not None:
+            if frame is self.frame:
+                self.stacks[";".join(reversed(stack)) or frame_label(frame)] += elapsed
+                return
+            stack.append(frame_label(frame))
+            frame = frame.f_back
+        waiting = bool(stack) and stack[0].startswith("selectors.")
+        self.stacks["(event loop idle)" if waiting else "(other tasks)"] += elapsed
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        self.finished = True
+        self.frame = None
+
+    def summary(self):
+        sql = [event for event in self.events if event["kind"] == "sql"]
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "profiled": self.sampled,
+            "sql_statements": len(sql),
+            "sql_ms": round(sum(event["ms"] for event in sql), 3),
+            "ws_sends": sum(1 for event in self.events if event["kind"] == "ws_send"),
+        }
+
+    def details(self):
+        return {
+            **self.summary(),
+            # Events are recorded when they end, listed by when they started
+            "timeline": sorted(self.events, key=lambda event: event["at_ms"]),
+            "dropped_events": self.dropped_events,
+            "samples": {
+                "interval_ms": PROFILE_SAMPLE_INTERVAL * 1000,
+                "sampled_ms": round(sum(self.stacks.values()) * 1000, 3),
+                "stacks": [
+                    {"stack": stack, "ms": round(seconds * 1000, 3)}
+                    for stack, seconds in self.stacks.most_common(PROFILE_TOP_STACKS)
+                ],
+            },
+        }
+
+    def folded(self):
+        """Stack samples in the folded format of flamegraph.pl and speedscope, weighted in microseconds."""
+        return "".join(f"{stack} {round(seconds * 1e6)}\n" for stack, seconds in self.stacks.most_common())
+
+
+class StackSampler:
+    """Thread sampling the event loop stacks of the profiled requests in flight; runs only while there are some."""
+    def __init__(self):
+        self.profiles: set[RequestProfile] = set()
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+
+    def add(self, profile: RequestProfile):
+        with self.lock:
+            self.profiles.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self.thread.start()
+
+    def remove(self, profile: RequestProfile):
+        # Under the lock, so no sample lands in a profile once it is finished
+        with self.lock:
+            self.profiles.discard(profile)
+
+    def _run(self):
+        while True:
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                frames = sys._current_frames()
+                now = time.perf_counter()
+                for profile in self.profiles:
+                    profile.sample(frames.get(profile.thread_id), now)
+
+
+class ProfileRing:
+    """The latest profiled and slow requests, by id."""
+    def __init__(self, size: int):
+        self.profiles: deque[RequestProfile] = deque(maxlen=size)
+        self.ids = itertools.count(1)
+        self.captured = 0
+
+    def append(self, profile: RequestProfile):
+        profile.id = next(self.ids)
+        self.profiles.append(profile)
+        self.captured += 1
+
+    def get(self, profile_id: int):
+        return next((profile for profile in self.profiles if profile.id == profile_id), None)
+
+    def clear(self):
+        self.profiles.clear()
+
+
+sampler = StackSampler()
+profile_ring = ProfileRing(SLOW_REQUEST_RING_SIZE)
+
+
+def check_admin_token(token: str | None):
+    return bool(ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+def profile_requested(scope: dict):
+    """Whether a request asks to be profiled (X-Profile header) or is sampled."""
+    if ADMIN_TOKEN:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return check_admin_token(value.decode("latin-1"))
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests on demand and capturing slow ones. A request that is
+    neither profiled nor timed (SLOW_REQUEST_THRESHOLD_MS unset or 0) goes straight through.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        sampled = profile_requested(scope)
+        # WebSocket connections last as long as their client; only profiled ones are recorded
+        if not sampled and (scope["type"] != "http" or not SLOW_REQUEST_THRESHOLD):
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope, sampled)
+        token = current_profile.set(profile)
+        if sampled:
+            profile.thread_id = threading.get_ident()
+            profile.frame = sys._getframe()
+            sampler.add(profile)
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            if sampled:
+                sampler.remove(profile)
+            current_profile.reset(token)
+            profile.finish()
+            if sampled or profile.duration >= SLOW_REQUEST_THRESHOLD:
+                profile_ring.append(profile)
@@ -0,0 +1,281 @@
+"""
+Pub/sub bus that carries ingest events between the workers of the API.
+
+Every worker subscribes to the channels it fans out to its own WebSocket clients. A worker that
+ingests readings publishes the event once on the bus, and every worker, itself included,
+handles it. With PUBSUB_URL unset the bus is in-process, for a single worker. With a redis://
+URL the events go through a Redis server (or anything speaking the Redis protocol), so the API
+can run as several uvicorn workers or on several nodes.
+
+For development without Redis, a minimal stand-in server is included:
+    python -m utils.pubsub --serve --port 6379
+"""
+from urllib.parse import urlparse
+from utils.metrics import Counter
+import argparse
+import asyncio
+import json
+import os
+
+# Bus backend: unset or memory:// for in-process, redis://[:password@]host[:port] for Redis
+PUBSUB_URL = os.getenv("PUBSUB_URL", "memory://")
+
+# Seconds between attempts to reconnect to a lost Redis server
+PUBSUB_RECONNECT_INTERVAL = 1.0
+
+PUBSUB_MESSAGES = Counter("pubsub_messages_total", "Messages published on and received from the bus.", ("channel", "direction"))
+
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class InProcessBus:
+    """Delivers every message straight to the handlers of this process."""
+    def __init__(self):
+        self.handlers: dict[str, list] = {}
+        self.reconnect_handlers: list = []
+
+    def subscribe(self, channel: str, handler):
+        """Call `await handler(message)` for every message published on `channel`."""
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, handler):
+        """
+        Call `await handler()` once the bus is back after messages may have been missed (never
+        for the in-process bus), so state kept from them can be reloaded.
+        """
+        self.reconnect_handlers.append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message):
+        PUBSUB_MESSAGES.inc(channel=channel, direction="published")
+        await self.dispatch(channel, message)
+
+    async def dispatch(self, channel: str, message):
+        PUBSUB_MESSAGES.inc(channel=channel, direction="received")
+        for handler in self.handlers.get(channel, ()):
+            try:
+                await handler(message)
+            except Exception as e:
+                print(f"Failed to handle a message on {channel}: {e}")
+
+
+class RespConnection:
+    """One connection speaking the Redis serialization protocol (RESP)."""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int, password: str | None = None):
+        reader, writer = await asyncio.open_connection(host, port)
+        connection = cls(reader, writer)
+        if password:
+            await connection.send("AUTH", password)
+            await connection.read()
+        return connection
+
+    async def send(self, *arguments):
+        parts = [f"*{len(arguments)}\r\n".encode()]
+        for argument in arguments:
+            data = argument if isinstance(argument, bytes) else str(argument).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.writer.write(b"".join(parts))
+        await self.writer.drain()
+
+    async def read(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise ConnectionError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [await self.read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the server: {line!r}")
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisBus(InProcessBus):
+    """
+    Publishes through a Redis server and delivers what it receives on its subscriptions,
+    including its own messages, so every worker handles every event in the same order.
+    If the server cannot be reached, messages are delivered in this process only, and those
+    of the other workers are missed: the reconnect handlers run once subscribed again.
+    """
+    def __init__(self, url: str):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.publisher: RespConnection | None = None
+        self.publish_lock = asyncio.Lock()
+        self.listener: asyncio.Task | None = None
+        self.subscribed = asyncio.Event()
+        # Whether messages may have been missed since the bus was last subscribed
+        self.missed = False
+
+    async def start(self):
+        self.listener = asyncio.create_task(self._listen())
+        try:
+            # Messages published before the subscription is in place would not come back
+            await asyncio.wait_for(self.subscribed.wait(), 5)
+        except asyncio.TimeoutError:
+            print(f"Pub/sub server at {self.host}:{self.port} not reachable, delivering in-process until it is")
+
+    async def stop(self):
+        if self.listener:
+            self.listener.cancel()
+        if self.publisher:
+            self.publisher.close()
+            self.publisher = None
+
+    async def publish(self, channel: str, message):
+        PUBSUB_MESSAGES.inc(channel=channel, direction="published")
+        if self.subscribed.is_set():
+            try:
+                async with self.publish_lock:
+                    if self.publisher is None:
+                        self.publisher = await RespConnection.open(self.host, self.port, self.password)
+                    await self.publisher.send("PUBLISH", channel, encode(message))
+                    await self.publisher.read()
+                return
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                print(f"Failed to publish on {channel}: {e}")
+                if self.publisher:
+                    self.publisher.close()
+                    self.publisher = None
+
+        # Without the server, at least the clients of this worker get the event
+        await self.dispatch(channel, message)
+
+    async def _listen(self):
+        if not self.handlers:
+            self.subscribed.set()
+            return
+        while True:
+            connection = None
+            try:
+                connection = await RespConnection.open(self.host, self.port, self.password)
+                await connection.send("SUBSCRIBE", *self.handlers)
+                while True:
+                    reply = await connection.read()
+                    if reply[0] == b"subscribe" and reply[2] == len(self.handlers):
+                        self.subscribed.set()
+                        if self.missed:
+                            self.missed = False
+                            await self._reconnected()
+                    elif reply[0] == b"message":
+                        await self.dispatch(reply[1].decode(), json.loads(reply[2]))
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                if self.subscribed.is_set():
+                    print(f"Lost the pub/sub server: {e}")
+                self.subscribed.clear()
+                self.missed = True
+            finally:
+                if connection:
+                    connection.close()
+            await asyncio.sleep(PUBSUB_RECONNECT_INTERVAL)
+
+
+    async def _reconnected(self):
+        for handler in self.reconnect_handlers:
+            try:
+                await handler()
+            except Exception as e:
+                print(f"Failed to resynchronize after reconnecting to the pub/sub server: {e}")
+
+
+def create_bus(url: str = PUBSUB_URL):
+    """Bus backend for a PUBSUB_URL."""
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return InProcessBus()
+    if scheme == "redis":
+        return RedisBus(url)
+    raise ValueError(f"Unsupported PUBSUB_URL scheme: {scheme}")
+
+
+bus = create_bus()
+
+
+async def serve_standin(host: str, port: int):
+    """
+    Minimal stand-in for a Redis server that supports what the bus needs:
+    PING, AUTH, SUBSCRIBE, UNSUBSCRIBE and PUBLISH.
+    """
+    subscribers: dict[bytes, set] = {}
+
+    async def handle(reader, writer):
+        connection = RespConnection(reader, writer)
+        channels: set = set()
+        try:
+            while True:
+                command = await connection.read()
+                name = command[0].upper()
+                if name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif name == b"AUTH":
+                    writer.write(b"+OK\r\n")
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        channels.add(channel)
+                        subscribers.setdefault(channel, set()).add(writer)
+                        writer.write(b"*3\r\n$9\r\nsubscribe\r\n$%d\r\n%s\r\n:%d\r\n" % (len(channel), channel, len(channels)))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(channels):
+                        channels.discard(channel)
+                        subscribers.get(channel, set()).discard(writer)
+                        writer.write(b"*3\r\n$11\r\nunsubscribe\r\n$%d\r\n%s\r\n:%d\r\n" % (len(channel), channel, len(channels)))
+                elif name == b"PUBLISH":
+                    channel, data = command[1], command[2]
+                    receivers = subscribers.get(channel, set())
+                    frame = b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n" % (len(channel), channel, len(data), data)
+                    for receiver in receivers:
+                        receiver.write(frame)
+                    writer.write(b":%d\r\n" % len(receivers))
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in channels:
+                subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Pub/sub stand-in listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help="Run the Redis stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    if args.serve:
+        asyncio.run(serve_standin(args.host, args.port))
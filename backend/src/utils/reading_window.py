@@ -0,0 +1,112 @@
+from array import array
+import numpy as np
+
+# Buffers start this small and double until they reach the capacity of the window
+INITIAL_CAPACITY = 8
+
+
+def window_start(timestamps: list[float], readings: int = 0, seconds: float = 0):
+    """
+    Index of the first reading inside the window, in readings sorted by epoch seconds:
+    the last `readings` readings and/or those at most `seconds` older than the newest one.
+    """
+    start = max(0, len(timestamps) - readings) if readings else 0
+    if seconds and timestamps:
+        oldest = timestamps[-1] - seconds
+        while start < len(timestamps) and timestamps[start] < oldest:
+            start += 1
+    return start
+
+
+class ReadingWindow:
+    """
+    The newest readings of one sensor, as epoch seconds and values in two ring buffers of
+    doubles (array("d")), oldest first from `start`. Holds at most `capacity` readings and,
+    with `seconds`, none older than `seconds` before the newest one.
+
+    `seen` is the number of readings of the sensor folded in over its lifetime, compared to
+    sensor_statistics.count to notice readings written by another worker.
+    """
+    def __init__(self, capacity: int, seconds: float = 0):
+        self.capacity = capacity
+        self.seconds = seconds
+        self.timestamps = array("d", bytes(8 * min(capacity, INITIAL_CAPACITY)))
+        self.values = array("d", bytes(8 * min(capacity, INITIAL_CAPACITY)))
+        self.start = 0
+        self.size = 0
+        self.seen = 0
+
+    def ordered(self):
+        """Timestamps and values in the window as arrays, oldest first."""
+        timestamps = np.frombuffer(self.timestamps, dtype=np.float64)
+        values = np.frombuffer(self.values, dtype=np.float64)
+        end = self.start + self.size
+        if end <= len(self.timestamps):
+            return timestamps[self.start:end], values[self.start:end]
+        end -= len(self.timestamps)
+        return (
+            np.concatenate((timestamps[self.start:], timestamps[:end])),
+            np.concatenate((values[self.start:], values[:end])),
+        )
+
+    def _reset(self, timestamps, values, allocated: int = 0):
+        """Refill the buffers from ordered readings, keeping the newest that fit."""
+        timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+        allocated = min(self.capacity, max(allocated, len(self.timestamps), len(timestamps)))
+        padding = bytes(8 * (allocated - len(timestamps)))
+        self.timestamps = array("d", np.asarray(timestamps, dtype=np.float64).tobytes() + padding)
+        self.values = array("d", np.asarray(values, dtype=np.float64).tobytes() + padding)
+        self.start = 0
+        self.size = len(timestamps)
+
+    def fill(self, timestamps, values):
+        """Replace the readings with ordered ones, e.g. loaded from the database."""
+        self._reset(timestamps, values)
+        if self.size:
+            self._expire()
+
+    def add(self, timestamp: float, value: float):
+        """Add a reading; a late one is put in its place by time."""
+        if self.size and timestamp < self.newest():
+            timestamps, values = self.ordered()
+            position = int(np.searchsorted(timestamps, timestamp, side="right"))
+            self._reset(np.insert(timestamps, position, timestamp), np.insert(values, position, value))
+        else:
+            if self.size == len(self.timestamps):
+                if self.size < self.capacity:
+                    self._reset(*self.ordered(), allocated=2 * self.size)
+                else:
+                    # Full: the oldest reading makes room
+                    self.start = (self.start + 1) % len(self.timestamps)
+                    self.size -= 1
+            position = (self.start + self.size) % len(self.timestamps)
+            self.timestamps[position] = timestamp
+            self.values[position] = value
+            self.size += 1
+        self._expire()
+
+    def _expire(self):
+        if not self.seconds:
+            return
+        oldest = self.newest() - self.seconds
+        while self.size and self.timestamps[self.start] < oldest:
+            self.start = (self.start + 1) % len(self.timestamps)
+            self.size -= 1
+
+    def newest(self):
+        return self.timestamps[(self.start + self.size - 1) % len(self.timestamps)]
+
+    def statistics(self):
+        """
+        Count and sum of squared deviations of the values, and count, mean and sum of squared
+        deviations of the intervals in the window, as kept in sensor_statistics for the lifetime.
+        """
+        timestamps, values = self.ordered()
+        if not self.size:
+            return 0, 0.0, 0, 0.0, 0.0
+        value_m2 = float(((values - values.mean()) ** 2).sum())
+        intervals = np.diff(timestamps)
+        if not len(intervals):
+            return self.size, value_m2, 0, 0.0, 0.0
+        interval_mean = float(intervals.mean())
+        return self.size, value_m2, len(intervals), interval_mean, float(((intervals - interval_mean) ** 2).sum())
@@ -0,0 +1,216 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+from models.sensor_data import SensorData
+from models.sensor_latest import SensorLatest
+from models.sensor_reliability import SensorReliability
+
+# Columns shared by sensor_data and sensor_latest that make up a reading
+READING_COLUMNS = ("sensor_id", "name", "type", "location", "value", "unit", "timestamp", "status")
+
+
+def combine_sensor_data(reading, reliability):
+    """Build the dashboard entry of a sensor from its latest reading and its reliability."""
+    return {
+        "sensor_id": reading["sensor_id"],
+        "name": reading["name"],
+        "type": reading["type"].value,
+        "location": reading["location"],
+        "value": reading["value"],
+        "unit": reading["unit"],
+        "timestamp": reading["timestamp"].isoformat(),
+        "status": reading["status"].value,
+        "reliability_score": reliability.score if reliability else None,
+        "data_variance": reliability.variance if reliability else None,
+        "update_frequency": reliability.update_frequency if reliability else None,
+    }
+
+
+def latest_entry(latest: SensorLatest):
+    """Build the dashboard entry of a sensor from its sensor_latest row."""
+    return {
+        "sensor_id": latest.sensor_id,
+        "name": latest.name,
+        "type": latest.type.value,
+        "location": latest.location,
+        "value": latest.value,
+        "unit": latest.unit,
+        "timestamp": latest.timestamp.isoformat(),
+        "status": latest.status.value,
+        "reliability_score": latest.reliability_score,
+        "data_variance": latest.data_variance,
+        "update_frequency": latest.update_frequency,
+    }
+
+
+def summarize_sensors(entries: list[dict]):
+    """Dashboard summary of a subset of the sensors, in the shape of `SensorStateStore.summary()`."""
+    scores = [entry["reliability_score"] for entry in entries if entry["reliability_score"] is not None]
+    return {
+        "total_sensors": len(entries),
+        "online_sensors": sum(1 for entry in entries if entry["status"] == "online"),
+        "warning_sensors": sum(1 for entry in entries if entry["status"] in ["warning", "error"]),
+        "average_reliability": round(sum(scores) / len(scores), 2) if scores else 0.0,
+    }
+
+
+# Sensor fields the dashboard can be broken down by
+BREAKDOWN_DIMENSIONS = ("location", "type")
+
+
+class GroupCounters:
+    """Dashboard counters of the sensors sharing a location or a type."""
+    __slots__ = ("total_sensors", "online_sensors", "warning_sensors", "error_sensors", "reliability_total", "reliability_count")
+
+    def __init__(self):
+        self.total_sensors = 0
+        self.online_sensors = 0
+        self.warning_sensors = 0
+        self.error_sensors = 0
+        self.reliability_total = 0.0
+        self.reliability_count = 0
+
+    def count(self, entry: dict, sign: int):
+        self.total_sensors += sign
+        if entry["status"] == "online":
+            self.online_sensors += sign
+        elif entry["status"] in ["warning", "error"]:
+            self.warning_sensors += sign
+            if entry["status"] == "error":
+                self.error_sensors += sign
+        if entry["reliability_score"] is not None:
+            self.reliability_total += sign * entry["reliability_score"]
+            self.reliability_count += sign
+
+    def summary(self):
+        return {
+            "total_sensors": self.total_sensors,
+            "online_sensors": self.online_sensors,
+            "warning_sensors": self.warning_sensors,
+            "error_sensors": self.error_sensors,
+            "average_reliability": round(self.reliability_total / self.reliability_count, 2) if self.reliability_count else 0.0,
+        }
+
+
+class SensorStateStore:
+    """
+    Latest reading, status and reliability per sensor, keyed by sensor ID.
+    Dashboard counters, overall and per location and type, are maintained on every update so
+    the summary is answered in O(1) and a breakdown in O(groups).
+    """
+    def __init__(self):
+        self.sensors: dict[str, dict] = {}
+        self.online_sensors = 0
+        self.warning_sensors = 0
+        self.reliability_total = 0.0
+        self.reliability_count = 0
+        # Per dimension, the counters of every value it takes, e.g. groups["location"]["Room 1"]
+        self.groups: dict[str, dict[str, GroupCounters]] = {dimension: {} for dimension in BREAKDOWN_DIMENSIONS}
+        self.loaded = False
+        self._warm_lock = asyncio.Lock()
+
+    def _count(self, entry: dict, sign: int):
+        if entry["status"] == "online":
+            self.online_sensors += sign
+        elif entry["status"] in ["warning", "error"]:
+            self.warning_sensors += sign
+        if entry["reliability_score"] is not None:
+            self.reliability_total += sign * entry["reliability_score"]
+            self.reliability_count += sign
+
+        for dimension, groups in self.groups.items():
+            group = groups.get(entry[dimension])
+            if group is None:
+                group = groups[entry[dimension]] = GroupCounters()
+            group.count(entry, sign)
+            if not group.total_sensors:
+                del groups[entry[dimension]]
+
+    def update(self, entry: dict):
+        """Replace the state of a sensor and adjust the counters."""
+        previous = self.sensors.get(entry["sensor_id"])
+        if previous is not None:
+            self._count(previous, -1)
+        self.sensors[entry["sensor_id"]] = entry
+        self._count(entry, 1)
+
+    @property
+    def total_sensors(self):
+        return len(self.sensors)
+
+    @property
+    def average_reliability(self):
+        if not self.reliability_count:
+            return 0.0
+        return round(self.reliability_total / self.reliability_count, 2)
+
+    def summary(self):
+        """Dashboard summary of the latest state of every sensor."""
+        return {
+            "total_sensors": self.total_sensors,
+            "online_sensors": self.online_sensors,
+            "warning_sensors": self.warning_sensors,
+            "average_reliability": self.average_reliability,
+        }
+
+    def breakdown(self, dimension: str):
+        """Dashboard summary per location or type, ordered by group."""
+        return [
+            {dimension: value, **group.summary()}
+            for value, group in sorted(self.groups[dimension].items())
+        ]
+
+    async def warm(self, db: AsyncSession):
+        """Load the latest state of every sensor from sensor_latest with one streaming query."""
+        async with self._warm_lock:
+            if self.loaded:
+                return
+
+            result = await db.stream(select(SensorLatest))
+            async for latest in result.scalars():
+                self.update(latest_entry(latest))
+
+            if not self.sensors:
+                await self.backfill(db)
+
+            self.loaded = True
+
+    async def reload(self, db: AsyncSession):
+        """
+        Load sensor_latest again into a warm store, e.g. after changes were missed. Returns the
+        entries that differ from those held before.
+        """
+        changed = []
+        async with self._warm_lock:
+            result = await db.stream(select(SensorLatest))
+            async for latest in result.scalars():
+                entry = latest_entry(latest)
+                if self.sensors.get(entry["sensor_id"]) != entry:
+                    self.update(entry)
+                    changed.append(entry)
+        return changed
+
+    async def backfill(self, db: AsyncSession):
+        """Populate sensor_latest from the history of a database that predates it."""
+        # Latest reading per sensor (highest id) joined with its reliability
+        latest_ids = select(func.max(SensorData.id).label("id")).group_by(SensorData.sensor_id).subquery()
+        query = (
+            select(SensorData, SensorReliability)
+            .join(latest_ids, SensorData.id == latest_ids.c.id)
+            .outerjoin(SensorReliability, SensorReliability.sensor_id == SensorData.sensor_id)
+        )
+        result = await db.stream(query)
+        async for sensor, reliability in result:
+            reading = {column: getattr(sensor, column) for column in READING_COLUMNS}
+            db.add(SensorLatest(
+                **reading,
+                reliability_score=reliability.score if reliability else None,
+                data_variance=reliability.variance if reliability else None,
+                update_frequency=reliability.update_frequency if reliability else None,
+            ))
+            self.update(combine_sensor_data(reading, reliability))
+        await db.commit()
+
+
+sensor_state = SensorStateStore()
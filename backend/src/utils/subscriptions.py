@@ -0,0 +1,146 @@
+# Dashboard entry fields a client can filter on, with the plural key accepted in subscribe messages.
+# Subscriptions are indexed under the first of these fields they filter on (the most selective one).
+FILTER_FIELDS = {
+    "sensor_id": "sensor_ids",
+    "location": "locations",
+    "type": "types",
+    "status": "statuses",
+}
+
+
+def parse_subscription(message: dict):
+    """
+    Filters of a subscribe message, as {field: frozenset of accepted values}.
+    Each field takes a string or a list of strings, under its singular or plural key;
+    no filters at all means every sensor.
+    """
+    filters = {}
+    for field, plural in FILTER_FIELDS.items():
+        value = message.get(plural, message.get(field))
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else value
+        if not isinstance(values, list) or not all(isinstance(item, str) for item in values):
+            raise ValueError(f"'{plural}' must be a string or a list of strings")
+        filters[field] = frozenset(values)
+    return filters
+
+
+def parse_query_subscription(query_params):
+    """
+    Filters given as query parameters of the WebSocket URL, e.g. ?locations=Building%20A&types=temperature,
+    each repeatable, as `parse_subscription`.
+    """
+    message = {}
+    for field, plural in FILTER_FIELDS.items():
+        values = query_params.getlist(plural) + query_params.getlist(field)
+        if values:
+            message[plural] = values
+    return parse_subscription(message)
+
+
+def matches(filters: dict, entry: dict):
+    """Whether a dashboard entry passes every filter."""
+    return all(entry[field] in values for field, values in filters.items())
+
+
+def select_sensors(filters: dict, sensors: dict):
+    """Dashboard entries matching the filters; a sensor ID filter is answered by lookup."""
+    if not filters:
+        return list(sensors.values())
+    if "sensor_id" in filters:
+        candidates = (sensors[sensor_id] for sensor_id in filters["sensor_id"] if sensor_id in sensors)
+    else:
+        candidates = sensors.values()
+    return [entry for entry in candidates if matches(filters, entry)]
+
+
+class SubscriptionIndex:
+    """
+    Which clients want which sensors.
+
+    Clients without filters are kept apart in `everything`. A filtered client is indexed under
+    one value set of its most selective field, so finding the clients interested in a sensor
+    only visits clients indexed under that sensor's ID, location, type or status. The sensors
+    each filtered client was last sent are tracked too, so a sensor that stops matching a
+    client's filters (say, its status changed) can be routed to that client once more.
+    """
+    def __init__(self):
+        self.everything: set = set()
+        self.filters: dict = {}
+        self.index: dict[str, dict[str, set]] = {field: {} for field in FILTER_FIELDS}
+        self.holders: dict[str, set] = {}
+        self.views: dict = {}
+
+    def subscribe(self, client, filters: dict | None = None):
+        """Set the filters of a client, replacing any previous subscription."""
+        self.unsubscribe(client)
+        if not filters:
+            self.everything.add(client)
+            return
+
+        self.filters[client] = filters
+        self.views[client] = set()
+        field = next(field for field in FILTER_FIELDS if field in filters)
+        for value in filters[field]:
+            self.index[field].setdefault(value, set()).add(client)
+
+    def unsubscribe(self, client):
+        """Forget a client."""
+        self.everything.discard(client)
+        filters = self.filters.pop(client, None)
+        if not filters:
+            return
+
+        field = next(field for field in FILTER_FIELDS if field in filters)
+        for value in filters[field]:
+            clients = self.index[field].get(value)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self.index[field][value]
+        for sensor_id in self.views.pop(client):
+            self._release(client, sensor_id)
+
+    def hold(self, client, sensor_ids):
+        """Record that a filtered client was sent these sensors (e.g. in a snapshot)."""
+        view = self.views.get(client)
+        if view is None:
+            return
+        for sensor_id in sensor_ids:
+            view.add(sensor_id)
+            self.holders.setdefault(sensor_id, set()).add(client)
+
+    def _release(self, client, sensor_id):
+        clients = self.holders.get(sensor_id)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del self.holders[sensor_id]
+
+    def interested(self, entry: dict):
+        """Filtered clients whose filters match a dashboard entry (clients in `everything` excluded)."""
+        candidates = set()
+        for field in FILTER_FIELDS:
+            clients = self.index[field].get(entry[field])
+            if clients:
+                candidates |= clients
+        return {client for client in candidates if matches(self.filters[client], entry)}
+
+    def route(self, changed: list[dict]):
+        """
+        Changed sensors per filtered client, as {client: (entries, removed sensor IDs)}:
+        the changed sensors matching its filters, and those it was sent before that no longer do.
+        """
+        routes: dict = {}
+        for entry in changed:
+            sensor_id = entry["sensor_id"]
+            now = self.interested(entry)
+            for client in now:
+                routes.setdefault(client, ([], []))[0].append(entry)
+                self.hold(client, (sensor_id,))
+            for client in self.holders.get(sensor_id, set()) - now:
+                routes.setdefault(client, ([], []))[1].append(sensor_id)
+                self.views[client].discard(sensor_id)
+                self._release(client, sensor_id)
+        return routes
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# The backend imports its modules relative to src/, and db.py needs a database URL at import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'urban_monitor_test.db')}")
@@ -0,0 +1,118 @@
+"""
+The Redis bus against the stand-in server of utils.pubsub, run as it is for development:
+    python -m utils.pubsub --serve --port <port>
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import pytest
+
+from utils import pubsub
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StandIn:
+    """The stand-in server in a subprocess, which can be stopped and started again on its port."""
+    def __init__(self, port: int):
+        self.port = port
+        self.process: subprocess.Popen | None = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "utils.pubsub", "--serve", "--port", str(self.port)],
+            cwd=SOURCE_DIR, stdout=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    monkeypatch.setattr(pubsub, "PUBSUB_RECONNECT_INTERVAL", 0.1)
+    server = StandIn(free_port())
+    server.start()
+    yield server
+    server.stop()
+
+
+async def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def test_every_worker_receives_every_message_in_order(standin):
+    async def run():
+        workers = [pubsub.RedisBus(f"redis://127.0.0.1:{standin.port}") for _ in range(2)]
+        received = [[] for _ in workers]
+        for worker, messages in zip(workers, received):
+            async def handler(message, messages=messages):
+                messages.append(message)
+            worker.subscribe("sensor-changes", handler)
+            await worker.start()
+            assert worker.subscribed.is_set()
+
+        for index in range(10):
+            await workers[index % 2].publish("sensor-changes", [{"sensor_id": f"sensor_{index}"}])
+        await wait_for(lambda: all(len(messages) == 10 for messages in received))
+        for worker in workers:
+            await worker.stop()
+        return received
+
+    first, second = asyncio.run(run())
+    assert first == second == [[{"sensor_id": f"sensor_{index}"}] for index in range(10)]
+
+
+def test_reconnect_handlers_run_once_the_server_is_back(standin):
+    async def run():
+        bus = pubsub.RedisBus(f"redis://127.0.0.1:{standin.port}")
+        received, reconnects = [], []
+
+        async def handler(message):
+            received.append(message)
+
+        async def reconnected():
+            reconnects.append(bus.subscribed.is_set())
+
+        bus.subscribe("sensor-changes", handler)
+        bus.on_reconnect(reconnected)
+        await bus.start()
+        assert reconnects == []
+
+        standin.stop()
+        await wait_for(lambda: not bus.subscribed.is_set())
+        # Without the server the message is still delivered in this process
+        await bus.publish("sensor-changes", "while down")
+
+        standin.start()
+        await wait_for(lambda: reconnects)
+        await bus.publish("sensor-changes", "after")
+        await wait_for(lambda: len(received) == 2)
+        await bus.stop()
+        return received, reconnects
+
+    received, reconnects = asyncio.run(run())
+    assert received == ["while down", "after"]
+    assert reconnects == [True]
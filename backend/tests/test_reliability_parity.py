@@ -0,0 +1,78 @@
+"""
+The grouped array scoring of the recompute must give the scores of the scalar functions the
+ingest path was written against, whatever the order of the readings.
+"""
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pytest
+
+import routes  # noqa: F401  (imports the modules in the order the app does)
+from controllers.sensor_controller import (
+    calculate_reliability_score, calculate_update_frequency_score, calculate_variance,
+)
+from controllers.sensor_reliability_controller import score_readings
+from utils.reading_window import window_start
+
+EXPECTED_INTERVAL = 600
+FREQUENCY_WEIGHTS = (0.3, 0.3, 0.4)
+RELIABILITY_WEIGHTS = (0.5, 0.5)
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def random_history(seed: int, sensor_count: int = 40):
+    """Shuffled readings of sensors with no, one, few or many readings, some at the same second."""
+    rng = np.random.default_rng(seed)
+    codes, timestamps, values = [], [], []
+    for code in range(sensor_count):
+        readings = int(rng.choice([0, 1, 2, 5, 50, 300]))
+        start = int(rng.integers(0, 10 * 86400))
+        gaps = rng.choice([0, 1, 300, 600, 900, 7200], size=readings, p=[0.05, 0.05, 0.2, 0.4, 0.2, 0.1])
+        codes += [code] * readings
+        timestamps += list(start + np.cumsum(gaps))
+        values += list(rng.normal(float(rng.uniform(-20, 40)), float(rng.uniform(0, 5)), size=readings))
+    order = rng.permutation(len(codes))
+    return (
+        np.asarray(codes, dtype=np.int64)[order],
+        np.asarray(timestamps, dtype=np.float64)[order],
+        np.asarray(values, dtype=np.float64)[order],
+        sensor_count,
+    )
+
+
+def scalar_scores(codes, timestamps, values, code, window_readings, window_seconds):
+    readings = sorted(
+        ((timestamp, value) for reading_code, timestamp, value in zip(codes, timestamps, values) if reading_code == code),
+        key=lambda reading: reading[0],
+    )
+    readings = readings[window_start([timestamp for timestamp, _ in readings], window_readings, window_seconds):]
+    variance = calculate_variance([value for _, value in readings])
+    update_frequency = calculate_update_frequency_score(
+        [EPOCH + timedelta(seconds=timestamp) for timestamp, _ in readings], EXPECTED_INTERVAL, FREQUENCY_WEIGHTS
+    )
+    score = calculate_reliability_score(1 - (variance / max(variance, 1)), update_frequency, RELIABILITY_WEIGHTS)
+    return variance, update_frequency, score
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("window_readings, window_seconds", [(0, 0), (1, 0), (10, 0), (0, 3600), (20, 6 * 3600)])
+def test_score_readings_matches_scalar_functions(seed, window_readings, window_seconds):
+    codes, timestamps, values, sensor_count = random_history(seed)
+    scored = score_readings(
+        codes, timestamps, values, sensor_count, EXPECTED_INTERVAL, FREQUENCY_WEIGHTS, RELIABILITY_WEIGHTS,
+        window_readings, window_seconds,
+    )
+    for code in range(sensor_count):
+        variance, update_frequency, score = scalar_scores(codes, timestamps, values, code, window_readings, window_seconds)
+        assert scored["variance"][code] == pytest.approx(variance, rel=1e-9, abs=1e-9)
+        assert scored["update_frequency"][code] == pytest.approx(update_frequency, abs=1e-9)
+        assert scored["score"][code] == pytest.approx(score, abs=1e-9)
+
+
+def test_score_readings_ignores_arrival_order():
+    codes, timestamps, values, sensor_count = random_history(7)
+    parameters = (sensor_count, EXPECTED_INTERVAL, FREQUENCY_WEIGHTS, RELIABILITY_WEIGHTS)
+    scored = score_readings(codes, timestamps, values, *parameters)
+    order = np.random.default_rng(8).permutation(len(codes))
+    reordered = score_readings(codes[order], timestamps[order], values[order], *parameters)
+    for key in ("count", "variance", "update_frequency", "score"):
+        np.testing.assert_allclose(reordered[key], scored[key], rtol=1e-9, atol=1e-9)
@@ -1,5 +1,5 @@
 // hooks/useSensorDashboard.ts
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 
 interface DashboardSummary {
   total_sensors: number;
@@ -22,36 +22,116 @@ interface SensorData {
   update_frequency: number | null;
 }
 
+// A snapshot carries the full state, a delta only the changed sensors and summary fields.
+// Deltas of a filtered subscription also list sensors that no longer match under `removed`.
+// `epoch` (on snapshots and resumes) identifies the server process numbering the versions.
 interface DashboardMessage {
-  dashboard: DashboardSummary;
+  type: 'snapshot' | 'delta';
+  version: number;
+  epoch?: string;
+  dashboard: Partial<DashboardSummary>;
   sensors: SensorData[];
+  removed?: string[];
 }
 
-export const useSensorDashboard = () => {
+// Only the sensors matching every given filter are sent
+export interface SensorFilters {
+  sensor_ids?: string[];
+  locations?: string[];
+  types?: string[];
+  statuses?: string[];
+}
+
+const DASHBOARD_SOCKET_URL = 'ws://khrk0p6k-8000.inc1.devtunnels.ms/ws/sensor-dashboard';
+
+// Delay before reconnecting after the connection drops (in milliseconds), doubled up to the maximum.
+// Each wait is randomized between half and all of it, so dashboards dropped together by a
+// restart don't reconnect (and ask for snapshots) in lockstep.
+const RECONNECT_DELAY = 500;
+const MAX_RECONNECT_DELAY = 10000;
+
+export const useSensorDashboard = (filters?: SensorFilters) => {
   const [dashboard, setDashboard] = useState<DashboardSummary | null>(null);
   const [sensors, setSensors] = useState<SensorData[]>([]);
+  // Last version applied and its epoch, to resume with only the missed changes after a reconnect
+  const position = useRef<{ version: number; epoch: string } | null>(null);
 
   useEffect(() => {
-    const socket = new WebSocket('ws://khrk0p6k-8000.inc1.devtunnels.ms/ws/sensor-dashboard');
+    let socket: WebSocket;
+    let reconnectTimer: ReturnType<typeof setTimeout> | undefined;
+    let delay = RECONNECT_DELAY;
+    let closed = false;
+    // New filters start from a fresh snapshot
+    position.current = null;
+
+    const connect = () => {
+      // Filters go in the URL, so the first message is already the filtered snapshot;
+      // a filtered connection always starts from one, so only unfiltered ones resume
+      const params = new URLSearchParams();
+      Object.entries(filters ?? {}).forEach(([key, values]) => {
+        (values ?? []).forEach((value: string) => params.append(key, value));
+      });
+      if (position.current && !params.toString()) {
+        params.set('since', String(position.current.version));
+        params.set('epoch', position.current.epoch);
+      }
+      const query = params.toString();
+      socket = new WebSocket(DASHBOARD_SOCKET_URL + (query ? `?${query}` : ''));
 
-    socket.onmessage = (event) => {
+      socket.onopen = () => {
+        delay = RECONNECT_DELAY;
+      };
+
+      socket.onmessage = onMessage;
+
+      socket.onerror = (error) => {
+        console.error('WebSocket error:', error);
+      };
+
+      socket.onclose = () => {
+        if (!closed) {
+          reconnectTimer = setTimeout(connect, delay * (0.5 + Math.random() / 2));
+          delay = Math.min(delay * 2, MAX_RECONNECT_DELAY);
+        }
+      };
+    };
+
+    const onMessage = (event: MessageEvent) => {
       try {
         const data: DashboardMessage = JSON.parse(event.data);
-        setDashboard(data.dashboard);
-        setSensors(data.sensors);
+        if (data.epoch) {
+          position.current = { version: data.version, epoch: data.epoch };
+        } else if (position.current) {
+          position.current.version = data.version;
+        }
+        if (data.type === 'delta') {
+          setDashboard((current) => ({ ...current, ...data.dashboard }) as DashboardSummary);
+          setSensors((current) => {
+            const changed = new Map(data.sensors.map((sensor) => [sensor.sensor_id, sensor]));
+            const removed = new Set(data.removed ?? []);
+            const merged = current
+              .filter((sensor) => !removed.has(sensor.sensor_id))
+              .map((sensor) => changed.get(sensor.sensor_id) ?? sensor);
+            const known = new Set(current.map((sensor) => sensor.sensor_id));
+            return merged.concat(data.sensors.filter((sensor) => !known.has(sensor.sensor_id)));
+          });
+        } else {
+          setDashboard(data.dashboard as DashboardSummary);
+          setSensors(data.sensors);
+        }
       } catch (err) {
         console.error('Invalid WebSocket message:', err);
       }
     };
 
-    socket.onerror = (error) => {
-      console.error('WebSocket error:', error);
-    };
+    connect();
 
     return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
       socket.close();
     };
-  }, []);
+  }, [JSON.stringify(filters)]); // reconnect with the new subscription when the filters change
 
   return { dashboard, sensors };
 };